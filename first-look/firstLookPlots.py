@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -------------------------------------- #
+# python version of firstLookPlots.cpp: same histograms and kinematic cuts,
+# filled with numpy reading the dimu trees in batches, from one or more files
+# -------------------------------------- #
+
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# custom library
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from dimuVars import (JPSI_WINDOW, first_look_binning, first_look_histos, histo_branches,
+                      iterate_dimu, window_integral, write_histos)
+
+# samples of firstLookPlots.cpp: dataType -> (file, output file, lowPt, upPt)
+SAMPLES = {
+  'OO_coh': ('../data/train-442464/data-OO-tree.root', 'fl-442464.root', 0., 0.25),
+  'OO_full_pt': ('../data/train-442464/data-OO-full-pt-tree.root', 'fl-442464-full-pt.root', 0., 1.),
+  'OO_coh_wide_mass': ('../data/train-442464/data-OO-full-pt-tree.root', 'fl-442464-wide-mass.root', 0., 0.25),
+  'OO_full_cpass0_coh': ('../data/train-447456/merged-trees.root', 'fl-447456-wide-mass.root', 0., 0.25),
+  'OO_apass1_coh': ('../data/train-455531/data-OO-full-pt-tree.root', 'fl-455531-wide-mass.root', 0., 0.25),
+}
+
+
+def fill_file(file_path, cuts, binning, batch_size):
+  """
+  Fill the histograms with the candidates of one file that pass the kinematic cuts,
+  reading at most batch_size entries at a time. Returns (histograms, number of entries read).
+  """
+  histos = None
+  n_read = 0
+  branches = sorted(set(histo_branches(binning)) | set(cuts))
+  for arrays in iterate_dimu(file_path, branches, step_size=batch_size):
+    mask = np.ones(len(arrays[branches[0]]), dtype=bool)
+    for branch, (low, up) in cuts.items():
+      mask &= (arrays[branch] >= low) & (arrays[branch] <= up)
+    batch = first_look_histos(arrays, mask, binning)
+    histos = batch if histos is None else {name: histos[name] + batch[name] for name in histos}
+    n_read += len(mask)
+  return histos, n_read
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Fill the first look histograms (mass, pt, phi, rapidity, pt vs mass) of the dimu trees, as firstLookPlots.cpp"
+  )
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument('-d', '--data-type', choices=sorted(SAMPLES), help='One of the samples of firstLookPlots.cpp')
+  group.add_argument('-f', '--files', nargs='+', help='ROOT files with the dimu trees')
+  group.add_argument('-l', '--file-list', help='Text file with one ROOT file per line')
+  group.add_argument('-j', '--jobs-dir', help='Jobs directory of run-task.py: all its dimu-job-N.root files are used')
+  parser.add_argument('-o', '--output', default=None, help='Output ROOT file (default: the one of the sample, or fl.root)')
+  parser.add_argument('--low-pt', type=float, default=None, help='Lower pt cut (default: 0, or the one of the sample)')
+  parser.add_argument('--up-pt', type=float, default=None, help='Upper pt cut (default: 2, or the one of the sample)')
+  parser.add_argument('--batch-size', type=int, default=100000, help='Entries read at a time from each tree (default: 100000)')
+  parser.add_argument('--workers', type=int, default=1, help='Number of files processed at the same time (default: 1)')
+  args = parser.parse_args()
+
+  # inputs and cuts: as in the macro for the samples
+  low_pt, up_pt, output = 0., 2., 'fl.root'
+  if args.data_type:
+    file_path, output, low_pt, up_pt = SAMPLES[args.data_type]
+    files = [file_path]
+  elif args.files:
+    files = args.files
+  elif args.file_list:
+    with open(args.file_list, 'r') as f:
+      files = [os.path.expanduser(line.strip()) for line in f if line.strip()]
+  else:
+    files = sorted(glob.glob(os.path.join(args.jobs_dir, 'dimu-job-*.root')),
+                   key=lambda p: int(p.rsplit('-', 1)[1].split('.')[0]))
+  if args.low_pt is not None:
+    low_pt = args.low_pt
+  if args.up_pt is not None:
+    up_pt = args.up_pt
+  if args.output:
+    output = args.output
+
+  if not files:
+    print('No input file. Bye!')
+    sys.exit(1)
+  for file_path in files:
+    if not os.path.isfile(file_path):
+      print(f'The file {file_path} does not exist.')
+      sys.exit(1)
+
+  # kinematic cuts and histograms of the macro
+  binning = first_look_binning(lowPt=low_pt, upPt=up_pt)
+  cuts = {'fPt': (low_pt, up_pt), 'fM': (binning['hMass'][2], binning['hMass'][3]), 'fRap': (binning['hRapidity'][2], binning['hRapidity'][3])}
+
+  # fill the histos: one file per task, partial histograms summed at the end
+  histos = None
+  n_read = 0
+  with ProcessPoolExecutor(max_workers=args.workers) as pool:
+    futures = [pool.submit(fill_file, f, cuts, binning, args.batch_size) for f in files]
+    for file_path, future in zip(files, futures):
+      part, n = future.result()
+      n_read += n
+      if part is None:
+        print(f'Warning: no dimu tree in {file_path}.')
+        continue
+      histos = part if histos is None else {name: histos[name] + part[name] for name in histos}
+  if histos is None:
+    print('No dimu tree found. Bye!')
+    sys.exit(1)
+
+  # number of candidates
+  _, bins, low, up = binning['hMass']
+  in_range = window_integral(histos['hMass'], bins, low, up, *JPSI_WINDOW)
+  print(f'entries read = {n_read}, selected = {int(histos["hMass"].sum())}')
+  print(f'n. candidates in ({JPSI_WINDOW[0]}, {JPSI_WINDOW[1]}) = {in_range:g}')
+
+  # save the results
+  write_histos(output, histos, binning)
+  print(f'Histograms saved in {output}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,128 @@
+# index of the AO2D input files: for each file its size, mtime, number of entries of every table,
+# number of events and run numbers. The files are read once, and the index (a JSON file) is updated
+# only for the files that are new or changed, so that the inputs can be selected by run without reading them
+
+import os
+import re
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import uproot
+
+from dimuVars import source_stamp
+
+INDEX = 'aod-index.json'
+# version of the metadata of a file: the entries written by an older version are read again
+INDEX_VERSION = 2
+
+# tables whose entries are the events, in order of preference (one per DF): the UD collisions of the UPC
+# candidate producer, or the collisions. Only the base tables, not their extensions (O2udcollisionsel_001, ...)
+EVENT_TABLES = ('O2udcollision', 'O2collision')
+# tables where the run number is read from, in order of preference
+RUN_TABLES = EVENT_TABLES + ('O2bc',)
+
+
+def table_name(tree_path):
+  """Name of an AO2D table from the path of its tree (DF_N/O2table_001 -> O2table_001)."""
+  return tree_path.split('/')[-1]
+
+
+def base_table(name):
+  """Name of a table without its version (O2udcollision_001 -> O2udcollision)."""
+  return re.sub(r'_\d+$', '', name)
+
+
+def first_table(paths, names):
+  """Path of the first of the tables names (base names, in order of preference) among the tree paths of a DF, None if none is there."""
+  for name in names:
+    for path in sorted(paths):
+      if base_table(table_name(path)) == name:
+        return path
+  return None
+
+
+def scan_aod(file_path):
+  """Read the metadata of one AO2D file: size, mtime, entries per table, events and runs."""
+  entry = dict(source_stamp(file_path), version=INDEX_VERSION)
+  entries = {}
+  events = 0
+  runs = set()
+  with uproot.open(file_path) as f:
+    trees = {}
+    for key, class_name in f.classnames().items():
+      path = key.split(';')[0]
+      if class_name == 'TTree':
+        trees.setdefault(path.split('/')[0], set()).add(path)
+    for df, paths in sorted(trees.items()):
+      for path in sorted(paths):
+        entries[table_name(path)] = entries.get(table_name(path), 0) + f[path].num_entries
+      event_table = first_table(paths, EVENT_TABLES)
+      if event_table:
+        events += f[event_table].num_entries
+      # run numbers of this DF from the first table that has them
+      run_table = first_table([p for p in paths if 'fRunNumber' in f[p].keys()], RUN_TABLES)
+      if run_table:
+        runs.update(np.unique(f[run_table]['fRunNumber'].array(library='np')).tolist())
+  entry['entries'] = entries
+  entry['events'] = events
+  entry['runs'] = sorted(runs)
+  return entry
+
+
+def load_index(index_path):
+  """Files of the index: absolute path -> metadata."""
+  try:
+    with open(index_path, 'r') as f:
+      return json.load(f).get('files', {})
+  except (OSError, ValueError):
+    return {}
+
+
+def save_index(index_path, files):
+  with open(index_path + '.tmp', 'w') as f:
+    json.dump({'files': files}, f, indent=1, sort_keys=True)
+  os.replace(index_path + '.tmp', index_path)
+
+
+def is_entry_current(entry, file_path):
+  """True if the metadata in the index were read from the current version of the file."""
+  try:
+    stamp = source_stamp(file_path)
+  except OSError:
+    return False
+  return (entry is not None and entry.get('version') == INDEX_VERSION
+          and entry.get('size') == stamp['size'] and entry.get('mtime_ns') == stamp['mtime_ns'])
+
+
+def update_index(paths, index_path, workers=1):
+  """
+  Return the metadata of the files (absolute paths), reading only the ones that are not in the index
+  or changed since they were indexed, up to workers files at the same time; the index is saved.
+  Files that cannot be read are reported and left out.
+  """
+  files = load_index(index_path)
+  todo = sorted({p for p in paths if not is_entry_current(files.get(p), p)})
+  if todo:
+    print(f'Indexing {len(todo)} file(s) ({len(paths) - len(todo)} already in {index_path})')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = {path: pool.submit(scan_aod, path) for path in todo}
+      for n, (path, future) in enumerate(futures.items(), 1):
+        try:
+          files[path] = future.result()
+        except (OSError, ValueError, KeyError) as e:
+          print(f'Warning: cannot index {path}: {e}')
+          files.pop(path, None)
+          continue
+        if n % 100 == 0:
+          save_index(index_path, files)
+    save_index(index_path, files)
+  return {p: files[p] for p in paths if p in files}
+
+
+def parse_runs(spec):
+  """Run numbers from a comma separated list (564356,564359) or from a file with runs separated by spaces, commas or new lines."""
+  if os.path.isfile(spec):
+    with open(spec, 'r') as f:
+      spec = f.read()
+  return {int(run) for run in spec.replace(',', ' ').split()}
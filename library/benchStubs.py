@@ -0,0 +1,113 @@
+# stand-ins of the O2 executables used by scripts/run-task.py (the analysis task, hadd and o2-aod-merger),
+# to measure the time spent by the scripts outside the analysis itself (bench-orchestration.py).
+# They read the same arguments as the real ones and write fake ROOT files where the real ones write their outputs;
+# their runtime, memory and output size are set with the BENCH_* environment variables (see STUB_ENV)
+
+import os
+import sys
+import time
+
+# environment variables read by the stubs, with their default
+STUB_ENV = {
+  'BENCH_TASK_SECONDS': 0.,           # fixed runtime of a run of the analysis
+  'BENCH_TASK_SECONDS_PER_FILE': 0.,  # runtime added for each input file
+  'BENCH_TASK_MEM_MB': 0.,            # memory allocated (and touched) by the analysis
+  'BENCH_TASK_READ': 0,               # 1: read the input files, 0: only stat them
+  'BENCH_TASK_OUT_KB': 4.,            # size of AnalysisResults.root and of dimu.root
+  'BENCH_MERGE_SECONDS': 0.,          # runtime of hadd and o2-aod-merger
+  'BENCH_MERGE_MEM_MB': 0.,           # memory allocated by hadd and o2-aod-merger
+}
+
+# name of the executable -> function of this module
+STUBS = {
+  'o2-analysis-ud-fwd-muons-upc': 'analysis',
+  'hadd': 'hadd',
+  'o2-aod-merger': 'aod_merger',
+}
+
+
+def env(name):
+  return type(STUB_ENV[name])(os.environ.get(name, STUB_ENV[name]))
+
+
+def hold_memory(mb):
+  """Allocate mb MB and write one byte per page, so that they count in the RSS."""
+  buf = bytearray(int(mb * 1024**2))
+  for pos in range(0, len(buf), 4096):
+    buf[pos] = 1
+  return buf
+
+
+def write_fake(path, size):
+  with open(path, 'wb') as f:
+    f.write(b'\0' * int(size))
+
+
+def option(argv, name):
+  return argv[argv.index(name) + 1] if name in argv else None
+
+
+def analysis(argv):
+  """o2-analysis-* --configuration json://<config> | --aod-file <file>: reads the input list of the config."""
+  import json
+  config = option(argv, '--configuration')
+  if config:
+    with open(config[len('json://'):], 'r') as f:
+      aod = json.load(f)['internal-dpl-aod-reader']['aod-file-private']
+  else:
+    aod = option(argv, '--aod-file')
+  if aod.startswith('@'):
+    with open(aod[1:], 'r') as f:
+      inputs = [line.strip() for line in f if line.strip()]
+  else:
+    inputs = [aod]
+  buf = hold_memory(env('BENCH_TASK_MEM_MB'))
+  for path in inputs:
+    if env('BENCH_TASK_READ'):
+      with open(path, 'rb') as f:
+        while f.read(1 << 20):
+          pass
+    else:
+      os.stat(path)
+  time.sleep(env('BENCH_TASK_SECONDS') + env('BENCH_TASK_SECONDS_PER_FILE') * len(inputs))
+  del buf
+  for name in ('AnalysisResults.root', 'dimu.root'):
+    write_fake(name, env('BENCH_TASK_OUT_KB') * 1024)
+  return 0
+
+
+def merge(inputs, output):
+  buf = hold_memory(env('BENCH_MERGE_MEM_MB'))
+  size = sum(os.path.getsize(p) for p in inputs if os.path.isfile(p))
+  time.sleep(env('BENCH_MERGE_SECONDS'))
+  del buf
+  write_fake(output, size)
+  return 0
+
+
+def hadd(argv):
+  """hadd [-f] <output> <inputs...>"""
+  args = [a for a in argv if a != '-f']
+  return merge(args[1:], args[0])
+
+
+def aod_merger(argv):
+  """o2-aod-merger --input <list> --output <file> [--max-size N]"""
+  with open(option(argv, '--input'), 'r') as f:
+    inputs = [line.strip() for line in f if line.strip()]
+  return merge(inputs, option(argv, '--output'))
+
+
+def write_stubs(bin_dir):
+  """Write the stub executables in bin_dir (to be put first in the PATH), run with this python."""
+  os.makedirs(bin_dir, exist_ok=True)
+  library_dir = os.path.dirname(os.path.realpath(__file__))
+  for exe, function in STUBS.items():
+    path = os.path.join(bin_dir, exe)
+    with open(path, 'w') as f:
+      f.write(f'#!{sys.executable}\n'
+              f'import sys\n'
+              f'sys.path.insert(0, {library_dir!r})\n'
+              f'import benchStubs\n'
+              f'sys.exit(benchStubs.{function}(sys.argv[1:]))\n')
+    os.chmod(path, 0o755)
@@ -0,0 +1,219 @@
+# variables saved in data and MC trees: python counterpart of dimuVars.h
+# the trees are read with uproot into numpy arrays, one array per branch
+
+import os
+import json
+import shutil
+import numpy as np
+import uproot
+
+# DATA ------------------------------------------------------------
+
+# branches of the data tree (same as createDataTree in dimuVars.h)
+DATA_BRANCHES = [
+  'fRunNumber', 'fM', 'fPt', 'fRap', 'fPhi',
+  'fPtp', 'fEtap', 'fPhip', 'fTrackTypep',
+  'fPtn', 'fEtan', 'fPhin', 'fTrackTypen',
+  'fNclass',
+]
+
+# MC --------------------------------------------------------------
+
+# branches of the MC trees, as read by fitJPsi.cpp
+RECO_BRANCHES = ['fM', 'fPt', 'fRap']
+GEN_BRANCHES = ['fGenM', 'fGenPt', 'fGenRap']
+
+# expected branches for each type of tree
+LAYOUTS = {'data': DATA_BRANCHES, 'reco': RECO_BRANCHES, 'gen': GEN_BRANCHES}
+
+# mass window used to count the J/psi candidates
+JPSI_WINDOW = (2.9, 3.3)
+
+
+def first_look_binning(lowPt=0., upPt=2., lowMass=2., upMass=4.5, lowRap=-4., upRap=-2.5, nBins=30):
+  """
+  Binning of the histograms of firstLookPlots.cpp, that follows the kinematic cuts (defaults as in the macro):
+  name -> (branch, bins, low, up) for 1D, (x branch, bins, low, up, y branch, bins, low, up) for 2D.
+  """
+  return {
+    'hMass': ('fM', nBins, lowMass, upMass),
+    'hPt': ('fPt', nBins, lowPt, upPt),
+    'hPhi': ('fPhi', nBins, -np.pi, np.pi),
+    'hRapidity': ('fRap', nBins, lowRap, upRap),
+    # pt vs mass
+    'hMassPt': ('fM', nBins//3, lowMass, upMass, 'fPt', nBins//2, lowPt, upPt),
+  }
+
+FIRST_LOOK_HISTOS = first_look_binning()
+
+
+def tree_paths(root_file, tree_name='dimu'):
+  """Return the paths of all the trees called tree_name in an open uproot file (one per DF directory in merged files)."""
+  paths = set()
+  for key, class_name in root_file.classnames().items():
+    path = key.split(';')[0]
+    if class_name == 'TTree' and path.split('/')[-1] == tree_name:
+      paths.add(path)
+  return sorted(paths)
+
+
+def read_dimu(file_path, branches, tree_name='dimu'):
+  """Read the branches of all the dimu trees of a file, concatenated in one numpy array per branch."""
+  parts = {b: [] for b in branches}
+  with uproot.open(file_path) as f:
+    for path in tree_paths(f, tree_name):
+      arrays = f[path].arrays(branches, library='np')
+      for b in branches:
+        parts[b].append(arrays[b])
+  return {b: np.concatenate(parts[b]) if parts[b] else np.empty(0) for b in branches}
+
+
+def iterate_dimu(file_path, branches, step_size=100000, tree_name='dimu'):
+  """Read the branches of all the dimu trees of a file in batches of at most step_size entries (dict of numpy arrays)."""
+  with uproot.open(file_path) as f:
+    for path in tree_paths(f, tree_name):
+      for arrays in f[path].iterate(branches, step_size=step_size, library='np'):
+        yield arrays
+
+
+def hist1d(values, bins, low, up, weights=None):
+  """Bin contents of a histogram with uniform bins, filled as TH1::Fill does (under/overflow dropped, up excluded)."""
+  idx = np.floor((np.asarray(values, dtype=np.float64) - low) * (bins / (up - low)))
+  inside = (idx >= 0) & (idx < bins)
+  w = None if weights is None else np.asarray(weights)[inside]
+  return np.bincount(idx[inside].astype(np.int64), weights=w, minlength=bins).astype(np.float64)
+
+
+def hist2d(xvalues, xbins, xlow, xup, yvalues, ybins, ylow, yup):
+  """Bin contents (x bins, y bins) of a 2D histogram with uniform bins, filled as TH2::Fill does."""
+  ix = np.floor((np.asarray(xvalues, dtype=np.float64) - xlow) * (xbins / (xup - xlow)))
+  iy = np.floor((np.asarray(yvalues, dtype=np.float64) - ylow) * (ybins / (yup - ylow)))
+  inside = (ix >= 0) & (ix < xbins) & (iy >= 0) & (iy < ybins)
+  flat = ix[inside].astype(np.int64) * ybins + iy[inside].astype(np.int64)
+  return np.bincount(flat, minlength=xbins*ybins).astype(np.float64).reshape(xbins, ybins)
+
+
+def histo_branches(binning):
+  """Branches needed to fill the histograms of a binning."""
+  branches = set()
+  for spec in binning.values():
+    branches.add(spec[0])
+    if len(spec) == 8:
+      branches.add(spec[4])
+  return sorted(branches)
+
+
+def first_look_histos(arrays, mask=None, binning=FIRST_LOOK_HISTOS):
+  """Fill the histograms of firstLookPlots.cpp from the arrays (only the entries selected by mask, if given)."""
+  sel = (lambda a: a) if mask is None else (lambda a: a[mask])
+  histos = {}
+  for name, spec in binning.items():
+    if len(spec) == 4:
+      branch, bins, low, up = spec
+      histos[name] = hist1d(sel(arrays[branch]), bins, low, up)
+    else:
+      xb, xbins, xlow, xup, yb, ybins, ylow, yup = spec
+      histos[name] = hist2d(sel(arrays[xb]), xbins, xlow, xup, sel(arrays[yb]), ybins, ylow, yup)
+  return histos
+
+
+def window_integral(counts, bins, low, up, a, b):
+  """Integral of a 1D histogram from the bin of a to the bin of b (both included), as TH1::Integral(FindBin(a), FindBin(b))."""
+  width = (up - low) / bins
+  first = max(int(np.floor((a - low) / width)), 0)
+  last = min(int(np.floor((b - low) / width)), bins - 1)
+  return float(counts[first:last+1].sum())
+
+
+def write_histos(file_path, histos, binning=FIRST_LOOK_HISTOS):
+  """Write the histograms (bin contents from first_look_histos) in a ROOT file, with their binning."""
+  with uproot.recreate(file_path) as f:
+    for name, counts in histos.items():
+      spec = binning[name]
+      if len(spec) == 4:
+        _, bins, low, up = spec
+        f[name] = (counts, np.linspace(low, up, bins + 1))
+      else:
+        _, xbins, xlow, xup, _, ybins, ylow, yup = spec
+        f[name] = (counts, np.linspace(xlow, xup, xbins + 1), np.linspace(ylow, yup, ybins + 1))
+
+
+# COLUMNAR CACHE ---------------------------------------------------
+# one .npy file per branch, with all the DF directories concatenated, plus a meta.json
+# that stores size and mtime of the source and the name of the trees: the cache is rebuilt if the source changes
+
+CACHE_SUFFIX = '.npcache'
+
+
+def cache_path(file_path, cache_dir=None, tree_name='dimu'):
+  """Directory of the cache of the trees tree_name of a ROOT file: next to the file, or in cache_dir if given."""
+  name = os.path.basename(file_path) + ('' if tree_name == 'dimu' else f'.{tree_name}') + CACHE_SUFFIX
+  return os.path.join(cache_dir, name) if cache_dir else os.path.join(os.path.dirname(os.path.abspath(file_path)), name)
+
+
+def source_stamp(file_path):
+  """Size and modification time of the source file, used to invalidate the cache."""
+  st = os.stat(file_path)
+  return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def is_cache_valid(file_path, path, tree_name='dimu'):
+  """True if the cache in path exists and was built from the trees tree_name of the current version of file_path."""
+  try:
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return False
+  # caches written before the tree name was stored are of the dimu trees
+  return meta.get('source_stamp') == source_stamp(file_path) and meta.get('tree_name', 'dimu') == tree_name
+
+
+def build_cache(file_path, path, tree_name='dimu'):
+  """
+  Convert all the dimu trees of a file into one .npy file per branch in path.
+  The branches are converted one at a time, and the cache is written in a temporary directory
+  that replaces the old one only at the end.
+  """
+  stamp = source_stamp(file_path)
+  tmp_path = path + '.tmp'
+  shutil.rmtree(tmp_path, ignore_errors=True)
+  os.makedirs(tmp_path)
+  with uproot.open(file_path) as f:
+    paths = tree_paths(f, tree_name)
+    branches = list(f[paths[0]].keys()) if paths else []
+    dtypes = {}
+    entries = 0
+    for b in branches:
+      column = np.concatenate([f[p][b].array(library='np') for p in paths])
+      np.save(os.path.join(tmp_path, f'{b}.npy'), column)
+      dtypes[b] = str(column.dtype)
+      entries = len(column)
+  meta = {
+    'source': os.path.abspath(file_path),
+    'source_stamp': stamp,
+    'tree_name': tree_name,
+    'trees': paths,
+    'branches': dtypes,
+    'entries': entries,
+  }
+  with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+    json.dump(meta, f, indent=2)
+  shutil.rmtree(path, ignore_errors=True)
+  os.replace(tmp_path, path)
+  return meta
+
+
+def open_cache(file_path, branches=None, cache_dir=None, tree_name='dimu'):
+  """
+  Return the branches (all of them if None) of the dimu trees of a file as memory-mapped numpy arrays,
+  (re)building the cache first if it is missing or older than the file.
+  """
+  path = cache_path(file_path, cache_dir, tree_name)
+  if not is_cache_valid(file_path, path, tree_name):
+    build_cache(file_path, path, tree_name)
+  with open(os.path.join(path, 'meta.json'), 'r') as f:
+    available = json.load(f)['branches']
+  missing = [b for b in (branches or []) if b not in available]
+  if missing:
+    raise KeyError(f"branches {', '.join(missing)} not in the trees of {file_path}")
+  return {b: np.load(os.path.join(path, f'{b}.npy'), mmap_mode='r') for b in (branches or available)}
@@ -0,0 +1,194 @@
+# download of the outputs of HY trains: each hy job has one sub-directory per output file (AOD/NNN/),
+# and every file is a separate transfer. The transfers run in a pool of threads with retries, and the
+# completed ones are recorded in a manifest in the output directory, so that an interrupted download resumes
+
+import os
+import re
+import json
+import time
+import shlex
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# path of a hy job in a line: a job URL, or an alien_cp line of the download-*.sh scripts
+HY_JOB = re.compile(r'(\S*(hy_\d+))')
+
+MANIFEST = 'download-manifest.json'
+
+
+def parse_jobs(lines):
+  """Return the (hy id, job path) of the lines that contain a hy job, in order and without duplicates."""
+  jobs = []
+  seen = set()
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith('#'):
+      continue
+    match = HY_JOB.search(line)
+    if match is None or match.group(2) in seen:
+      continue
+    seen.add(match.group(2))
+    jobs.append((match.group(2), match.group(1)))
+  return jobs
+
+
+# TRANSFER COMMANDS ----------------------------------------------------
+# a transfer is a pair of functions: list(job path) -> names of the AOD sub-directories,
+# copy(source, destination) that raises an error if the file was not copied
+
+def alien_list(job_path):
+  """Sub-directories of the AOD directory of a job on the grid."""
+  res = subprocess.run(['alien_ls', f'{job_path}/AOD/'], capture_output=True, text=True)
+  if res.returncode != 0:
+    raise RuntimeError(f'alien_ls failed on {job_path}: {res.stderr.strip()}')
+  return sorted(name.strip().rstrip('/') for name in res.stdout.split() if name.strip())
+
+
+def command_copy(template):
+  """Copy function that runs a command, with {src} and {dst} replaced by the source and the destination."""
+  def copy(src, dst):
+    cmd = [arg.format(src=src, dst=dst) for arg in shlex.split(template)]
+    res = subprocess.run(cmd, capture_output=True, text=True)
+    if res.returncode != 0:
+      raise RuntimeError(f"'{' '.join(cmd)}' exited with {res.returncode}: {res.stderr.strip()}")
+    if not os.path.isfile(dst):
+      raise RuntimeError(f"'{' '.join(cmd)}' did not write {dst}")
+  return copy
+
+
+def local_path(job_path):
+  """Local stand-in of a grid path: the same path without the alien:// prefix."""
+  return job_path[len('alien://'):] if job_path.startswith('alien://') else job_path
+
+
+def local_list(job_path):
+  """Sub-directories of the AOD directory of a job copied on the local disk."""
+  return sorted(os.listdir(os.path.join(local_path(job_path), 'AOD')))
+
+
+def local_copy(src, dst):
+  shutil.copyfile(local_path(src), dst)
+
+
+TRANSFERS = {
+  'alien': (alien_list, command_copy('alien_cp {src} file://{dst}')),
+  'local': (local_list, local_copy),
+}
+
+
+# MANIFEST -------------------------------------------------------------
+
+def load_manifest(out_dir):
+  """Completed files of a previous download: 'hy_id/NNN' -> size in bytes."""
+  try:
+    with open(os.path.join(out_dir, MANIFEST), 'r') as f:
+      return json.load(f).get('files', {})
+  except (OSError, ValueError):
+    return {}
+
+
+def save_manifest(out_dir, files):
+  path = os.path.join(out_dir, MANIFEST)
+  with open(path + '.tmp', 'w') as f:
+    json.dump({'files': files}, f, indent=2, sort_keys=True)
+  os.replace(path + '.tmp', path)
+
+
+# DOWNLOAD -------------------------------------------------------------
+
+def with_retries(func, args, retries, backoff):
+  """Call func(*args), trying again up to retries times, waiting backoff, 2*backoff, 4*backoff, ... seconds."""
+  for attempt in range(retries + 1):
+    try:
+      return func(*args)
+    except (OSError, RuntimeError) as e:
+      if attempt == retries:
+        raise
+      print(f'Warning: {e}; retrying in {backoff * 2**attempt:g} s')
+      time.sleep(backoff * 2**attempt)
+
+
+def fetch(src, dst, copy, retries, backoff):
+  """Copy one file in dst, through a temporary file so that dst exists only if the copy completed. Returns its size."""
+  os.makedirs(os.path.dirname(dst), exist_ok=True)
+  tmp = dst + '.part'
+
+  def attempt():
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    copy(src, tmp)
+    os.replace(tmp, dst)
+
+  with_retries(attempt, (), retries, backoff)
+  return os.path.getsize(dst)
+
+
+def download(jobs, out_dir, file_name='AO2D.root', transfer='alien', copy=None, parallel=4, retries=3, backoff=5., on_done=None):
+  """
+  Download file_name from all the AOD sub-directories of the jobs ((hy id, job path) pairs) in out_dir/hy_id/NNN/,
+  skipping the files already in the manifest. copy replaces the copy function of the transfer, if given,
+  and on_done is called with the path of each file as soon as it is downloaded.
+  Returns the paths of the downloaded files (sorted) and the list of the failures.
+  """
+  list_job, transfer_copy = TRANSFERS[transfer]
+  copy = copy or transfer_copy
+  os.makedirs(out_dir, exist_ok=True)
+  done = load_manifest(out_dir)
+  failed = []
+
+  with ThreadPoolExecutor(max_workers=parallel) as pool:
+    # list the output sub-directories of all the jobs
+    listings = {pool.submit(with_retries, list_job, (job_path,), retries, backoff): (hy_id, job_path) for hy_id, job_path in jobs}
+    tasks = []
+    for future, (hy_id, job_path) in listings.items():
+      try:
+        subs = future.result()
+      except (OSError, RuntimeError) as e:
+        print(f'Error: cannot list {job_path}: {e}')
+        failed.append(hy_id)
+        continue
+      for sub in subs:
+        key = f'{hy_id}/{sub}'
+        dst = os.path.join(out_dir, hy_id, sub, file_name)
+        src = f'{job_path}/AOD/{sub}/{file_name}'
+        if key in done and os.path.isfile(dst) and os.path.getsize(dst) == done[key]:
+          continue
+        done.pop(key, None)
+        tasks.append((key, src, dst))
+
+    n_total = len(tasks) + len(done)
+    print(f'{len(done)} file(s) already downloaded, {len(tasks)} to download')
+
+    # download, keeping at most parallel transfers running
+    running = {}
+    pending = list(reversed(tasks))
+    while pending or running:
+      while pending and len(running) < parallel:
+        key, src, dst = pending.pop()
+        running[pool.submit(fetch, src, dst, copy, retries, backoff)] = key
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        key = running.pop(future)
+        try:
+          done[key] = future.result()
+        except (OSError, RuntimeError) as e:
+          print(f'Error: download of {key} failed: {e}')
+          failed.append(key)
+          continue
+        save_manifest(out_dir, done)
+        print(f'[{len(done)}/{n_total}] {key}')
+        if on_done:
+          on_done(os.path.join(out_dir, key, file_name))
+
+  files = sorted(os.path.join(out_dir, key, file_name) for key in done)
+  return files, failed
+
+
+def write_file_list(path, files, out_dir, prefix=None):
+  """Write the downloaded files in a list for run-task.py, with out_dir replaced by prefix if given."""
+  with open(path, 'w') as f:
+    for file_path in files:
+      if prefix:
+        file_path = os.path.join(prefix, os.path.relpath(file_path, out_dir))
+      f.write(file_path + '\n')
@@ -0,0 +1,205 @@
+# resources used by the commands run by the scripts (analysis, hadd, o2-aod-merger): wall time,
+# CPU time, peak RSS and bytes read/written, measured on the child process and on all its descendants
+# (the I/O counters of /proc/<pid>/io include the children already terminated, the rusage of wait4 as well)
+
+import os
+import csv
+import json
+import time
+import select
+import signal
+import threading
+import subprocess
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# process groups of the commands running in this process: they are in their own sessions, so a Ctrl-C
+# does not reach them and they have to be killed when the process is interrupted
+_groups = set()
+_groups_lock = threading.Lock()
+
+
+def process_group_rss(pgid):
+  """Return the total resident memory (bytes) of all the processes in the process group pgid, read from /proc."""
+  total = 0
+  try:
+    pids = [p for p in os.listdir('/proc') if p.isdigit()]
+  except OSError:
+    return 0
+  for pid in pids:
+    try:
+      with open(f'/proc/{pid}/stat', 'r') as f:
+        # the command name can contain spaces: split after its closing parenthesis
+        fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+      continue
+    # fields[2] is the process group, fields[21] the rss in pages
+    if int(fields[2]) == pgid:
+      total += int(fields[21]) * PAGE_SIZE
+  return total
+
+
+def process_io(pid):
+  """I/O counters of a process (rchar, wchar, read_bytes, write_bytes, ...), empty if they cannot be read."""
+  try:
+    with open(f'/proc/{pid}/io', 'r') as f:
+      return {key: int(value) for key, value in (line.split(':') for line in f if ':' in line)}
+  except (OSError, ValueError):
+    return {}
+
+
+def kill_groups(pgids=None, sig=signal.SIGKILL):
+  """Send sig to the process groups pgids (default: all the commands of run_measured running in this process)."""
+  if pgids is None:
+    with _groups_lock:
+      pgids = set(_groups)
+  for pgid in list(pgids):
+    try:
+      os.killpg(pgid, sig)
+    except ProcessLookupError:
+      pass
+
+
+def run_measured(cmd, cwd=None, log=None, poll_interval=0.5, on_poll=None, log_mode='w', running=None):
+  """
+  Run a shell command in its own process group and measure it. log is a file path for stdout and stderr
+  (None to inherit them), opened with log_mode ('a' to append to the messages already there). on_poll(pid, rss) is called at every poll while the command runs.
+  running, if given, is a set that holds the process group of the command while it runs, so that the caller can kill it
+  (see kill_groups); if this thread is interrupted (Ctrl-C, or any exception) the command is killed.
+  Returns a dict with the exit code ('ret', negative if killed by a signal), 'start' (time.monotonic() when it started,
+  to place it in time against the other commands of the process), 'wall' and 'cpu' (user + system) in seconds,
+  'peak_rss' in bytes, and the bytes read/written: 'read'/'write' (all the I/O, also from the page cache)
+  and 'disk_read'/'disk_write' (from/to the storage).
+  """
+  flog = open(log, log_mode) if log else None
+  start = time.monotonic()
+  peak_rss = 0
+  proc = None
+  try:
+    proc = subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=flog,
+                            stderr=subprocess.STDOUT if flog else None, start_new_session=True)
+    with _groups_lock:
+      _groups.add(proc.pid)
+    if running is not None:
+      running.add(proc.pid)
+    # the pid file descriptor becomes readable when the process ends: short commands are not rounded up to poll_interval
+    pidfd = os.pidfd_open(proc.pid) if hasattr(os, 'pidfd_open') else None
+    try:
+      while True:
+        # wait without reaping the process, so that its I/O counters can still be read
+        if os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+          break
+        rss = process_group_rss(proc.pid)
+        peak_rss = max(peak_rss, rss)
+        if on_poll:
+          on_poll(proc.pid, rss)
+        if pidfd is not None:
+          select.select([pidfd], [], [], poll_interval)
+        else:
+          time.sleep(poll_interval)
+    except BaseException:
+      kill_groups([proc.pid])
+      os.waitpid(proc.pid, 0)
+      raise
+    finally:
+      if pidfd is not None:
+        os.close(pidfd)
+    io = process_io(proc.pid)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+  finally:
+    if proc is not None:
+      with _groups_lock:
+        _groups.discard(proc.pid)
+      if running is not None:
+        running.discard(proc.pid)
+    if flog:
+      flog.close()
+  return {
+    'ret': proc.returncode,
+    'start': start,
+    'wall': time.monotonic() - start,
+    'cpu': usage.ru_utime + usage.ru_stime,
+    # ru_maxrss is in kB, and it is the peak of a single process: the sampled total of the group is usually larger
+    'peak_rss': max(peak_rss, usage.ru_maxrss * 1024),
+    'read': io.get('rchar', 0),
+    'write': io.get('wchar', 0),
+    'disk_read': io.get('read_bytes', 0),
+    'disk_write': io.get('write_bytes', 0),
+  }
+
+
+# REPORT ---------------------------------------------------------------
+
+REPORT_COLUMNS = ['kind', 'name', 'ret', 'wall', 'cpu', 'peak_rss', 'read', 'write', 'disk_read', 'disk_write',
+                  'input_bytes', 'events', 'mb_per_s', 'events_per_s']
+
+
+def report_row(kind, name, stats, input_bytes=None, events=None):
+  """One row of the report: the stats of a command, with the throughput if the size (bytes) or the events of its input are known."""
+  row = {'kind': kind, 'name': name, **stats, 'input_bytes': input_bytes, 'events': events}
+  wall = stats['wall'] if stats['wall'] > 0 else None
+  row['mb_per_s'] = input_bytes / 1024**2 / wall if wall and input_bytes is not None else None
+  row['events_per_s'] = events / wall if wall and events is not None else None
+  return row
+
+
+def busy_time(rows):
+  """Time with at least one of the commands of rows running: the length of the union of their [start, start + wall]."""
+  busy, end = 0., None
+  for start, stop in sorted((r['start'], r['start'] + r['wall']) for r in rows):
+    if end is None or start > end:
+      busy += stop - start
+      end = stop
+    elif stop > end:
+      busy += stop - end
+      end = stop
+  return busy
+
+
+def write_report(path_base, rows, total_wall, unit='chunk', n_slowest=5):
+  """
+  Write the rows in path_base.json (with a summary) and path_base.csv. The summary has the slowest units of work
+  (rows of kind unit, e.g. the chunks of run-task.py or the points of a scan) and the merge overhead:
+  the time with at least one merge (rows of kind 'merge') running and its fraction of total_wall, and the wall
+  times of the merges summed (larger with merges in parallel). Returns the summary.
+  """
+  chunks = [r for r in rows if r['kind'] == unit]
+  merges = [r for r in rows if r['kind'] == 'merge']
+  # the merges of a tree run in parallel: their wall times overlap
+  merge_wall = busy_time(merges) if all('start' in r for r in merges) else sum(r['wall'] for r in merges)
+  summary = {
+    'unit': unit,
+    'total_wall': total_wall,
+    'chunks': len(chunks),
+    'chunks_wall': sum(r['wall'] for r in chunks),
+    'chunks_cpu': sum(r['cpu'] for r in chunks),
+    'max_peak_rss': max((r['peak_rss'] for r in chunks), default=0),
+    'slowest': [r['name'] for r in sorted(chunks, key=lambda r: r['wall'], reverse=True)[:n_slowest]],
+    'merge_wall': merge_wall,
+    'merge_wall_sum': sum(r['wall'] for r in merges),
+    'merge_fraction': merge_wall / total_wall if total_wall > 0 else None,
+  }
+  with open(path_base + '.json', 'w') as f:
+    json.dump({'summary': summary, 'rows': rows}, f, indent=2)
+  with open(path_base + '.csv', 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+  return summary
+
+
+def print_summary(summary, rows, say=print):
+  """Print the summary of a report (with say, e.g. to write it in a log)."""
+  by_name = {r['name']: r for r in rows}
+  say(f"Resources: {summary['chunks']} {summary['unit']}(s) in {summary['total_wall']:.1f} s "
+      f"(sum of the wall times {summary['chunks_wall']:.1f} s, CPU {summary['chunks_cpu']:.1f} s, "
+      f"max peak RSS {summary['max_peak_rss']/1024**3:.2f} GB)")
+  for name in summary['slowest']:
+    r = by_name[name]
+    speed = f", {r['mb_per_s']:.1f} MB/s" if r['mb_per_s'] is not None else ''
+    speed += f", {r['events_per_s']:.0f} events/s" if r['events_per_s'] is not None else ''
+    say(f"  slowest: {name}: {r['wall']:.1f} s{speed}")
+  if summary['merge_wall'] and summary['merge_fraction'] is not None:
+    say(f"  merges: {summary['merge_wall']:.1f} s with at least one merge running ({100*summary['merge_fraction']:.1f}% of the total), "
+        f"{summary['merge_wall_sum']:.1f} s summed over the merges")
@@ -0,0 +1,96 @@
+# metadata of the files of an input list (size, mtime, inode), saved in a sidecar file next to the list
+# the directories are scanned several at a time with os.scandir, and a directory whose mtime did not
+# change since the last scan is not listed again: its files and sub-directories are taken from the sidecar,
+# and only the stat of its files is taken again (a file rewritten in place does not change the directory)
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SIDECAR_SUFFIX = '.meta.json'
+
+
+def sidecar_path(list_path):
+  """Sidecar file of an input list (file_list.txt -> file_list.txt.meta.json)."""
+  return list_path + SIDECAR_SUFFIX
+
+
+def load_sidecar(list_path):
+  """Content of the sidecar of a list: {'dirs': directory -> entries, 'files': listed path -> stat}, empty if missing."""
+  try:
+    with open(sidecar_path(list_path), 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {'dirs': {}, 'files': {}}
+
+
+def save_sidecar(list_path, dirs, files):
+  path = sidecar_path(list_path)
+  with open(path + '.tmp', 'w') as f:
+    json.dump({'dirs': dirs, 'files': files}, f)
+  os.replace(path + '.tmp', path)
+
+
+def scan_dir(path, cached=None):
+  """
+  Files (name -> size, mtime, inode) and sub-directories of one directory, with its mtime.
+  If the mtime of the directory did not change the names of the cached entry are used, with the stat of the files taken again.
+  Returns (entry, True if the directory was read).
+  """
+  try:
+    mtime = os.stat(path).st_mtime_ns
+    if cached and cached['mtime_ns'] == mtime:
+      files = {}
+      for name in cached['files']:
+        try:
+          st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+          continue
+        files[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+      return {'mtime_ns': mtime, 'files': files, 'subdirs': cached['subdirs']}, False
+    files, subdirs = {}, []
+    with os.scandir(path) as it:
+      for e in it:
+        # as os.walk: symbolic links to directories are not followed
+        if e.is_dir():
+          if not e.is_symlink():
+            subdirs.append(e.name)
+          continue
+        st = e.stat()
+        files[e.name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+  except OSError as e:
+    print(f'Warning: cannot read {path}: {e}')
+    return {'mtime_ns': None, 'files': {}, 'subdirs': []}, True
+  return {'mtime_ns': mtime, 'files': files, 'subdirs': sorted(subdirs)}, True
+
+
+def scan_tree(start, cached_dirs=None, workers=8):
+  """
+  Scan start and all its sub-directories, up to workers at the same time, reusing the cached
+  directories whose mtime did not change. Returns (directory -> entry, number of directories read).
+  """
+  cached_dirs = cached_dirs or {}
+  dirs = {}
+  n_read = 0
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    running = {pool.submit(scan_dir, start, cached_dirs.get(start)): start}
+    while running:
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        path = running.pop(future)
+        entry, read = future.result()
+        dirs[path] = entry
+        n_read += read
+        for sub in entry['subdirs']:
+          sub_path = os.path.join(path, sub)
+          running[pool.submit(scan_dir, sub_path, cached_dirs.get(sub_path))] = sub_path
+  return dirs, n_read
+
+
+def walk_files(dirs, start):
+  """(path, stat) of all the files of the scanned tree, in the order of os.walk with sorted directories and files."""
+  entry = dirs[start]
+  for name in sorted(entry['files']):
+    yield os.path.join(start, name), entry['files'][name]
+  for sub in entry['subdirs']:
+    yield from walk_files(dirs, os.path.join(start, sub))
@@ -0,0 +1,91 @@
+# luminosity from the AnalysisResults.root of the trains: python counterpart of lumi-hy/getLumi.cpp
+# only the luminosity and trigger histograms are read from each file, and summed with numpy bin by bin
+# (by bin label when the bins are labelled, e.g. with the run number), so no merged file is needed
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import uproot
+
+# directories of the luminosity histograms: old and new layout, the old one is used when it has hLumiTCE
+LUMI_DIRS = ['eventselection-run3/luminosity', 'lumi-task']
+
+DETECTORS = ['TVX', 'TCE', 'ZEM', 'ZNC']
+LUMI_HISTOS = [f'hLumi{d}' for d in DETECTORS] + [f'hLumi{d}afterBCcuts' for d in DETECTORS]
+COUNTER_HISTOS = [f'hCounter{d}' for d in DETECTORS] + [f'hCounter{d}afterBCcuts' for d in DETECTORS]
+
+# TCE triggers counted by the UPC candidate producer
+UPC_TRIGGERS = 'upc-cand-producer/hCountersTrg'
+TCE_CROSS_SECTION = 4100000 # mub
+
+SYST_UNC = 0.039 # https://alice-notes.web.cern.ch/node/1515
+
+
+def lumi_dir(root_file):
+  """Directory of the luminosity histograms in an open uproot file, as chosen by getLumi.cpp."""
+  return LUMI_DIRS[0] if f'{LUMI_DIRS[0]}/hLumiTCE' in root_file else LUMI_DIRS[1]
+
+
+def histo_bins(histo):
+  """Bin contents of a 1D histogram (under/overflow excluded) keyed by bin label, or by bin number (from 1) if not labelled."""
+  values = histo.values()
+  labels = histo.axis().labels() or []
+  return OrderedDict((labels[i] if i < len(labels) and labels[i] else i + 1, float(v)) for i, v in enumerate(values))
+
+
+def read_lumi_histos(file_path):
+  """Read the luminosity and trigger histograms of one file: name -> bin contents (see histo_bins). Missing histograms are skipped."""
+  histos = {}
+  with uproot.open(file_path) as f:
+    directory = lumi_dir(f)
+    for name in LUMI_HISTOS + COUNTER_HISTOS:
+      path = f'{directory}/{name}'
+      if path in f:
+        histos[name] = histo_bins(f[path])
+    if UPC_TRIGGERS in f:
+      histos[UPC_TRIGGERS] = histo_bins(f[UPC_TRIGGERS])
+  return histos
+
+
+def add_lumi_histos(total, histos):
+  """Add the histograms of one file to the total, as hadd does."""
+  for name, bins in histos.items():
+    total_bins = total.setdefault(name, OrderedDict())
+    for key, value in bins.items():
+      total_bins[key] = total_bins.get(key, 0.) + value
+  return total
+
+
+def sum_lumi_files(files, parallel=4):
+  """Sum the luminosity and trigger histograms of the files, reading up to parallel files at the same time."""
+  total = {}
+  with ThreadPoolExecutor(max_workers=parallel) as pool:
+    for histos in pool.map(read_lumi_histos, files):
+      add_lumi_histos(total, histos)
+  return total
+
+
+def lumi_report(total):
+  """Lines with the totals printed by getLumi.cpp."""
+  lines = []
+  for name in LUMI_HISTOS:
+    label = name[len('hLumi'):].replace('afterBCcuts', ' afterBCcuts')
+    if name in total:
+      lumi = np.sum(list(total[name].values()))
+      lines.append(f'Total luminosity as seen by {label} is: {lumi:.2f}±{SYST_UNC*lumi:.2f} /mub')
+    else:
+      lines.append(f'no {label} lumi info')
+  if UPC_TRIGGERS in total and total[UPC_TRIGGERS]:
+    triggers = next(iter(total[UPC_TRIGGERS].values()))
+    lumi = triggers / TCE_CROSS_SECTION
+    lines.append(f'Total TCE triggers from UPCCandProducer: {triggers:.0f}; Luminosity is: {lumi:.2f}±{SYST_UNC*lumi:.2f} /mub')
+  else:
+    lines.append('no UPCCandProducer output')
+  for name in COUNTER_HISTOS:
+    label = name[len('hCounter'):].replace('afterBCcuts', ' afterBCcuts')
+    if name in total:
+      lines.append(f'Total triggers as seen by {label} is: {np.sum(list(total[name].values())):.2f}')
+    else:
+      lines.append(f'no {label} triggers info')
+  return lines
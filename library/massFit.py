@@ -0,0 +1,370 @@
+# fit of the invariant mass distribution with numpy/scipy: python counterpart of the model of fitJPsi.cpp
+# J/psi and psi(2S) as double-sided Crystal Balls (the psi(2S) shares the tails of the J/psi, with its mass
+# shifted and its widths scaled) plus the background exp(p1*m + p2*m^2), in an extended likelihood.
+# Unbinned (array of masses) and binned (histogram) fits; the likelihood is evaluated for a whole batch of
+# parameter sets at once, which gives the gradient (central differences) and the Hessian in a few numpy calls
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# parameters of the shapes: name -> (initial value, min, max), as the RooRealVar of doOneDataFit in fitJPsi.cpp
+SHAPE_PARAMS = {
+  'm0': (3.096900, 2.9, 3.2),
+  'sigmaL': (0.073, 0.01, 0.2),
+  'sigmaR': (0.061, 0.01, 0.2),
+  'nL': (140., 130., 150.),
+  'nR': (0.1, 0.01, 10.),
+  'alphaL': (1.08, 0.9, 1.2),
+  'alphaR': (2.8, 2.5, 4.),
+  'p1': (-2.55, -100., 0.),
+  'p2': (0.2, -5., 5.),
+}
+YIELDS = ['nJpsi', 'nPsi2s', 'nBg']
+PARAMS = list(SHAPE_PARAMS) + YIELDS
+
+# psi(2S) from the J/psi parameters: m0 + (3.686097 - 3.096900), widths x 1.09 = sqrt(Mpsi2s/Mjpsi)
+PSI2S_SHIFT = 3.686097 - 3.096900
+PSI2S_SIGMA_SCALE = 1.09
+
+# switches of fitJPsi.cpp that change the model, with the same defaults
+SWITCHES = {
+  'isNFixed': False,
+  'isSigmaFixed': False,
+  'isAlphaFixed': False,
+  'isMassFixed': False,
+  'includePsi2s': False,
+  'useExpoBkg': True,     # p2 = 0
+  'excludeJPsi': False,   # background only
+  'excludeBkg': False,    # no background
+}
+
+# neutron classes of doOneDataFit: name -> range of fNclass (0n0n == 1, Xn0n == 2, 0nXn == 3, XnXn == 4)
+NEUTRON_CLASSES = {'noSelection': (1, 4), '0n0n': (1, 1), 'Xn0n': (2, 2), 'XnXn': (4, 4)}
+
+# fit variants: name -> switches of fitJPsi.cpp to set (the others keep their default);
+# default is the macro as it is, with the background exp(p_1*m) (p2 fixed to 0)
+FIT_VARIANTS = {
+  'default': {},                       # bkg = exp(p_1*m)
+  'p2-free': {'useExpoBkg': False},    # bkg = exp(p_1*m + p_2*m^2)
+  'psi2s': {'includePsi2s': True},
+  'no-jpsi': {'excludeJPsi': True},
+}
+
+# Gauss-Legendre nodes used to integrate the background
+GL_NODES, GL_WEIGHTS = np.polynomial.legendre.leggauss(32)
+
+
+def read_config_sections(config_path):
+  """Sections of mass-fits/config.cfg (TEnv format, 'section.key: value'): section -> {key: value}, in the order of the file."""
+  sections = {}
+  with open(config_path, 'r') as f:
+    for line in f:
+      line = line.split('#', 1)[0].strip()
+      if ':' not in line:
+        continue
+      name, value = (part.strip() for part in line.split(':', 1))
+      section, _, key = name.partition('.')
+      sections.setdefault(section, {})[key] = float(value)
+  return sections
+
+
+def parse_switches(specs):
+  """Switches from 'switch=value' (true/false), checked against SWITCHES."""
+  values = {}
+  for spec in specs:
+    key, _, value = spec.partition('=')
+    if key not in SWITCHES:
+      raise ValueError(f"'{key}' is not a switch of the model ({', '.join(SWITCHES)})")
+    values[key] = value.lower() == 'true'
+  return values
+
+
+def select_masses(arrays, section, n_class='noSelection'):
+  """Masses of the candidates (arrays of fM, fPt, fRap and, for data, fNclass) in the kinematics of a config section and in a neutron class, as the dataset of doOneDataFit."""
+  mask = ((arrays['fPt'] >= section['minPt']) & (arrays['fPt'] <= section['maxPt'])
+          & (arrays['fM'] >= section['minMass']) & (arrays['fM'] <= section['maxMass'])
+          & (arrays['fRap'] >= section['minRapidity']) & (arrays['fRap'] <= section['maxRapidity']))
+  if 'fNclass' in arrays:
+    low, up = NEUTRON_CLASSES[n_class]
+    mask &= (arrays['fNclass'] >= low) & (arrays['fNclass'] <= up)
+  return np.asarray(arrays['fM'][mask], dtype=float)
+
+
+# CRYSTAL BALL -------------------------------------------------------
+# one side of the Crystal Ball as a function of t = |m - m0|/sigma >= 0: gaussian core up to alpha, then the
+# power-law tail exp(-alpha^2/2) * (1 + alpha/n*(t - alpha))^-n (same as A*(B + t)^-n of RooCrystalBall, without overflows)
+
+def _half_shape(t, alpha, n):
+  r = 1 + alpha / n * (np.maximum(t, alpha) - alpha)
+  return np.where(t <= alpha, np.exp(-0.5 * t * t), np.exp(-0.5 * alpha * alpha) * r ** -n)
+
+
+def _half_integral(u, v, alpha, n):
+  """Integral of _half_shape over [u, v], 0 <= u <= v."""
+  from scipy.special import erf
+  gu, gv = np.minimum(u, alpha), np.minimum(v, alpha)
+  core = math.sqrt(math.pi / 2) * (erf(gv / math.sqrt(2)) - erf(gu / math.sqrt(2)))
+  ru = 1 + alpha / n * (np.maximum(u, alpha) - alpha)
+  rv = 1 + alpha / n * (np.maximum(v, alpha) - alpha)
+  one_minus_n = np.where(np.abs(1 - n) < 1e-9, 1e-9, 1 - n)
+  power = np.where(np.abs(1 - n) < 1e-9, np.log(rv / ru), (rv ** one_minus_n - ru ** one_minus_n) / one_minus_n)
+  return core + np.exp(-0.5 * alpha * alpha) * n / alpha * power
+
+
+def crystal_ball(m, m0, sigmaL, sigmaR, alphaL, nL, alphaR, nR):
+  """Double-sided Crystal Ball (not normalized), as RooCrystalBall."""
+  left = m < m0
+  t = np.where(left, (m0 - m) / sigmaL, (m - m0) / sigmaR)
+  return np.where(left, _half_shape(t, alphaL, nL), _half_shape(t, alphaR, nR))
+
+
+def crystal_ball_integral(a, b, m0, sigmaL, sigmaR, alphaL, nL, alphaR, nR):
+  """Integral of crystal_ball over [a, b] (arrays broadcast together)."""
+  left = sigmaL * _half_integral((m0 - np.minimum(b, m0)) / sigmaL, (m0 - np.minimum(a, m0)) / sigmaL, alphaL, nL)
+  right = sigmaR * _half_integral((np.maximum(a, m0) - m0) / sigmaR, (np.maximum(b, m0) - m0) / sigmaR, alphaR, nR)
+  return left + right
+
+
+def _shapes(p, psi2s=False):
+  """Crystal Ball parameters of the J/psi (or of the psi(2S)) from the parameter dict."""
+  scale = PSI2S_SIGMA_SCALE if psi2s else 1.
+  return (p['m0'] + (PSI2S_SHIFT if psi2s else 0.), p['sigmaL'] * scale, p['sigmaR'] * scale,
+          p['alphaL'], p['nL'], p['alphaR'], p['nR'])
+
+
+def _background_integral(a, b, p1, p2):
+  """Integral of exp(p1*m + p2*m^2) over [a, b] with Gauss-Legendre (a, b: arrays of bin edges, p1, p2: (K, 1))."""
+  a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+  half, mid = (b - a) / 2, (b + a) / 2
+  m = mid[..., None] + half[..., None] * GL_NODES                       # (..., bins, nodes)
+  values = np.exp(p1[..., None] * m + p2[..., None] * m * m)
+  return half * np.sum(values * GL_WEIGHTS, axis=-1)
+
+
+# MODEL -------------------------------------------------------------
+
+class MassModel:
+  """
+  Model of fitJPsi.cpp in the mass window [low, high], with the switches of the macro (see SWITCHES).
+  The parameters are dicts name -> array of shape (K, 1): the model is evaluated for K parameter sets at once.
+  """
+
+  def __init__(self, low, high, switches=None, start=None):
+    self.low, self.high = float(low), float(high)
+    self.switches = {**SWITCHES, **(switches or {})}
+    unknown = set(self.switches) - set(SWITCHES)
+    if unknown:
+      raise ValueError(f"unknown switch(es) {', '.join(sorted(unknown))} ({', '.join(SWITCHES)})")
+    self.start = {name: spec[0] for name, spec in SHAPE_PARAMS.items()}
+    self.start.update(start or {})
+
+  def fixed(self):
+    """Parameters fixed by the switches, with their value."""
+    s = self.switches
+    fixed = {}
+    if s['isMassFixed']:
+      fixed['m0'] = self.start['m0']
+    for switch, names in (('isSigmaFixed', ('sigmaL', 'sigmaR')), ('isNFixed', ('nL', 'nR')), ('isAlphaFixed', ('alphaL', 'alphaR'))):
+      if s[switch]:
+        fixed.update({name: self.start[name] for name in names})
+    if s['useExpoBkg']:
+      fixed['p2'] = 0.
+    if not s['includePsi2s'] or s['excludeJPsi']:
+      fixed['nPsi2s'] = 0.
+    if s['excludeJPsi']:
+      # the shapes of the resonances do not enter the fit
+      fixed.update({name: self.start[name] for name in SHAPE_PARAMS if name not in ('p1', 'p2')}, nJpsi=0.)
+    if s['excludeBkg']:
+      fixed.update(p1=0., p2=0., nBg=0.)
+    return fixed
+
+  def limits(self, n_events):
+    """Initial value and range of every parameter; the yields as in fitJPsi.cpp, from the number of events."""
+    limits = {name: (self.start[name], lo, hi) for name, (_, lo, hi) in SHAPE_PARAMS.items()}
+    limits['nJpsi'] = (0.8 * n_events, 0.05 * n_events, n_events)
+    limits['nPsi2s'] = (0.05 * n_events, 0., n_events)
+    limits['nBg'] = (0.15 * n_events, 0., n_events)
+    return limits
+
+  def densities(self, m, p):
+    """Normalized densities in the window of J/psi, psi(2S) and background at the masses m: three arrays (K, len(m))."""
+    out = []
+    for psi2s in (False, True):
+      shape = _shapes(p, psi2s)
+      out.append(crystal_ball(m, *shape) / crystal_ball_integral(self.low, self.high, *shape))
+    norm = _background_integral(self.low, self.high, p['p1'], p['p2'])
+    out.append(np.exp(p['p1'] * m + p['p2'] * m * m) / norm)
+    return out
+
+  def bin_fractions(self, edges, p):
+    """Fraction of each component in the bins of edges (within the window): three arrays (K, bins)."""
+    a, b = edges[:-1], edges[1:]
+    out = []
+    for psi2s in (False, True):
+      shape = _shapes(p, psi2s)
+      out.append(crystal_ball_integral(a, b, *shape) / crystal_ball_integral(self.low, self.high, *shape))
+    out.append(_background_integral(a, b, p['p1'], p['p2']) / _background_integral(self.low, self.high, p['p1'], p['p2']))
+    return out
+
+  def cumulative(self, grid, p):
+    """Cumulative distribution of each component from the lower edge of the window to the masses of grid (sorted): three arrays (K, len(grid))."""
+    out = []
+    for psi2s in (False, True):
+      shape = _shapes(p, psi2s)
+      out.append(crystal_ball_integral(self.low, grid, *shape) / crystal_ball_integral(self.low, self.high, *shape))
+    # background in steps between the points, summed
+    steps = _background_integral(grid[:-1], grid[1:], p['p1'], p['p2'])
+    first = _background_integral(np.array([self.low]), grid[:1], p['p1'], p['p2'])
+    out.append(np.cumsum(np.concatenate([first, steps], axis=-1), axis=-1) / _background_integral(self.low, self.high, p['p1'], p['p2']))
+    return out
+
+  def nll(self, p, masses=None, counts=None, edges=None):
+    """Extended negative log-likelihood for each parameter set: unbinned on masses, or binned on counts in edges."""
+    yields = [p[name] for name in YIELDS]
+    if masses is not None:
+      dens = sum(y * f for y, f in zip(yields, self.densities(masses, p)))
+      return (sum(yields)[:, 0] - np.sum(np.log(np.maximum(dens, 1e-300)), axis=1))
+    nu = sum(y * f for y, f in zip(yields, self.bin_fractions(edges, p)))
+    nu = np.maximum(nu, 1e-300)
+    return np.sum(nu - counts * np.log(nu), axis=1)
+
+
+# FIT ---------------------------------------------------------------
+
+def _params(names, x, fixed):
+  """Parameter dict (arrays (K, 1)) from the free values x (K, len(names)) and the fixed ones."""
+  k = x.shape[0]
+  p = {name: np.full((k, 1), value) for name, value in fixed.items()}
+  p.update({name: x[:, i:i+1] for i, name in enumerate(names)})
+  return p
+
+
+def window_bins(model, counts, edges):
+  """
+  Counts and edges of the bins of a histogram whose center is in the window of the model, and the model of the
+  binned fit: the same one, with its window moved to the edges of those bins if they do not line up with it.
+  """
+  counts, edges = np.asarray(counts, dtype=float), np.asarray(edges, dtype=float)
+  centers = (edges[:-1] + edges[1:]) / 2
+  inside = (centers >= model.low) & (centers <= model.high)
+  counts = counts[inside]
+  edges = np.append(edges[:-1][inside], edges[1:][inside][-1:])
+  if len(edges) > 1 and (edges[0] != model.low or edges[-1] != model.high):
+    model = MassModel(edges[0], edges[-1], model.switches, model.start)
+  return counts, edges, model
+
+
+def fit(model, masses=None, counts=None, edges=None, max_iter=500):
+  """
+  Fit the model to the masses in the window (unbinned) or to a histogram (counts, edges: binned; only the bins
+  inside the window are used, and the model is normalized over them, see window_bins). The free parameters are mapped on [0, 1] within their ranges and minimized
+  with L-BFGS-B, with the gradient from a batch of central differences; the errors come from the Hessian.
+  Returns a dict with 'status' (0 if converged, as RooFit; -1 if not fitted, with fewer events than free parameters),
+  'covQual' (as RooFitResult::covQual: 3 if the Hessian is positive definite, 1 if not and the errors are not reliable,
+  -1 if not fitted), 'nll', 'params', 'errors' (NaN where the variance is not positive), the variables of
+  savedVarInMassFits.h (numJPsi, errNumJPsi, numBkg, errNumBkg, entries, errEntries) and, for binned fits, 'chi2' and 'ndf'.
+  """
+  from scipy.optimize import minimize
+  if masses is not None:
+    masses = np.asarray(masses, dtype=float)
+    masses = masses[(masses >= model.low) & (masses <= model.high)]
+    n_events = len(masses)
+  else:
+    counts, edges, model = window_bins(model, counts, edges)
+    n_events = counts.sum()
+  limits = model.limits(n_events)
+  fixed = model.fixed()
+  names = [name for name in PARAMS if name not in fixed]
+  if n_events < len(names):
+    # nothing to fit (an empty class or section): the yield ranges would be empty
+    nan = float('nan')
+    out = {
+      'status': -1, 'covQual': -1, 'nll': nan,
+      'params': {name: float(fixed.get(name, nan)) for name in PARAMS},
+      'errors': {name: 0. if name in fixed else nan for name in PARAMS},
+      'numJPsi': nan, 'errNumJPsi': nan, 'numBkg': nan, 'errNumBkg': nan,
+      'entries': float(n_events), 'errEntries': math.sqrt(n_events),
+    }
+    if counts is not None:
+      out['chi2'], out['ndf'] = nan, int(len(counts)) - len(names)
+    return out
+  lo = np.array([limits[name][1] for name in names])
+  span = np.array([limits[name][2] for name in names]) - lo
+  x0 = (np.array([limits[name][0] for name in names]) - lo) / span
+
+  def batch(xs):
+    return model.nll(_params(names, lo + xs * span, fixed), masses, counts, edges)
+
+  def value_and_grad(x, h=1e-6):
+    # x, x + h e_i and x - h e_i (kept within [0, 1]) in one evaluation
+    eye = np.eye(len(x)) * h
+    plus, minus = np.clip(x + eye, 0, 1), np.clip(x - eye, 0, 1)
+    values = batch(np.vstack([x[None, :], plus, minus]))
+    step = np.diag(plus - minus)
+    return values[0], (values[1:len(x)+1] - values[len(x)+1:]) / step
+
+  result = minimize(value_and_grad, x0, jac=True, method='L-BFGS-B', bounds=[(0, 1)] * len(names),
+                    options={'maxiter': max_iter})
+  best = lo + result.x * span
+  # Hessian in the physical parameters from second differences of the likelihood, all the points in one batch;
+  # a parameter at its bound is differentiated next to it (the gradients would be too noisy on a flat direction)
+  h = 1e-3
+  k = len(names)
+  center = np.clip(result.x, h, 1 - h)
+  pairs = [(i, j) for i in range(k) for j in range(i, k)]
+  eye = np.eye(k) * h
+  points = [center + si * eye[i] + sj * eye[j] for i, j in pairs for si, sj in ((1, 1), (1, -1), (-1, 1), (-1, -1))]
+  values = batch(np.array(points)).reshape(len(pairs), 4)
+  hess = np.empty((k, k))
+  for (i, j), (pp, pm, mp, mm) in zip(pairs, values):
+    hess[i, j] = hess[j, i] = (pp - pm - mp + mm) / (4 * h * h)
+  hess = hess / np.outer(span, span)
+  # as MINUIT, the errors are reliable only if the Hessian is positive definite
+  try:
+    np.linalg.cholesky(hess)
+    cov_quality = 3
+  except np.linalg.LinAlgError:
+    cov_quality = 1
+  variances = np.diag(np.linalg.pinv(hess))
+  errors = np.where(variances > 0, np.sqrt(np.abs(variances)), np.nan)
+  params = {**fixed, **dict(zip(names, best))}
+  errs = {name: 0. for name in fixed}
+  errs.update(zip(names, errors))
+  out = {
+    'status': 0 if result.success else 1,
+    'covQual': cov_quality,
+    'nll': float(result.fun),
+    'params': {k: float(v) for k, v in params.items()},
+    'errors': {k: float(v) for k, v in errs.items()},
+    'numJPsi': float(params['nJpsi']), 'errNumJPsi': float(errs['nJpsi']),
+    'numBkg': float(params['nBg']), 'errNumBkg': float(errs['nBg']),
+    'entries': float(n_events), 'errEntries': math.sqrt(n_events),
+  }
+  if counts is not None:
+    p = {k: np.array([[v]]) for k, v in params.items()}
+    nu = sum(p[name][0, 0] * f[0] for name, f in zip(YIELDS, model.bin_fractions(edges, p)))
+    used = nu > 0
+    out['chi2'] = float(np.sum((counts[used] - nu[used]) ** 2 / nu[used]))
+    out['ndf'] = int(used.sum()) - len(names)
+  return out
+
+
+def _fit_one(args):
+  model, dataset, edges = args
+  if edges is None:
+    return fit(model, masses=dataset)
+  return fit(model, counts=dataset, edges=edges)
+
+
+def fit_many(model, datasets, edges=None, workers=1):
+  """
+  Fit many datasets with the same model: arrays of masses (unbinned), or of counts in the bins of edges (binned,
+  e.g. the rows of a 2D array). With workers > 1 the fits are spread over a pool of processes. Returns the list of results.
+  """
+  tasks = [(model, dataset, edges) for dataset in datasets]
+  if workers <= 1:
+    return [_fit_one(t) for t in tasks]
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    return list(pool.map(_fit_one, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
@@ -0,0 +1,163 @@
+# cache of the outputs of run-task.py, shared by all the runs and scans that use the same cache directory.
+# An entry is addressed by the hash of everything that determines the outputs: the config (sorted JSON,
+# without the path of the input list), the input files with their size and mtime, the executables of the
+# task chain and the tree writer JSON. The outputs are hard-linked in and out of the cache (copied if the
+# cache is on another file system), and the least recently used entries are removed above a maximum size
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+ENTRY = 'entry.json'
+
+
+def config_digest(config):
+  """Digest of a config independent of the key order and of the path of its input (hashed separately with its files)."""
+  config = json.loads(json.dumps(config))
+  config.get('internal-dpl-aod-reader', {}).pop('aod-file-private', None)
+  return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def inputs_digest(paths):
+  """
+  Digest of the input files (absolute paths) with their size and mtime, always taken from the disk: a file rewritten
+  in place does not change the sidecar of its list (see listMeta.py), that is only used to speed up the chunking.
+  """
+  h = hashlib.sha1()
+  for path in sorted(paths):
+    try:
+      s = os.stat(path)
+      st = (s.st_size, s.st_mtime_ns)
+    except OSError:
+      st = (None, None)
+    h.update(f"{path}\0{st[0]}\0{st[1]}\n".encode())
+  return h.hexdigest()
+
+
+def cache_key(*parts):
+  """Key of a cache entry from the digests (strings) of its parts, in order."""
+  return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def entry_dir(cache_dir, key):
+  return os.path.join(cache_dir, key[:2], key)
+
+
+def link_or_copy(src, dst):
+  """Hard-link src to dst (replacing dst), or copy it if they are on different file systems."""
+  if os.path.exists(dst) and os.path.samefile(src, dst):
+    return  # already linked (renaming a link onto the same file would do nothing)
+  tmp = dst + '.cache-tmp'
+  if os.path.lexists(tmp):
+    os.remove(tmp)
+  try:
+    os.link(src, tmp)
+  except OSError:
+    shutil.copy2(src, tmp)
+  os.replace(tmp, dst)
+
+
+def detach(path):
+  """
+  Remove path if it is a hard link shared with other files (e.g. an output linked from the cache),
+  so that a program that rewrites it in place (hadd -f, o2-aod-merger) does not change the cached copy.
+  """
+  try:
+    if os.stat(path).st_nlink > 1:
+      os.remove(path)
+  except FileNotFoundError:
+    pass
+
+
+def fetch(cache_dir, key, outputs):
+  """
+  Link the files of the entry key to the outputs (name in the cache -> destination path).
+  Returns False, without touching the outputs, if the entry is missing or incomplete; marks the entry as used.
+  """
+  path = entry_dir(cache_dir, key)
+  try:
+    with open(os.path.join(path, ENTRY), 'r') as f:
+      files = json.load(f)['files']
+  except (OSError, ValueError):
+    return False
+  wanted = [name for name in outputs if name in files]
+  if not wanted or any(not os.path.isfile(os.path.join(path, name)) or os.path.getsize(os.path.join(path, name)) != files[name]
+                       for name in wanted):
+    return False
+  for name in wanted:
+    link_or_copy(os.path.join(path, name), outputs[name])
+  os.utime(os.path.join(path, ENTRY))
+  return True
+
+
+def store(cache_dir, key, outputs, description='', max_bytes=None):
+  """
+  Add the outputs (name in the cache -> path; missing files are left out) as the entry key.
+  The entry is written in a temporary directory and renamed, so runs sharing the cache never see it incomplete.
+  Then, if max_bytes is given, the least recently used entries are removed. Returns the size of the entry.
+  """
+  path = entry_dir(cache_dir, key)
+  # runs of the same process (e.g. the points of a scan) use different temporary directories too
+  tmp = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+  shutil.rmtree(tmp, ignore_errors=True)
+  os.makedirs(tmp)
+  files = {}
+  for name, src in outputs.items():
+    if os.path.isfile(src):
+      link_or_copy(src, os.path.join(tmp, name))
+      files[name] = os.path.getsize(src)
+  with open(os.path.join(tmp, ENTRY), 'w') as f:
+    json.dump({'key': key, 'description': description, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'files': files}, f, indent=2)
+  try:
+    os.rename(tmp, path)
+  except OSError:
+    # another run stored the same entry in the meantime
+    shutil.rmtree(tmp, ignore_errors=True)
+  if max_bytes is not None:
+    evict(cache_dir, max_bytes)
+  return sum(files.values())
+
+
+def entries(cache_dir):
+  """(last use, size in bytes, path) of all the entries of the cache."""
+  found = []
+  if not os.path.isdir(cache_dir):
+    return found
+  for prefix in os.listdir(cache_dir):
+    prefix_dir = os.path.join(cache_dir, prefix)
+    if not os.path.isdir(prefix_dir):
+      continue
+    for key in os.listdir(prefix_dir):
+      if '.' in key:
+        continue  # entry being written or removed
+      path = os.path.join(prefix_dir, key)
+      try:
+        with open(os.path.join(path, ENTRY), 'r') as f:
+          size = sum(json.load(f)['files'].values())
+        found.append((os.path.getmtime(os.path.join(path, ENTRY)), size, path))
+      except (OSError, ValueError):
+        continue
+  return found
+
+
+def evict(cache_dir, max_bytes):
+  """Remove the least recently used entries until the cache is within max_bytes. Returns the number of entries removed."""
+  found = sorted(entries(cache_dir))
+  total = sum(size for _, size, _ in found)
+  removed = 0
+  for _, size, path in found:
+    if total <= max_bytes:
+      break
+    # renamed first, so that no run can fetch a half-removed entry
+    trash = f'{path}.evicted-{os.getpid()}'
+    try:
+      os.rename(path, trash)
+    except OSError:
+      continue
+    shutil.rmtree(trash, ignore_errors=True)
+    total -= size
+    removed += 1
+  return removed
@@ -0,0 +1,147 @@
+# per-run index of luminosity, trigger counts and J/psi candidates, kept in a SQLite file
+# every row comes from a source file (AnalysisResults.root, dimu tree or trigger spreadsheet) recorded
+# with its size and mtime: a source is read again only if it changed, and its old rows are replaced,
+# so the index is updated incrementally when new trains or runs are added
+
+import os
+import sqlite3
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from dimuVars import JPSI_WINDOW, iterate_dimu, source_stamp
+from lumiSum import LUMI_HISTOS, read_lumi_histos
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+  path TEXT PRIMARY KEY, train TEXT, kind TEXT, size INTEGER, mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS lumi (
+  source TEXT, run INTEGER, histo TEXT, value REAL, PRIMARY KEY (source, run, histo)
+);
+CREATE TABLE IF NOT EXISTS triggers (
+  source TEXT, run INTEGER, trigger TEXT, count REAL, PRIMARY KEY (source, run, trigger)
+);
+CREATE TABLE IF NOT EXISTS candidates (
+  source TEXT, run INTEGER, n_all INTEGER, n_jpsi INTEGER, PRIMARY KEY (source, run)
+);
+"""
+
+TABLES = ['lumi', 'triggers', 'candidates']
+
+
+def open_index(path):
+  """Open (and create if needed) the index."""
+  db = sqlite3.connect(path)
+  db.executescript(SCHEMA)
+  return db
+
+
+def is_source_current(db, file_path):
+  """True if the file is in the index and did not change since it was read."""
+  row = db.execute('SELECT size, mtime_ns FROM sources WHERE path = ?', (os.path.abspath(file_path),)).fetchone()
+  stamp = source_stamp(file_path)
+  return row is not None and row == (stamp['size'], stamp['mtime_ns'])
+
+
+def replace_source(db, file_path, train, table, rows):
+  """Replace the rows of a source in table (rows without the source column) and record its stamp, in one transaction."""
+  path = os.path.abspath(file_path)
+  stamp = source_stamp(file_path)
+  columns = {'lumi': 'run, histo, value', 'triggers': 'run, trigger, count', 'candidates': 'run, n_all, n_jpsi'}[table]
+  with db:
+    for t in TABLES:
+      db.execute(f'DELETE FROM {t} WHERE source = ?', (path,))
+    db.executemany(f'INSERT INTO {table} (source, {columns}) VALUES (?, ?, ?, ?)', [(path,) + tuple(r) for r in rows])
+    db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)', (path, train, table, stamp['size'], stamp['mtime_ns']))
+
+
+# READERS --------------------------------------------------------------
+
+def lumi_rows(file_path):
+  """(run, histo, lumi) of the hLumi* histograms of an AnalysisResults.root, whose bins are labelled with the run number."""
+  rows = []
+  unlabelled = False
+  for name, bins in read_lumi_histos(file_path).items():
+    if name not in LUMI_HISTOS:
+      continue
+    for key, value in bins.items():
+      if isinstance(key, str) and key.isdigit():
+        rows.append((int(key), name, value))
+      elif value:
+        unlabelled = True
+  if unlabelled:
+    print(f'Warning: some luminosity bins of {file_path} are not labelled with a run number and are not indexed.')
+  return rows
+
+
+def candidate_rows(file_path, step_size=1000000, tree_name='dimu'):
+  """(run, all candidates, candidates in the J/psi mass window) of the dimu trees of a file."""
+  n_all = {}
+  n_jpsi = {}
+  for arrays in iterate_dimu(file_path, ['fRunNumber', 'fM'], step_size, tree_name):
+    runs = arrays['fRunNumber']
+    in_window = (arrays['fM'] >= JPSI_WINDOW[0]) & (arrays['fM'] <= JPSI_WINDOW[1])
+    for counts, sel in ((n_all, slice(None)), (n_jpsi, in_window)):
+      values, n = np.unique(runs[sel], return_counts=True)
+      for run, c in zip(values.tolist(), n.tolist()):
+        counts[run] = counts.get(run, 0) + c
+  return [(run, n_all[run], n_jpsi.get(run, 0)) for run in sorted(n_all)]
+
+
+def read_ods_table(file_path):
+  """Rows (lists of cell texts) of the first sheet of an OpenDocument spreadsheet."""
+  ns = {'table': 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'}
+  repeated = f"{{{ns['table']}}}number-columns-repeated"
+  with zipfile.ZipFile(file_path) as z:
+    root = ET.fromstring(z.read('content.xml'))
+  sheet = root.find('.//table:table', ns)
+  rows = []
+  for row in sheet.iter(f"{{{ns['table']}}}table-row"):
+    cells = []
+    for cell in row.findall('table:table-cell', ns):
+      text = ''.join(cell.itertext())
+      # repeated empty cells fill the rest of the row: keep only one
+      cells += [text] * (int(cell.get(repeated, '1')) if text else 1)
+    rows.append(cells)
+  return rows
+
+
+def trigger_rows(file_path):
+  """(run, trigger, count) of a trigger count spreadsheet: a header 'run, <trigger>, ...' and one row per run (as trg-count-25ae.cvs)."""
+  rows = read_ods_table(file_path)
+  header = rows[0]
+  triggers = []
+  for cells in rows[1:]:
+    if not cells or not cells[0].strip().isdigit():
+      continue
+    for trigger, value in zip(header[1:], cells[1:]):
+      if trigger and value.strip():
+        triggers.append((int(cells[0]), trigger, float(value)))
+  return triggers
+
+
+# QUERIES --------------------------------------------------------------
+
+def run_yields(db, lumi_histo='hLumiTCE', trigger=None, train=None):
+  """
+  One row per run: (run, candidates, J/psi candidates, lumi from lumi_histo, trigger count, J/psi candidates per unit lumi).
+  trigger is the trigger to report (the first one in the index if None); train restricts lumi and candidates to one train.
+  """
+  if trigger is None:
+    row = db.execute('SELECT trigger FROM triggers ORDER BY rowid LIMIT 1').fetchone()
+    trigger = row[0] if row else ''
+  train_cut = 'AND s.train = :train' if train is not None else ''
+  query = f"""
+    WITH c AS (SELECT run, SUM(n_all) AS n_all, SUM(n_jpsi) AS n_jpsi FROM candidates JOIN sources s ON s.path = source
+               WHERE 1 {train_cut} GROUP BY run),
+         l AS (SELECT run, SUM(value) AS lumi FROM lumi JOIN sources s ON s.path = source
+               WHERE histo = :histo {train_cut} GROUP BY run),
+         t AS (SELECT run, MAX(count) AS count FROM triggers WHERE trigger = :trigger GROUP BY run),
+         r AS (SELECT run FROM c UNION SELECT run FROM l UNION SELECT run FROM t)
+    SELECT r.run, c.n_all, c.n_jpsi, l.lumi, t.count, c.n_jpsi / l.lumi
+    FROM r LEFT JOIN c ON c.run = r.run LEFT JOIN l ON l.run = r.run LEFT JOIN t ON t.run = r.run
+    ORDER BY r.run
+  """
+  return db.execute(query, {'histo': lumi_histo, 'trigger': trigger, 'train': train}).fetchall()
@@ -0,0 +1,1127 @@
+# run of an O2Physics task as done by scripts/run-task.py, as a library: TaskRun validates the options and the inputs,
+# plans the commands, splits the input list in chunks, runs the analysis (or the sub-jobs) and merges the outputs,
+# in the calling process and in a given directory, so that a scan runs its points without starting python for each one.
+# What the runs read is kept for the next runs of the same process, as long as the files it is read from do not change:
+# the parsed configs, the input lists, the file sizes of their sidecars, the AO2D index entries, the digests of the
+# executables and of the input files of a list (computed again when the size or the mtime of one of the files changes)
+
+import os
+import copy
+import json
+import time
+import types
+import shutil
+import hashlib
+import re
+import signal
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from listMeta import SIDECAR_SUFFIX, load_sidecar
+from jobStats import run_measured, kill_groups, report_row, write_report, print_summary
+from resultCache import config_digest, inputs_digest, cache_key, fetch, store, detach
+
+UTILITIES_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'utilities'))
+
+# options of a run, named and with the defaults of the options of run-task.py
+OPTIONS = {
+  'json_file': None, 'data_file': None,
+  'script': 'o2-analysis-ud-fwd-muons-upc', 'services': None, 'data_type': 'reco', 'dry_run': False,
+  'use_sub_jobs': False, 'chunk_num': None, 'chunk_max_size': None, 'chunk_count': None, 'chunk_events': None,
+  'chunk_group': None, 'event_table': None, 'jobs_dir': 'jobs', 'max_parallel': None, 'mem_budget': None,
+  'merge_fan_in': None, 'merge_parallel': 2, 'rerun_all': False, 'runs': None, 'aod_index': None,
+  'rss_limit': None, 'mem_per_input': 1.0, 'cache_dir': None, 'cache_max_size': 100.,
+}
+
+
+class RunTaskError(Exception):
+  """Error that stops a run; code is the exit code of run-task.py."""
+
+  def __init__(self, message, code=1):
+    super().__init__(message)
+    self.code = code
+
+
+# CACHE ----------------------------------------------------------------
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _stamp(paths):
+  stamps = []
+  for path in paths:
+    try:
+      st = os.stat(path)
+      stamps.append((st.st_size, st.st_mtime_ns))
+    except OSError:
+      stamps.append(None)
+  return tuple(stamps)
+
+
+def _cached(kind, paths, compute):
+  """
+  Value of compute() for the files paths (a path or a tuple of paths), computed again only when the size
+  or the mtime of one of them changed since the last call of the process.
+  """
+  paths = (paths,) if isinstance(paths, str) else tuple(paths)
+  with _cache_lock:
+    hit = _cache.get((kind, paths))
+  if hit and hit[0] == _stamp(paths):
+    return hit[1]
+  value = compute()
+  # stamped after compute, that may write the files (e.g. the AO2D index)
+  with _cache_lock:
+    _cache[(kind, paths)] = (_stamp(paths), value)
+  return value
+
+
+def clear_cache():
+  """Forget the files read by the earlier runs."""
+  with _cache_lock:
+    _cache.clear()
+
+
+# HELPERS --------------------------------------------------------------
+
+def resolve_list_entry(line, cwd):
+  """Return a line of an input list with relative paths made absolute w.r.t. cwd, so it can be read from another directory."""
+  entry = line.strip()
+  if ':' in entry or entry.startswith('~') or os.path.isabs(entry):
+    return entry + '\n'
+  return os.path.join(cwd, entry) + '\n'
+
+
+def input_file_path(line, list_dir):
+  """Return the absolute path of a file listed in an input list (relative paths are w.r.t. list_dir)."""
+  file_path = os.path.expanduser(line.strip())
+  if not os.path.isabs(file_path):
+    file_path = os.path.join(list_dir, file_path)
+  return os.path.abspath(file_path)
+
+
+def read_list(list_path):
+  """Non-empty lines of an input list, read again only if the list changed since the last call."""
+  def load():
+    with open(list_path, 'r') as f:
+      return [line for line in f if line.strip()]
+  return _cached('list', list_path, load)
+
+
+def read_config(path):
+  """Parsed JSON config, read again only if the file changed since the last call (the dict is shared: copy it to modify it)."""
+  def load():
+    with open(path, 'r') as f:
+      return json.load(f)
+  return _cached('config', path, load)
+
+
+def input_file_size(line, list_dir, known_sizes=None, say=print):
+  """
+  Return the size in bytes of a file listed in an input list (relative paths are w.r.t. list_dir), None if it cannot be read.
+  known_sizes (listed path -> size, see listed_sizes) avoids a stat of the file.
+  """
+  if known_sizes and line.strip() in known_sizes:
+    return known_sizes[line.strip()]
+  file_path = input_file_path(line, list_dir)
+  try:
+    return os.path.getsize(file_path)
+  except OSError as e:
+    say(f'Warning: Could not get size for {file_path}: {e}.')
+    return None
+
+
+def listed_sizes(list_path):
+  """Sizes of the files of an input list from its sidecar, written by write-content.py --metadata (empty if there is none)."""
+  return _cached('sizes', (list_path, list_path + SIDECAR_SUFFIX),
+                 lambda: {path: stat['size'] for path, stat in load_sidecar(list_path)['files'].items()})
+
+
+def indexed_inputs(lines, list_dir, index_path, workers=1, say=print):
+  """
+  Return the metadata in the AO2D index (see aodIndex.py) of the files of the input list, as a list aligned with lines
+  (None for the files that do not exist or cannot be read). The files not indexed yet are read and added to index_path.
+  """
+  from aodIndex import update_index
+  paths = [input_file_path(line, list_dir) for line in lines]
+  for path in paths:
+    if not os.path.isfile(path):
+      say(f'Warning: {path} not found, it is not used.')
+  files = update_index([p for p in paths if os.path.isfile(p)], index_path, workers)
+  return [files.get(path) for path in paths]
+
+
+def select_runs(lines, entries, runs):
+  """Keep only the lines of the input list whose file (metadata from indexed_inputs) contains at least one of the runs."""
+  return [line for line, entry in zip(lines, entries) if entry and runs.intersection(entry['runs'])]
+
+
+def file_events(entry, table=None):
+  """Number of events of a file from its index metadata, or the entries of the tables whose name starts with table."""
+  if table is None:
+    return entry['events']
+  return sum(n for name, n in entry['entries'].items() if name.startswith(table))
+
+
+# how to find the group of files that have to stay in the same chunk, from the path of a file:
+# hy: the HY job directory (hy_NNNNNNN), run: a 6-digit directory named as the run number
+CHUNK_GROUPS = {
+  'hy': re.compile(r'(hy_\d+)'),
+  'run': re.compile(r'/(\d{6})/'),
+}
+
+
+def balanced_chunks(lines, sizes, n_chunks, group=None):
+  """
+  Split the files in at most n_chunks chunks of near-equal total size (longest processing time first):
+  the files (or the groups of files, if group is one of CHUNK_GROUPS) are taken from the largest,
+  and each one goes to the chunk that is the smallest at that moment.
+  Files without a group match are placed on their own.
+  Returns the list of chunks (lines in the order of the input list) and the list of their sizes in bytes.
+  """
+  groups = {}
+  for pos, (line, size) in enumerate(zip(lines, sizes)):
+    match = CHUNK_GROUPS[group].search(line) if group else None
+    key = match.group(1) if match else pos
+    members, total = groups.get(key, ([], 0))
+    groups[key] = (members + [pos], total + size)
+  heap = [(0, i, []) for i in range(min(n_chunks, len(groups)))]
+  for members, total in sorted(groups.values(), key=lambda g: g[1], reverse=True):
+    chunk_size, i, chunk = heapq.heappop(heap)
+    heapq.heappush(heap, (chunk_size + total, i, chunk + members))
+  chunks = sorted(heap, key=lambda c: min(c[2]))
+  return [[lines[pos] for pos in sorted(c[2])] for c in chunks], [c[0] for c in chunks]
+
+
+# file in the jobs directory with the peak RSS measured for the chunks of earlier runs
+MEM_HISTORY = 'mem-history.json'
+
+
+def chunk_hash(chunk):
+  """Hash of the list of files of a chunk, independent of their order."""
+  return hashlib.sha1('\n'.join(sorted(l.strip() for l in chunk)).encode()).hexdigest()
+
+
+def load_mem_history(jobs_dir, say=print):
+  """Return the list of the measurements saved in the jobs directory (empty if there are none)."""
+  path = os.path.join(jobs_dir, MEM_HISTORY)
+  if not os.path.isfile(path):
+    return []
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError) as e:
+    say(f'Warning: could not read {path}: {e}. Ignoring earlier memory measurements.')
+    return []
+
+
+def save_mem_history(jobs_dir, history):
+  """Save the measurements in the jobs directory, one entry per chunk content."""
+  with open(os.path.join(jobs_dir, MEM_HISTORY), 'w') as f:
+    json.dump(history, f, indent=2)
+
+
+def estimate_chunk_mem(chunk_hash_value, input_bytes, history, mem_per_input):
+  """
+  Estimate the peak RSS (bytes) of a chunk.
+  If the same chunk was measured in an earlier run its peak RSS is used (for a chunk that was split, the RSS
+  when it was killed); otherwise the input size is scaled by the largest RSS/input ratio measured so far
+  on chunks that completed, or by mem_per_input if nothing was measured yet.
+  """
+  for rec in history:
+    if rec['chunk_hash'] == chunk_hash_value:
+      return rec['peak_rss']
+  ratios = [rec['peak_rss'] / rec['input_bytes'] for rec in history if rec['input_bytes'] > 0 and 'split' not in rec]
+  ratio = max(ratios) if ratios else mem_per_input
+  return int(ratio * input_bytes)
+
+
+# file in the jobs directory that records, for each chunk, the hash of its inputs and the outputs it produced
+MANIFEST = 'manifest.json'
+
+
+def executable_digest(script):
+  """Digest of the analysis executable: its name and, if it is found in the PATH, its content."""
+  exe_path = shutil.which(script)
+  def digest():
+    h = hashlib.sha1(script.encode())
+    if exe_path:
+      with open(exe_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+          h.update(block)
+    return h.hexdigest()
+  return _cached('executable', exe_path or script, digest)
+
+
+
+def sub_job_inputs_hash(chunk_file, job_json, writer_json, exe_digest):
+  """
+  Hash of everything that determines the outputs of a sub-job: the file list of the chunk,
+  its config JSON and the tree writer JSON (both independent of the key order) and the executable.
+  """
+  h = hashlib.sha1()
+  with open(chunk_file, 'rb') as f:
+    h.update(f.read())
+  with open(job_json, 'r') as f:
+    job_config = json.load(f)
+  # the writer JSON is the same for all the chunks: it is parsed once
+  for config in (job_config, read_config(writer_json)):
+    h.update(json.dumps(config, sort_keys=True).encode())
+  h.update(exe_digest.encode())
+  return h.hexdigest()
+
+
+def load_manifest(jobs_dir, say=print):
+  """Return the manifest of the jobs directory as a dict chunk index (str) -> entry, empty if there is none."""
+  path = os.path.join(jobs_dir, MANIFEST)
+  if not os.path.isfile(path):
+    return {}
+  try:
+    with open(path, 'r') as f:
+      return json.load(f).get('chunks', {})
+  except (OSError, ValueError) as e:
+    say(f'Warning: could not read {path}: {e}. All the chunks will be run.')
+    return {}
+
+
+def load_splits(jobs_dir):
+  """
+  Return the chunks split for lack of memory in the earlier runs, from the manifest: chunk hash -> list of
+  {'idx', 'chunk'} of the chunks that replaced it (empty if there are none).
+  """
+  try:
+    with open(os.path.join(jobs_dir, MANIFEST), 'r') as f:
+      return json.load(f).get('splits', {})
+  except (OSError, ValueError):
+    return {}
+
+
+def save_manifest(jobs_dir, chunks, splits=None):
+  """Write the manifest through a temporary file, so an interrupted run never leaves it truncated."""
+  path = os.path.join(jobs_dir, MANIFEST)
+  with open(path + '.tmp', 'w') as f:
+    json.dump({'chunks': chunks, 'splits': splits or {}}, f, indent=2)
+  os.replace(path + '.tmp', path)
+
+
+def manifest_entry(job):
+  """Manifest entry of a successful sub-job: inputs hash, outputs and their sizes."""
+  dimu_exists = os.path.isfile(job['dimu_root'])
+  return {
+    'inputs_hash': job['inputs_hash'],
+    'analysis': os.path.basename(job['output_root']),
+    'analysis_size': os.path.getsize(job['output_root']),
+    'dimu': os.path.basename(job['dimu_root']) if dimu_exists else None,
+    'dimu_size': os.path.getsize(job['dimu_root']) if dimu_exists else None,
+  }
+
+
+def is_job_done(job, entry):
+  """True if the manifest entry has the same inputs hash as the job and its outputs are still there, with the same size."""
+  if not entry or entry.get('inputs_hash') != job['inputs_hash']:
+    return False
+  outputs = [(job['output_root'], entry.get('analysis_size'))]
+  if entry.get('dimu_size') is not None:
+    outputs.append((job['dimu_root'], entry['dimu_size']))
+  return all(os.path.isfile(path) and os.path.getsize(path) == size for path, size in outputs)
+
+
+def result_cache_key(config, input_path, chain, writer_json, runs=None):
+  """
+  Key of the outputs of a run in the result cache (see resultCache.py): the config, the input files (of the list
+  input_path, or the file itself) with their size and mtime, the executables of the chain, the tree writer JSON
+  and the selected runs.
+  """
+  if input_path.endswith('.txt'):
+    # the digest is stamped with the size and mtime of the input files themselves: it is computed again when
+    # one of them changes, also if it is rewritten in place (that changes neither the list nor its sidecar)
+    paths = tuple(input_file_path(line, os.path.dirname(input_path)) for line in read_list(input_path))
+    inputs = _cached('inputs', paths, lambda: inputs_digest(paths))
+  else:
+    inputs = inputs_digest([input_path])
+  writer = hashlib.sha1(json.dumps(read_config(writer_json), sort_keys=True).encode()).hexdigest()
+  return cache_key(config_digest(config), inputs, *[executable_digest(exe) for exe in chain],
+                   writer, ','.join(map(str, sorted(runs or []))))
+
+
+# exit codes of a job killed with SIGKILL (by the kernel OOM killer or by the RSS limit): directly or through the shell
+KILLED_CODES = (-signal.SIGKILL, 128 + signal.SIGKILL)
+
+
+def run_sub_job(job, poll_interval=0.5, rss_limit=None, running=None):
+  """
+  Run one sub-job inside its own working directory, then move its outputs into the jobs directory.
+  The job runs in its own process group, whose total RSS is sampled while it runs: if rss_limit (bytes)
+  is set and the RSS exceeds it, the whole group is killed. running is the set of the running process groups (see jobStats.run_measured).
+  Returns a dict with the job index, the exit code, an error message (None on success), the peak RSS in bytes,
+  the resources used by the job (see jobStats.run_measured) and 'oom', True if the job was killed
+  by the RSS limit or (with rss_limit set) by the OOM killer.
+  """
+  os.makedirs(job['workdir'], exist_ok=True)
+  # outputs of an earlier run of this chunk index (maybe with other files): a job that writes no tree must not leave
+  # the old one to the merge
+  for path in (job['output_root'], job['dimu_root']):
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+  over_limit = []
+  def watch(pid, rss):
+    if rss_limit is not None and rss > rss_limit and not over_limit:
+      over_limit.append(rss)
+      try:
+        os.killpg(pid, signal.SIGKILL)
+      except ProcessLookupError:
+        pass
+  stats = run_measured(job['cmd'], cwd=job['workdir'], log=job['log'], log_mode=job.get('log_mode', 'w'),
+                       poll_interval=poll_interval, on_poll=watch, running=running)
+  ret = stats['ret']
+  result = {'idx': job['idx'], 'ret': 0, 'msg': None, 'peak_rss': stats['peak_rss'], 'stats': stats, 'oom': False}
+  if over_limit:
+    result.update(ret=ret or 1, oom=True, msg=f'killed, RSS {over_limit[0]/1024**3:.2f} GB over the limit of {rss_limit/1024**3:.2f} GB')
+    return result
+  if ret != 0:
+    result.update(ret=ret, msg=f'analysis command failed with exit code {ret}')
+    if rss_limit is not None and ret in KILLED_CODES:
+      result.update(oom=True, msg=f'killed with exit code {ret}, probably out of memory')
+    return result
+  default_out = os.path.join(job['workdir'], 'AnalysisResults.root')
+  if not os.path.isfile(default_out):
+    result.update(ret=1, msg=f"expected output '{default_out}' not found, analysis may have failed")
+    return result
+  # every job owns its working directory, so these moves never race with other jobs
+  os.replace(default_out, job['output_root'])
+  dimu_src = os.path.join(job['workdir'], 'dimu.root')
+  if os.path.isfile(dimu_src):
+    os.replace(dimu_src, job['dimu_root'])
+  shutil.rmtree(job['workdir'], ignore_errors=True)
+  return result
+
+
+def run_sub_jobs(jobs, max_parallel, mem_budget=None, on_done=None, rss_limit=None, split=None, say=print):
+  """
+  Run the sub-jobs with at most max_parallel of them at the same time.
+  If mem_budget (bytes) is set, the jobs are started from the largest estimated memory ('mem' key of the job),
+  and a job is started only if the estimated memory of all the running jobs stays within the budget
+  (a job that alone exceeds the budget is run when nothing else is running).
+  rss_limit (bytes) is the RSS limit of each job (see run_sub_job). A job killed for lack of memory
+  is passed to split(job), that returns the jobs replacing it (None if it cannot be split):
+  they are queued and the killed job does not count as a failure.
+  After the first failure no new job is started, the running ones are let finish; on an interrupt (or any exception) they are killed.
+  on_done(job, result), if given, is called from this thread as soon as each job ends; the messages go through say.
+  Returns a dict job index -> result of run_sub_job for all the jobs that were run.
+  """
+  results = {}
+  pending = list(jobs)
+  if mem_budget is not None:
+    pending.sort(key=lambda job: job['mem'], reverse=True)
+  running = {}
+  groups = set()  # process groups of the running jobs
+  used_mem = 0
+  failed = False
+  with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+    try:
+      while pending or running:
+        for job in list(pending):
+          if failed or len(running) >= max_parallel:
+            break
+          if mem_budget is not None and running and used_mem + job['mem'] > mem_budget:
+            continue  # a smaller job may still fit
+          pending.remove(job)
+          used_mem += job.get('mem', 0)
+          if mem_budget is not None:
+            say(f"  Starting sub-job {job['idx']} (estimated memory {job['mem']/1024**3:.2f} GB, "
+                f"in use {used_mem/1024**3:.2f}/{mem_budget/1024**3:.2f} GB)")
+          else:
+            say(f"  Starting sub-job {job['idx']}")
+          running[pool.submit(run_sub_job, job, rss_limit=rss_limit, running=groups)] = job
+        if not running:
+          break
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+          job = running.pop(future)
+          used_mem -= job.get('mem', 0)
+          result = future.result()
+          results[result['idx']] = result
+          if on_done:
+            on_done(job, result)
+          parts = split(job) if result['oom'] and split else None
+          if parts:
+            say(f"  Sub-job {result['idx']} {result['msg']}: split into sub-jobs {', '.join(str(p['idx']) for p in parts)}")
+            pending += parts
+            if mem_budget is not None:
+              pending.sort(key=lambda job: job['mem'], reverse=True)
+          elif result['ret'] != 0:
+            say(f"Error: sub-job {result['idx']}: {result['msg']}")
+            failed = True
+          else:
+            say(f"  Sub-job {result['idx']} completed (peak RSS {result['peak_rss']/1024**3:.2f} GB)")
+    except BaseException:
+      # interrupted (Ctrl-C) or failed here: the jobs are in their own sessions, they would go on running
+      kill_groups(groups)
+      raise
+  return results
+
+
+def merge_files(kind, inputs, output, list_file, log=None, say=print, running=None):
+  """
+  Merge the input files into output and return the resources used by the merge, with its exit code in 'ret':
+  kind 'analysis' merges histograms with hadd, kind 'dimu' merges trees with o2-aod-merger (reading list_file).
+  """
+  if kind == 'analysis':
+    cmd = f"hadd -f {output} {' '.join(inputs)}"
+  else:
+    with open(list_file, 'w') as f:
+      f.writelines(path + '\n' for path in inputs)
+    cmd = f"o2-aod-merger --input {list_file} --output {output} --max-size 1000000000"
+  say(f'  Merging {len(inputs)} {kind} file(s) into {output}')
+  return run_measured(cmd, log=log, running=running)
+
+
+class TreeMerger:
+  """
+  Merge the outputs of the sub-jobs with a tree reduction of bounded fan-in.
+  The files are merged in groups of fan_in as soon as enough of them are available (also while other
+  sub-jobs are still running), the intermediate files are then merged again, up to the final merge.
+  At most fan_in files are open in one merge, and the merges run on the given thread pool.
+  """
+
+  def __init__(self, kind, final_output, tmp_dir, fan_in, pool, say=print):
+    self.kind = kind
+    self.say = say
+    self.final_output = final_output
+    self.tmp_dir = tmp_dir
+    self.fan_in = fan_in
+    self.pool = pool
+    self.ready = []          # files waiting to be merged
+    self.running = []        # (future, inputs, output) of the merges in progress
+    self.intermediates = set()
+    self.counter = 0
+    self.error = None
+    self.report = []         # report rows of the merges done
+    self.groups = set()      # process groups of the running merges
+    os.makedirs(tmp_dir, exist_ok=True)
+
+  def add(self, path):
+    """Add a file to merge, and start a merge if there are enough files waiting."""
+    self.ready.append(path)
+    self._collect()
+    while len(self.ready) >= self.fan_in and not self.error:
+      self._submit(self.ready[:self.fan_in])
+      del self.ready[:self.fan_in]
+
+  def _submit(self, inputs):
+    self.counter += 1
+    name = f'{self.kind}-merge-{self.counter}'
+    output = os.path.join(self.tmp_dir, f'{name}.root')
+    future = self.pool.submit(merge_files, self.kind, inputs, output,
+                              os.path.join(self.tmp_dir, f'{name}-list.txt'), os.path.join(self.tmp_dir, f'{name}.log'), self.say, self.groups)
+    self.running.append((future, inputs, output))
+
+  def _collect(self, block=False):
+    """Move the outputs of the finished merges to the files waiting to be merged."""
+    if block and self.running:
+      wait([future for future, _, _ in self.running], return_when=FIRST_COMPLETED)
+    still_running = []
+    for future, inputs, output in self.running:
+      if not future.done():
+        still_running.append((future, inputs, output))
+        continue
+      stats = future.result()
+      self.report.append(report_row('merge', os.path.basename(output), stats, sum(os.path.getsize(p) for p in inputs if os.path.isfile(p))))
+      if stats['ret'] != 0:
+        self.error = f"merging {len(inputs)} {self.kind} file(s) into {output} failed with exit code {stats['ret']}"
+        continue
+      self._remove_intermediates(inputs)
+      self.intermediates.add(output)
+      self.ready.append(output)
+    self.running = still_running
+
+  def _remove_intermediates(self, paths):
+    # the outputs of the sub-jobs are kept (they are needed to resume), only the intermediate merges are removed
+    for path in paths:
+      if path in self.intermediates:
+        self.intermediates.discard(path)
+        os.remove(path)
+
+  def abort(self):
+    """Cancel the merges not started yet and kill the running ones (after an interrupt or a failure)."""
+    for future, _, _ in self.running:
+      future.cancel()
+    kill_groups(self.groups)
+
+  def finish(self):
+    """Wait for the running merges and merge what is left into the final output. Returns an error message, or None."""
+    try:
+      return self._finish()
+    except BaseException:
+      self.abort()
+      raise
+
+  def _finish(self):
+    while True:
+      while self.running:
+        self._collect(block=True)
+      if self.error:
+        return self.error
+      if len(self.ready) <= self.fan_in:
+        break
+      groups = [self.ready[i:i+self.fan_in] for i in range(0, len(self.ready), self.fan_in)]
+      self.ready = []
+      for group in groups:
+        if len(group) == 1:
+          self.ready.append(group[0])
+        else:
+          self._submit(group)
+    if not self.ready:
+      self.say(f'Warning: no {self.kind} file to merge.')
+      return None
+    input_bytes = sum(os.path.getsize(p) for p in self.ready if os.path.isfile(p))
+    stats = merge_files(self.kind, self.ready, self.final_output,
+                        os.path.join(self.tmp_dir, f'{self.kind}-final-list.txt'), say=self.say)
+    self.report.append(report_row('merge', os.path.basename(self.final_output), stats, input_bytes))
+    if stats['ret'] != 0:
+      return f"merging {len(self.ready)} {self.kind} file(s) into {self.final_output} failed with exit code {stats['ret']}"
+    self._remove_intermediates(self.ready)
+    return None
+
+
+# RUN ------------------------------------------------------------------
+
+class TaskRun:
+  """
+  One run of the task with the options of run-task.py (keyword arguments named as in OPTIONS), in the directory cwd
+  (default: the current one): the relative paths of the options are w.r.t. it, and the outputs are written in it.
+  The messages and the output of the commands are appended to the file log, or printed (with several sub-jobs at
+  the same time each one writes in its own log). run does the steps validate, plan, chunk (with sub-jobs), execute
+  and merge; then stats has the resources used by all the commands (as jobStats.run_measured, with the CPU time
+  and the I/O summed and the largest peak RSS) and outputs the final files.
+  """
+
+  def __init__(self, cwd=None, log=None, **options):
+    unknown = sorted(set(options) - set(OPTIONS))
+    if unknown:
+      raise TypeError(f"unknown option(s) of the run: {', '.join(unknown)}")
+    self.opts = types.SimpleNamespace(**{**OPTIONS, **options})
+    self.cwd = os.path.abspath(cwd or os.getcwd())
+    self.log = log
+    self._log_lock = threading.Lock()
+    self.stats = {'ret': 0, 'wall': 0., 'cpu': 0., 'peak_rss': 0, 'read': 0, 'write': 0, 'disk_read': 0, 'disk_write': 0}
+    self.config = None
+    self.input_path = None
+    self.outputs = {}
+    self.sub_jobs = []
+    self.report = []
+    self.mergers = None
+
+  def say(self, message=''):
+    """Print a message, or append it to the log of the run (also from the threads of the merges)."""
+    if not self.log:
+      print(message)
+      return
+    with self._log_lock, open(self.log, 'a') as f:
+      f.write(message + '\n')
+
+  def _path(self, path):
+    return os.path.join(self.cwd, path)
+
+  def _measured(self, stats):
+    """Add the resources used by a command to the ones of the run."""
+    for key in ('cpu', 'read', 'write', 'disk_read', 'disk_write'):
+      self.stats[key] += stats[key]
+    self.stats['peak_rss'] = max(self.stats['peak_rss'], stats['peak_rss'])
+    return stats
+
+  def _run(self, cmd):
+    return self._measured(run_measured(cmd, cwd=self.cwd, log=self.log, log_mode='a'))
+
+  def _runs(self):
+    """Runs selected with the runs option (comma separated, or a file w.r.t. the directory of the run), None if not set."""
+    if not self.opts.runs:
+      return None
+    from aodIndex import parse_runs
+    spec = self._path(self.opts.runs)
+    return parse_runs(spec if os.path.isfile(spec) else self.opts.runs)
+
+  def validate(self):
+    """Check the options and the input files."""
+    o = self.opts
+    if bool(o.json_file) == bool(o.data_file):
+      raise RunTaskError('one of json_file (--json) and data_file (--data) is needed.')
+    # chunking and jobs-dir options are only used with sub-jobs
+    if (o.chunk_num is not None or o.chunk_max_size is not None or o.chunk_count is not None or o.chunk_events is not None or o.jobs_dir != 'jobs' or o.max_parallel is not None or o.mem_budget is not None or o.rerun_all or o.merge_fan_in is not None or o.runs is not None or o.rss_limit is not None) and not o.use_sub_jobs:
+      raise RunTaskError('--chunk-num, --chunk-max-size, --chunk-count, --chunk-events, --jobs-dir, --max-parallel, --mem-budget, --merge-fan-in, --rerun-all, --runs and --rss-limit can only be used if --use-sub-jobs is set.')
+    if o.merge_fan_in is not None and o.merge_fan_in < 2:
+      raise RunTaskError('--merge-fan-in must be at least 2.')
+    if o.merge_parallel < 1:
+      raise RunTaskError('--merge-parallel must be at least 1.')
+    if o.chunk_group and o.chunk_count is None and o.chunk_events is None:
+      raise RunTaskError('--chunk-group can only be used with --chunk-count or --chunk-events.')
+    if o.chunk_count is not None and o.chunk_count < 1:
+      raise RunTaskError('--chunk-count must be at least 1.')
+    if o.chunk_events is not None and o.chunk_events < 1:
+      raise RunTaskError('--chunk-events must be at least 1.')
+    if o.rss_limit is not None and o.rss_limit <= 0:
+      raise RunTaskError('--rss-limit must be positive.')
+    if o.event_table and o.chunk_events is None:
+      raise RunTaskError('--event-table can only be used with --chunk-events.')
+    if o.cache_dir and not o.json_file:
+      raise RunTaskError('--cache-dir can only be used with --json.')
+    self.max_parallel = o.max_parallel
+    if self.max_parallel is None:
+      self.max_parallel = (os.cpu_count() or 1) if o.mem_budget is not None else 1
+    if self.max_parallel < 1:
+      raise RunTaskError('--max-parallel must be at least 1.')
+    if o.mem_budget is not None and o.mem_budget <= 0:
+      raise RunTaskError('--mem-budget must be positive.')
+
+    # Required utility files: the tree writer JSON is used from the utilities, not copied in the directory of the run
+    self.in_list = os.path.join(UTILITIES_DIR, 'in.txt')
+    self.writer_json = os.path.join(UTILITIES_DIR, f'tree-{o.data_type}.json')
+    required = [self.in_list, self.writer_json]
+    if o.json_file:
+      self.json_path = self._path(o.json_file)
+      required.append(self.json_path)
+      if os.path.isfile(self.json_path):
+        try:
+          self.config = read_config(self.json_path)
+        except ValueError as e:
+          raise RunTaskError(f'Could not parse config JSON: {e}')
+        # 'aod-file-private' under 'internal-dpl-aod-reader', with a leading '@' for a list
+        aod_file_private = self.config.get('internal-dpl-aod-reader', {}).get('aod-file-private', None)
+        if not aod_file_private or str(aod_file_private).strip() == "":
+          raise RunTaskError(f"'aod-file-private' is missing or empty {self.json_path} in config JSON.")
+        self.input_path = self._path(str(aod_file_private).lstrip('@'))
+        if not os.path.isfile(self.input_path):
+          raise RunTaskError(f"Input file specified in config ('aod-file-private'): {self.input_path} not found.")
+        required.append(self.input_path)
+    else:
+      self.data_path = self._path(o.data_file)
+      required.append(self.data_path)
+    missing = [f for f in required if not os.path.isfile(f)]
+    if missing:
+      raise RunTaskError('Missing required file(s): ' + ', '.join(missing))
+    self.say('Input files verified:')
+    for f in required:
+      self.say(f'  - {f}')
+
+  def plan(self):
+    """Build the analysis and merge commands and the paths of the outputs."""
+    o = self.opts
+    if o.json_file:
+      source = f'--configuration json://{self.json_path}'
+      self.base = os.path.splitext(os.path.basename(o.json_file))[0]
+      output_root = self._path(f'{self.base}-AnalysisResults.root')
+      tree_output = self._path(f'{self.base}-tree.root')
+    else:
+      source = f'--aod-file {self.data_path}'
+      output_root = self._path('AnalysisResults.root')
+      tree_output = self._path(f'{o.data_type}-tree.root')
+    # services piped after the analysis, then the tree writer configuration
+    self.cmd_analysis = f'{o.script} {source}'
+    for service in o.services or []:
+      self.cmd_analysis += f' | {service} {source}'
+    self.cmd_analysis += f' --aod-writer-json {self.writer_json} -b'
+    self.cmd_merge = f'o2-aod-merger --input {self.in_list} --output {tree_output} --max-size 1000000000'
+    self.outputs = {'AnalysisResults.root': output_root, 'tree.root': tree_output}
+    # with sub-jobs a txt input list is split in chunks, and the main analysis/merge is not run
+    self.sub_jobs_mode = bool(o.use_sub_jobs and o.json_file and self.input_path.endswith('.txt'))
+    self.say('\nCommands to be executed:')
+    self.say(f'  Analysis: {self.cmd_analysis}')
+    self.say(f'  Merge:    {self.cmd_merge}\n')
+
+  def cache_key(self):
+    """Key of the outputs of the run in the result cache, None without cache_dir."""
+    o = self.opts
+    if not o.cache_dir:
+      return None
+    # the services are not used by the sub-jobs
+    chain = [o.script] + ([] if self.sub_jobs_mode else (o.services or []))
+    return result_cache_key(self.config, self.input_path, chain, self.writer_json, self._runs())
+
+  def chunk(self):
+    """Split the input list in chunks and write the file list and the config of the sub-job of each one."""
+    o = self.opts
+    self.jobs_dir = self._path(o.jobs_dir)
+    os.makedirs(self.jobs_dir, exist_ok=True)
+    self.list_dir = os.path.dirname(self.input_path)
+    lines = read_list(self.input_path)
+    # sizes of the files from the sidecar of the list, if any
+    self.known_sizes = listed_sizes(self.input_path)
+    if self.known_sizes:
+      self.say(f'File sizes from {self.input_path + SIDECAR_SUFFIX}')
+    # runs and events of the files from the AO2D index, if needed
+    entries = None
+    if o.runs or o.chunk_events:
+      from aodIndex import INDEX
+      index_path = self._path(o.aod_index) if o.aod_index else os.path.join(self.list_dir, INDEX)
+      entries = _cached('index', (self.input_path, index_path),
+                        lambda: indexed_inputs(lines, self.list_dir, index_path, self.max_parallel, self.say))
+    if o.runs:
+      # keep only the files with the requested runs
+      runs = self._runs()
+      n_lines = len(lines)
+      kept = select_runs(lines, entries, runs)
+      entries = [entry for line, entry in zip(lines, entries) if line in kept]
+      lines = kept
+      self.say(f'Run selection: {len(lines)} of {n_lines} files contain at least one of the {len(runs)} requested runs.')
+      if not lines:
+        raise RunTaskError('no input file contains the requested runs.')
+    # events of each file, to report the throughput of the chunks
+    self.entry_of = dict(zip(lines, entries)) if entries is not None else {}
+    if o.chunk_max_size:
+      # Chunk by total data size (in GB)
+      chunk_max_bytes = o.chunk_max_size * 1024**3
+      chunks = []
+      current_chunk = []
+      current_size = 0
+      for line in lines:
+        fsize = self._size(line)
+        if fsize is None:
+          self.say('  Skipping it.')
+          continue
+        if current_size + fsize > chunk_max_bytes and current_chunk:
+          chunks.append(current_chunk)
+          current_chunk = []
+          current_size = 0
+        current_chunk.append(line)
+        current_size += fsize
+      if current_chunk:
+        chunks.append(current_chunk)
+      self.say(f'Chunking by max size: {o.chunk_max_size} GB per chunk, total {len(chunks)} chunks.')
+    elif o.chunk_count:
+      # Chunk in a fixed number of chunks with balanced data size
+      kept, sizes = [], []
+      for line in lines:
+        fsize = self._size(line)
+        if fsize is None:
+          self.say('  Skipping it.')
+          continue
+        kept.append(line)
+        sizes.append(fsize)
+      chunks, chunk_sizes = balanced_chunks(kept, sizes, o.chunk_count, o.chunk_group)
+      grouping = f', files grouped by {o.chunk_group}' if o.chunk_group else ''
+      self.say(f'Chunking by balanced size: {len(chunks)} chunks{grouping}.')
+      for idx, size in enumerate(chunk_sizes, 1):
+        self.say(f'  chunk {idx}: {size/1024**3:.3f} GB')
+      if chunk_sizes:
+        mean = sum(chunk_sizes) / len(chunk_sizes)
+        self.say(f'  largest/mean chunk size = {max(chunk_sizes)/mean if mean else 1.:.3f}')
+    elif o.chunk_events:
+      # Chunk with balanced event counts, as many chunks as needed to have about chunk_events events in each one
+      kept, events = [], []
+      for line, entry in zip(lines, entries):
+        if entry is None:
+          self.say(f'  Skipping {line.strip()}: not in the index.')
+          continue
+        kept.append(line)
+        events.append(file_events(entry, o.event_table))
+      n_chunks = max(1, -(-sum(events) // o.chunk_events))
+      chunks, chunk_events = balanced_chunks(kept, events, n_chunks, o.chunk_group)
+      grouping = f', files grouped by {o.chunk_group}' if o.chunk_group else ''
+      what = f'{o.event_table} entries' if o.event_table else 'events'
+      self.say(f'Chunking by {what}: {o.chunk_events} per chunk, total {len(chunks)} chunks{grouping}.')
+      for idx, n in enumerate(chunk_events, 1):
+        self.say(f'  chunk {idx}: {n} {what}')
+      if chunk_events:
+        mean = sum(chunk_events) / len(chunk_events)
+        self.say(f'  largest/mean chunk {what} = {max(chunk_events)/mean if mean else 1.:.3f}')
+    else:
+      # Default: chunk by number of lines (files)
+      chunk_num = o.chunk_num if o.chunk_num else 2
+      chunks = [lines[i:i+chunk_num] for i in range(0, len(lines), chunk_num)]
+      self.say(f'Chunking by number of files: {chunk_num} per chunk, total {len(chunks)} chunks.')
+
+    self.mem_history = load_mem_history(self.jobs_dir, self.say)
+    manifest = {} if o.rerun_all else load_manifest(self.jobs_dir, self.say)
+    self.exe_digest = executable_digest(o.script)
+    # the chunks split for lack of memory in an earlier run are replaced by their parts, with the same indices
+    # (if they do not clash with the chunks of this run), so the parts already done are not run again
+    self.splits = load_splits(self.jobs_dir)
+    planned = list(enumerate(chunks, 1))
+    used = {idx for idx, _ in planned}
+    expanded = []
+    while planned:
+      idx, chunk = planned.pop(0)
+      parts = self.splits.get(chunk_hash(chunk))
+      if not parts:
+        expanded.append((idx, chunk))
+        continue
+      self.say(f'Chunk {idx} was split in an earlier run for lack of memory: replaced by {len(parts)} chunks.')
+      replaced = []
+      for part in parts:
+        part_idx = part['idx'] if part['idx'] > len(chunks) and part['idx'] not in used else None
+        if part_idx is not None:
+          used.add(part_idx)
+        replaced.append((part_idx, part['chunk']))
+      planned[:0] = replaced
+    # indices for the parts that clashed with other chunks, and for the chunks split in this run
+    self._new_idx = (i for i in itertools.count(max(used) + 1 if used else 1) if i not in used)
+    self.sub_jobs = [self._make_job(idx if idx is not None else next(self._new_idx), chunk) for idx, chunk in expanded]
+    # skip the chunks already done with the same inputs in an earlier run
+    self.done_jobs = [job for job in self.sub_jobs if is_job_done(job, manifest.get(str(job['idx'])))]
+    self.to_run = [job for job in self.sub_jobs if job not in self.done_jobs]
+    if self.done_jobs:
+      self.say(f"\nSub-job(s) {', '.join(str(job['idx']) for job in self.done_jobs)} already done with the same inputs "
+               f"(see {os.path.join(self.jobs_dir, MANIFEST)}): not run again.")
+    # entries of chunks that do not exist anymore (e.g. different chunking) are dropped
+    self.manifest = {str(job['idx']): manifest[str(job['idx'])] for job in self.done_jobs}
+
+  def _size(self, line):
+    return input_file_size(line, self.list_dir, self.known_sizes, self.say)
+
+  def _make_job(self, idx, chunk):
+    """Write the file list and the config of a chunk, and return its sub-job."""
+    o = self.opts
+    chunk_file = os.path.join(self.jobs_dir, f'chunk-{idx}.txt')
+    with open(chunk_file, 'w') as fout:
+      # the job runs in its own directory: relative paths must not depend on the cwd
+      fout.writelines([resolve_list_entry(l, self.cwd) for l in chunk])
+    config = copy.deepcopy(self.config)
+    config['internal-dpl-aod-reader']['aod-file-private'] = '@' + chunk_file
+    job_json = os.path.join(self.jobs_dir, f'{self.base}-job-{idx}.json')
+    with open(job_json, 'w') as jf:
+      json.dump(config, jf, indent=2)
+    cmd_analysis = (
+      f"{o.script} --configuration json://{job_json} "
+      f"--aod-writer-json {self.writer_json} -b"
+    )
+    output_root = os.path.join(self.jobs_dir, f"{self.base}-AnalysisResults-job-{idx}.root")
+    self.say(f'\nSub-job {idx}:')
+    self.say(f'  Analysis: {cmd_analysis}')
+    self.say(f'  Output:   {output_root}')
+    input_bytes = sum(self._size(l) or 0 for l in chunk)
+    chunk_entries = [self.entry_of.get(l) for l in chunk]
+    events = sum(file_events(e, o.event_table) for e in chunk_entries) if chunk_entries and all(chunk_entries) else None
+    this_hash = chunk_hash(chunk)
+    mem = estimate_chunk_mem(this_hash, input_bytes, self.mem_history, o.mem_per_input)
+    if o.mem_budget is not None:
+      self.say(f'  Input:    {input_bytes/1024**3:.2f} GB, estimated memory {mem/1024**3:.2f} GB')
+      if mem > o.mem_budget * 1024**3:
+        self.say(f'  Warning: the estimated memory exceeds --mem-budget, the chunk will run alone.')
+    # with several jobs at the same time the output would be mixed: one log per job
+    own_log = self.max_parallel > 1
+    return {
+      'idx': idx,
+      'inputs_hash': sub_job_inputs_hash(chunk_file, job_json, self.writer_json, self.exe_digest),
+      'chunk_hash': this_hash,
+      'input_bytes': input_bytes,
+      'events': events,
+      'mem': mem,
+      'chunk': chunk,
+      'cmd': cmd_analysis,
+      'workdir': os.path.join(self.jobs_dir, f'job-{idx}'),
+      'output_root': output_root,
+      'dimu_root': os.path.join(self.jobs_dir, f'dimu-job-{idx}.root'),
+      'log': os.path.join(self.jobs_dir, f'job-{idx}.log') if own_log else self.log,
+      'log_mode': 'w' if own_log else 'a',
+    }
+
+  def _split_job(self, job):
+    """Replace a chunk killed for lack of memory by two chunks with half of its input each (None if it has one file)."""
+    if len(job['chunk']) < 2:
+      return None
+    sizes = [self._size(l) or 0 for l in job['chunk']]
+    halves, _ = balanced_chunks(job['chunk'], sizes, 2)
+    if len(halves) < 2 or not all(halves):
+      middle = len(job['chunk']) // 2
+      halves = [job['chunk'][:middle], job['chunk'][middle:]]
+    parts = [self._make_job(next(self._new_idx), half) for half in halves]
+    # the merge lists are made from the chunks in sub_jobs
+    pos = self.sub_jobs.index(job)
+    self.sub_jobs[pos:pos + 1] = parts
+    # the next runs replace the chunk by the same parts, and do not run again those already done
+    self.splits[job['chunk_hash']] = [{'idx': p['idx'], 'chunk': p['chunk']} for p in parts]
+    save_manifest(self.jobs_dir, self.manifest, self.splits)
+    self.rss_records[job['chunk_hash']] = {'chunk_hash': job['chunk_hash'], 'input_bytes': job['input_bytes'],
+                                        'peak_rss': job['peak_rss'], 'split': [p['chunk_hash'] for p in parts]}
+    return parts
+
+  def _feed_mergers(self, job):
+    if self.mergers:
+      self.mergers['analysis'].add(job['output_root'])
+      if os.path.isfile(job['dimu_root']):
+        self.mergers['dimu'].add(job['dimu_root'])
+
+  def _save_report(self):
+    """Write the resources used by the sub-jobs and by the merges in the jobs directory."""
+    rows = self.report + (self.mergers['analysis'].report + self.mergers['dimu'].report if self.mergers else [])
+    if rows:
+      report_base = os.path.join(self.jobs_dir, 'run-report')
+      print_summary(write_report(report_base, rows, time.monotonic() - self._start), rows, self.say)
+      self.say(f'  Report written in {report_base}.json and {report_base}.csv')
+
+  def _abort(self, message, code=1):
+    if self.mergers:
+      self.merge_pool.shutdown(cancel_futures=True)
+    self._save_report()
+    return RunTaskError(message, code)
+
+  def _stop_merges(self):
+    """Kill the merges started during the sub-jobs, after an interrupt."""
+    if self.mergers:
+      for merger in self.mergers.values():
+        merger.abort()
+      self.merge_pool.shutdown(cancel_futures=True)
+
+  def execute(self):
+    """Run the analysis on the whole input, or the sub-jobs of the chunks that are not done yet."""
+    o = self.opts
+    if not self.sub_jobs_mode:
+      ret = self._run(self.cmd_analysis)['ret']
+      if ret != 0:
+        raise RunTaskError(f'Analysis command failed with exit code {ret}', ret if ret > 0 else 1)
+      # Verify and rename output
+      default_out = self._path('AnalysisResults.root')
+      if not os.path.isfile(default_out):
+        raise RunTaskError(f"Expected output '{default_out}' not found. Analysis may have failed.")
+      os.replace(default_out, self.outputs['AnalysisResults.root'])
+      return
+    # with merge_fan_in the outputs are merged as soon as the sub-jobs produce them
+    if o.merge_fan_in:
+      self.merge_pool = ThreadPoolExecutor(max_workers=o.merge_parallel)
+      self.merge_tmp = os.path.join(self.jobs_dir, 'merge-tmp')
+      self.mergers = {
+        'analysis': TreeMerger('analysis', self.outputs['AnalysisResults.root'], self.merge_tmp, o.merge_fan_in, self.merge_pool, self.say),
+        'dimu': TreeMerger('dimu', self.outputs['tree.root'], self.merge_tmp, o.merge_fan_in, self.merge_pool, self.say),
+      }
+    for job in self.done_jobs:
+      self._feed_mergers(job)
+    # peak RSS of the chunks run here (also those split and their parts), for the memory estimates of the next runs
+    self.rss_records = {}
+    def record_job(job, result):
+      self._measured(result['stats'])
+      self.report.append(report_row('chunk', f"chunk-{job['idx']}", result['stats'], job['input_bytes'], job['events']))
+      job['peak_rss'] = result['peak_rss']
+      if result['ret'] == 0:
+        self.manifest[str(job['idx'])] = manifest_entry(job)
+        save_manifest(self.jobs_dir, self.manifest, self.splits)
+        self._feed_mergers(job)
+        if result['peak_rss'] > 0:
+          self.rss_records[job['chunk_hash']] = {'chunk_hash': job['chunk_hash'], 'input_bytes': job['input_bytes'],
+                                              'peak_rss': result['peak_rss']}
+    if self.to_run:
+      save_manifest(self.jobs_dir, self.manifest, self.splits)
+      self.say(f'\nRunning {len(self.to_run)} sub-jobs, at most {self.max_parallel} at the same time')
+      if o.mem_budget is not None:
+        self.say(f'  Memory budget: {o.mem_budget} GB')
+      try:
+        results = run_sub_jobs(self.to_run, self.max_parallel,
+                               o.mem_budget * 1024**3 if o.mem_budget is not None else None,
+                               on_done=record_job,
+                               rss_limit=o.rss_limit * 1024**3 if o.rss_limit is not None else None,
+                               split=self._split_job, say=self.say)
+      except BaseException:
+        self._stop_merges()
+        raise
+      # remember the measured peak RSS to estimate the memory of the next runs
+      if self.rss_records:
+        mem_history = [rec for rec in self.mem_history if rec['chunk_hash'] not in self.rss_records]
+        save_mem_history(self.jobs_dir, mem_history + list(self.rss_records.values()))
+      # the chunks that were split are not in sub_jobs anymore
+      current = {job['idx'] for job in self.sub_jobs}
+      failed = sorted(idx for idx, res in results.items() if res['ret'] != 0 and idx in current)
+      not_run = sorted(job['idx'] for job in self.to_run if job['idx'] not in results)
+      if failed:
+        if not_run:
+          self.say(f"  Sub-job(s) not started: {', '.join(map(str, not_run))}")
+        raise self._abort(f"sub-job(s) {', '.join(map(str, failed))} failed, outputs are not merged.")
+    self.say('All sub-jobs completed.')
+
+  def merge(self):
+    """Merge the trees written by the analysis, or the outputs of the sub-jobs (and write the report of the sub-jobs)."""
+    o = self.opts
+    final_analysis, final_dimu = self.outputs['AnalysisResults.root'], self.outputs['tree.root']
+    # the final outputs may be links to the result cache, that the merges must not rewrite
+    detach(final_dimu)
+    if not self.sub_jobs_mode:
+      self.say("\nData processed: merging the trees\n")
+      ret = self._run(self.cmd_merge)['ret']
+      if ret != 0:
+        raise RunTaskError(f'Merging trees failed with exit code {ret}', ret if ret > 0 else 1)
+      try:
+        os.remove(self._path('dimu.root'))
+      except FileNotFoundError:
+        pass
+      return
+    detach(final_analysis)
+    # Prepare merge lists: only the outputs of the chunks of this run
+    analysis_results = [job['output_root'] for job in self.sub_jobs]
+    analysis_list_file = os.path.join(self.jobs_dir, 'analysis_merge_list.txt')
+    with open(analysis_list_file, 'w') as f:
+      for fname in sorted(analysis_results):
+        f.write(fname + '\n')
+    dimu_files = [job['dimu_root'] for job in self.sub_jobs if os.path.isfile(job['dimu_root'])]
+    dimu_list_file = os.path.join(self.jobs_dir, 'dimu_merge_list.txt')
+    with open(dimu_list_file, 'w') as f:
+      for fname in sorted(dimu_files):
+        f.write(fname + '\n')
+    if self.mergers:
+      # Merge what is left of the tree merges started during the sub-jobs
+      self.say(f'  Merging in a tree, at most {o.merge_fan_in} files per merge')
+      for merger in self.mergers.values():
+        try:
+          error = merger.finish()
+        except BaseException:
+          self._stop_merges()
+          raise
+        if error:
+          raise self._abort(error)
+      for merger in self.mergers.values():
+        for row in merger.report:
+          self._measured(row)
+      self.merge_pool.shutdown()
+      shutil.rmtree(self.merge_tmp, ignore_errors=True)
+    else:
+      merge_cmd_analysis = f"hadd -f {final_analysis} {' '.join(sorted(analysis_results))}"
+      self.say(f'  Merging AnalysisResults (histograms) with hadd: {merge_cmd_analysis}')
+      stats = self._run(merge_cmd_analysis)
+      self.report.append(report_row('merge', os.path.basename(final_analysis), stats, sum(os.path.getsize(f) for f in analysis_results if os.path.isfile(f))))
+      if stats['ret'] != 0:
+        raise self._abort(f"Merging AnalysisResults with hadd failed with exit code {stats['ret']}", stats['ret'] if stats['ret'] > 0 else 1)
+      # Merge dimu.root files with o2-aod-merger
+      merge_cmd_dimu = f"o2-aod-merger --input {dimu_list_file} --output {final_dimu} --max-size 1000000000"
+      self.say(f'  Merging dimu.root files: {merge_cmd_dimu}')
+      stats = self._run(merge_cmd_dimu)
+      self.report.append(report_row('merge', os.path.basename(final_dimu), stats, sum(os.path.getsize(f) for f in dimu_files)))
+      if stats['ret'] != 0:
+        raise self._abort(f"Merging dimu.root files failed with exit code {stats['ret']}", stats['ret'] if stats['ret'] > 0 else 1)
+    self.say('All sub-jobs merged. Final outputs:')
+    self.say(f'  {final_analysis}')
+    self.say(f'  {final_dimu}')
+    self._save_report()
+
+  def run(self):
+    """Do all the steps of the run (only validate and plan with dry_run); raises RunTaskError if the run fails."""
+    o = self.opts
+    self._start = time.monotonic()
+    try:
+      self.validate()
+      self.plan()
+      if o.dry_run:
+        self.say('Dry-run mode: no commands will be executed.')
+        return
+      # outputs of a run with the same config, inputs and executables are taken from the result cache
+      key = self.cache_key()
+      if key:
+        if fetch(o.cache_dir, key, self.outputs):
+          self.say(f'Outputs of a run with the same config, inputs and executables found in the cache {o.cache_dir} (entry {key[:12]}):')
+          for path in self.outputs.values():
+            if os.path.isfile(path):
+              self.say(f'  {path}')
+          return
+        self.say(f'Entry {key[:12]} not in the cache {o.cache_dir}: running the task.')
+      if self.sub_jobs_mode:
+        self.chunk()
+      self.execute()
+      self.merge()
+      if key:
+        size = store(o.cache_dir, key, self.outputs, os.path.basename(self.json_path), o.cache_max_size * 1024**3)
+        self.say(f'Outputs added to the cache {o.cache_dir} (entry {key[:12]}, {size/1024**3:.3f} GB)')
+    except RunTaskError as e:
+      self.stats['ret'] = e.code
+      raise
+    finally:
+      self.stats['wall'] = time.monotonic() - self._start
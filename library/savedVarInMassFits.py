@@ -0,0 +1,43 @@
+# variables saved from the mass fits: python counterpart of savedVarInMassFits.h
+# fitJPsi.cpp writes one tree per bin (tree_phi<bin>_pt1) with one entry, in <identifier>/<class>/massFitRes_<N>phi_1pt.root
+
+import re
+
+import uproot
+
+# branches of the tree of the fit results (same as createSaveFitTree in savedVarInMassFits.h)
+SAVED_BRANCHES = [
+  'numJPsi', 'errNumJPsi',
+  'numBkg', 'errNumBkg',
+  'AxECohJPsi', 'errAxECohJPsi',
+  'numJPsiCorr', 'errNumJPsiCorr',
+  'AxEMumuMid', 'errAxEMumuMid',
+  'numBkgCorr', 'errNumBkgCorr',
+  'entries', 'errEntries',
+]
+
+# name of the tree of a bin
+BIN_TREE = re.compile(r'tree_phi(\d+)_pt(\d+)$')
+
+
+def result_file_name(n_bins):
+  """Name of the file of the results of fitJPsi.cpp for n_bins bins."""
+  return f'massFitRes_{n_bins}phi_1pt.root'
+
+
+def read_fit_results(file_path):
+  """Read the trees of a file of fit results: list of dicts with 'bin' and the saved variables, ordered by bin."""
+  rows = []
+  with uproot.open(file_path) as f:
+    # last cycle of each tree
+    trees = {}
+    for key, class_name in f.classnames().items():
+      name, cycle = key.split(';')
+      if class_name == 'TTree' and BIN_TREE.match(name) and int(cycle) > trees.get(name, (0, None))[0]:
+        trees[name] = (int(cycle), key)
+    for name, (_, key) in trees.items():
+      match = BIN_TREE.match(name)
+      arrays = f[key].arrays(SAVED_BRANCHES, library='np')
+      for i in range(len(arrays['numJPsi'])):
+        rows.append({'bin': int(match.group(1)), **{b: float(arrays[b][i]) for b in SAVED_BRANCHES}})
+  return sorted(rows, key=lambda r: r['bin'])
@@ -0,0 +1,81 @@
+# toy Monte Carlo of the mass fits: pseudo-datasets generated from the model of massFit.py with given (usually
+# fitted) parameters, all the toys in one batch of numpy arrays, fitted again with massFit.fit_many.
+# The yields of each component are Poisson around their true value (the fits are extended), the masses
+# are drawn by inverting the cumulative distribution of each component on a fine grid.
+# From the fits: bias, pulls (fit - true)/error and coverage of the 1 sigma interval of each parameter
+
+import numpy as np
+
+from massFit import YIELDS, fit_many
+
+# points of the grid on which the cumulative distributions are inverted
+CDF_POINTS = 4001
+
+
+def _params(params):
+  """Parameters as arrays (1, 1), as the model wants them."""
+  return {name: np.array([[float(value)]]) for name, value in params.items()}
+
+
+def generate(model, params, n_toys, rng, edges=None):
+  """
+  Generate n_toys pseudo-datasets with the true parameters params (dict with all massFit.PARAMS). Unbinned: list of
+  arrays of masses; binned (edges given): array (n_toys, bins) of Poisson counts around the expected content of each bin.
+  """
+  p = _params(params)
+  yields = np.array([params[name] for name in YIELDS], dtype=float)
+  if edges is not None:
+    fractions = model.bin_fractions(np.asarray(edges, dtype=float), p)
+    expected = sum(y * f[0] for y, f in zip(yields, fractions))
+    return rng.poisson(expected, size=(n_toys, len(expected))).astype(float)
+  counts = rng.poisson(yields, size=(n_toys, len(yields)))
+  grid = np.linspace(model.low, model.high, CDF_POINTS)
+  cdfs = [c[0] for c in model.cumulative(grid, p)]
+  # all the masses of a component for all the toys at once, then split toy by toy
+  masses = [np.interp(rng.random(counts[:, i].sum()), cdf, grid) for i, cdf in enumerate(cdfs)]
+  parts = [np.split(m, np.cumsum(counts[:, i])[:-1]) for i, m in enumerate(masses)]
+  return [np.concatenate([parts[i][t] for i in range(len(YIELDS))]) for t in range(n_toys)]
+
+
+def run_toys(model, params, n_toys, seed=1234, edges=None, workers=1, fit_model=None):
+  """
+  Generate n_toys pseudo-datasets with model (reproducible with the seed) and fit them with fit_model (default: the same
+  model; another one, e.g. with other switches, gives the systematic effect of the choice of the model). Returns the toys and the fit results.
+  """
+  rng = np.random.default_rng(seed)
+  toys = generate(model, params, n_toys, rng, edges)
+  return toys, fit_many(fit_model or model, toys, edges, workers)
+
+
+def good_fit(result):
+  """True for a fit used in the statistics: converged (status 0) with a positive definite covariance (covQual 3)."""
+  return result['status'] == 0 and result.get('covQual', 3) == 3
+
+
+def summarize(params, results, names=None):
+  """
+  Bias, pulls and coverage of the parameters names (default: the free ones), all over the same good fits (see good_fit):
+  name -> dict with 'true', 'mean', 'bias', 'relative_bias', 'pull_mean', 'pull_width', 'coverage' (fraction of the
+  fits whose 1 sigma interval contains the true value), 'n_fits', 'n_excluded' (fits left out) and the arrays 'values', 'errors', 'pulls'.
+  """
+  good = [r for r in results if good_fit(r)]
+  if names is None:
+    names = [name for name in params if any(r['errors'].get(name, 0) > 0 for r in good)]
+  summary = {}
+  for name in names:
+    values = np.array([r['params'][name] for r in good])
+    errors = np.array([r['errors'][name] for r in good])
+    pulls = (values - params[name]) / errors
+    summary[name] = {
+      'true': float(params[name]),
+      'mean': float(values.mean()) if len(values) else None,
+      'bias': float(values.mean() - params[name]) if len(values) else None,
+      'relative_bias': float((values.mean() - params[name]) / params[name]) if len(values) and params[name] else None,
+      'pull_mean': float(pulls.mean()) if len(pulls) else None,
+      'pull_width': float(pulls.std(ddof=1)) if len(pulls) > 1 else None,
+      'coverage': float(np.mean(np.abs(pulls) <= 1)) if len(pulls) else None,
+      'n_fits': len(good),
+      'n_excluded': len(results) - len(good),
+      'values': values.tolist(), 'errors': errors.tolist(), 'pulls': pulls.tolist(),
+    }
+  return summary
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -------------------------------------- #
+# python version of getLumi.cpp: sums the luminosity and trigger histograms
+# of many AnalysisResults.root files, without merging them with hadd
+# -------------------------------------- #
+
+import os
+import sys
+import argparse
+
+# luminosity engine
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from lumiSum import sum_lumi_files, lumi_report
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Compute the luminosity from the AnalysisResults.root files of a train, summing their luminosity histograms as getLumi.cpp does on the merged file"
+  )
+  parser.add_argument('files', nargs='*', help='AnalysisResults.root files (or AnalysedLumi.root)')
+  parser.add_argument('-l', '--file-list', default=None, help='Text file with one file per line (e.g. the file_list.txt of download-hy.py)')
+  parser.add_argument('-j', '--parallel', type=int, default=4, help='Number of files read at the same time (default: 4)')
+  args = parser.parse_args()
+
+  files = list(args.files)
+  if args.file_list:
+    with open(args.file_list, 'r') as f:
+      files += [os.path.expanduser(line.strip()) for line in f if line.strip()]
+  if not files:
+    print('no lumi file found')
+    sys.exit(1)
+  for file_path in files:
+    if not os.path.isfile(file_path):
+      print(f'The file {file_path} does not exist.')
+      sys.exit(1)
+
+  total = sum_lumi_files(files, args.parallel)
+  for line in lumi_report(total):
+    print(line)
+
+if __name__ == '__main__':
+  main()
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# downloader of the HY outputs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from hyDownload import TRANSFERS, parse_jobs, command_copy, download
+from lumiSum import read_lumi_histos, add_lumi_histos, lumi_report
 
 def main():
   parser = argparse.ArgumentParser(
-    description="Download AnalysisResults.root files for given HY job URLs, merge them, and compute luminosity."
+    description="Download AnalysisResults.root files for given HY job URLs and compute luminosity, summing the luminosity histograms of the files as they are downloaded."
   )
   parser.add_argument(
     '-f', '--file',
@@ -17,59 +24,94 @@ def main():
     default='',
     help="Name of the dataset (default: empty)"
   )
+  parser.add_argument(
+    '-j', '--parallel',
+    type=int,
+    default=4,
+    help="Maximum number of downloads at the same time (default: %(default)s)"
+  )
+  parser.add_argument(
+    '--transfer',
+    choices=sorted(TRANSFERS),
+    default='alien',
+    help="How the files are listed and copied: alien (alien_ls/alien_cp) or local (the job paths are local directories) (default: %(default)s)"
+  )
+  parser.add_argument(
+    '--copy-cmd',
+    default=None,
+    help="Command used to copy a file instead of the default one, with {src} and {dst} (e.g. 'xrdcp -f {src} {dst}')"
+  )
+  parser.add_argument(
+    '--hadd',
+    action='store_true',
+    help="Merge the files with hadd and compute the luminosity with getLumi.cpp, as in the past (needs ROOT)"
+  )
+  parser.add_argument(
+    '--clean',
+    action='store_true',
+    help="Remove the downloaded files at the end (by default they are kept, and reused when the script is run again)"
+  )
 
   args = parser.parse_args()
 
   # Read job URLs
   try:
     with open(args.file, 'r') as inputFile:
-      lines = inputFile.readlines()
+      jobs = parse_jobs(inputFile)
   except FileNotFoundError:
     print(f"Error: File '{args.file}' not found.")
     return
 
-  # Create a temporary directory for download
+  # Download each AnalysisResults.root in a directory for the download,
+  # skipping the files downloaded by a previous run; the luminosity histograms
+  # of each file are read as soon as it is downloaded
   tmp_dir = 'this_merge'
-  os.makedirs(tmp_dir, exist_ok=True)
-
-  # Download each AnalysisResults.root
-  for line in lines:
-    line = line.rstrip()
-    try:
-      hy_id = line.split('/')[8]
-    except IndexError:
-      print(f"Warning: URL '{line}' is not in expected format, skipping.")
-      continue
-
-    print(f"Processing HY ID: {hy_id}")
-    dwn_comm = (
-      f"alien_cp {line}/AOD/*/AnalysisResults.root "
-      f"file://{tmp_dir}/{hy_id}/"
-    )
-    os.system(dwn_comm)
-
-  # Merge all downloaded ROOT files
-  lumi_file = 'AnalysedLumi.root'
-  merge_comm = f"hadd -f {lumi_file} {tmp_dir}/*/*/AnalysisResults.root"
-  os.system(merge_comm)
+  readings = {}
+  with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+    def read_file(path):
+      if not args.hadd:
+        readings[path] = pool.submit(read_lumi_histos, path)
+    copy = command_copy(args.copy_cmd) if args.copy_cmd else None
+    files, failed = download(jobs, tmp_dir, 'AnalysisResults.root', args.transfer, copy, parallel=args.parallel, on_done=read_file)
+    # files downloaded by a previous run
+    for path in files:
+      if path not in readings:
+        read_file(path)
+    total = {}
+    for path in readings:
+      add_lumi_histos(total, readings[path].result())
+  if failed:
+    print(f"Error: {len(failed)} download(s) failed, run again to resume.")
+    return
 
-  # Rename output based on dataset or input filename
-  if args.data:
-    out_name = f"AnalysedLumi_{args.data}.root"
+  if not args.hadd:
+    print(f"Luminosity from {len(files)} file(s):")
+    for line in lumi_report(total):
+      print(line)
   else:
-    base = os.path.splitext(os.path.basename(args.file))[0]
-    out_name = f"AnalysedLumi_{base}.root"
-    print(f"No --data given; using base '{base}'")
+    # Merge all downloaded ROOT files
+    lumi_file = 'AnalysedLumi.root'
+    merge_comm = f"hadd -f {lumi_file} {' '.join(files)}"
+    os.system(merge_comm)
+
+    # Rename output based on dataset or input filename
+    if args.data:
+      out_name = f"AnalysedLumi_{args.data}.root"
+    else:
+      base = os.path.splitext(os.path.basename(args.file))[0]
+      out_name = f"AnalysedLumi_{base}.root"
+      print(f"No --data given; using base '{base}'")
 
-  os.rename(lumi_file, out_name)
-  print(f"Renamed merged file to: {out_name}")
+    os.rename(lumi_file, out_name)
+    print(f"Renamed merged file to: {out_name}")
 
-  # Run the ROOT macro to get luminosity
-  lumi_comm = f"root -l -b -q 'getLumi.cpp(\"{out_name}\")'"
-  os.system(lumi_comm)
+    # Run the ROOT macro to get luminosity
+    lumi_comm = f"root -l -b -q 'getLumi.cpp(\"{out_name}\")'"
+    os.system(lumi_comm)
 
   # Clean up
-  os.system(f"rm -rf {tmp_dir}/")
+  if args.clean:
+    os.system(f"rm -rf {tmp_dir}/")
 
 if __name__ == "__main__":
   main()
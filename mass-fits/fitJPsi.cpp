@@ -111,6 +111,8 @@ string gSaveFileName = "";
 string gSaveTreeName = "";
 // name of the (1st) folder that contains the results
 string gIdentifier = "";
+// number of fits done in the current run (reset by fitJPsiTrees)
+int nCalls = 0;
 
 // position of the legend info
 float gXpos = 0.15;
@@ -126,8 +128,6 @@ void doOneDataFit(TTree *dataTree, TFile *saveFile, float binID[3],
                   TTree *recoCohJPsiTree, TTree *genCohJPsiTree, 
                   TTree *recoMumuMidTree, TTree *genMumuMidTree)
 {
-  // number of times the function has been called
-  static int nCalls = 0;
 
   // define variables for the tree
   RooRealVar pt("fPt","#it{p}_{T} (GeV/#it{c})",minPt,maxPt);
@@ -452,64 +452,23 @@ void doOneDataFit(TTree *dataTree, TFile *saveFile, float binID[3],
 
 
 // -----------------------------------------------------------------
-// entry point: set up and call fitting function
-// fitJPsiInPhiBins(string nClass = "noSelection", int nPhiBins = 12, const char *config = "jPsi", bool isMC = false, bool notShow = true)
-void fitJPsi(const char *config = "jPsi", string nClass = "noSelection", int nBins = 1, bool isMC = false, bool notShow = false)
+// fit the trees (already open) with the kinematics of a section of config.cfg, for all the bins
+// called by fitJPsi, or by a driver that keeps the trees open for many fits (scripts/fit-batch.py)
+// identifier: folder for the results (default: the name of the config)
+void fitJPsiTrees(const char *config, string nClass, int nBins, bool isMC,
+                  TTree *dataTree, TTree *recoCohJPsiTree, TTree *genCohJPsiTree,
+                  TTree *recoMumuMidTree, TTree *genMumuMidTree, string identifier = "")
 {
-  // choose to show or not the canvas and info from RooFit
-  if(notShow){
-    gROOT->SetBatch(kTRUE);
-    RooMsgService::instance().setGlobalKillBelow(RooFit::WARNING);
-  }
-
   // set the global values to the values in input
   // identifier = name of the config, it identifies the kine for a certain process
-  gIdentifier = config;
+  gIdentifier = identifier.empty() ? config : identifier;
   // nutron class
-  gNeutronClass = nClass;
+  gNeutronClass = isMC ? "noSelection" : nClass;
   // is MC or data?
   gIsMC = isMC;
-
-  // get the tree with the data
-  TFile *dataFile = NULL;
-  TTree *dataTree = NULL;
-
-  // get the trees with the reco MC of coh j/psi
-  TFile *recoCohJPsiFile = NULL;
-  TTree *recoCohJPsiTree = NULL;
-
-  // get the trees with the reco MC of coh j/psi
-  TFile *genCohJPsiFile = NULL;
-  TTree *genCohJPsiTree = NULL;
-
-  // get the trees with the reco MC of yy to mumu in the j/psi mass region
-  TFile *recoMumuMidFile = NULL;
-  TTree *recoMumuMidTree = NULL;
-
-  // get the trees with the reco MC of yy to mumu in the j/psi mass region
-  TFile *genMumuMidFile = NULL;
-  TTree *genMumuMidTree = NULL;
-
-  recoCohJPsiFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarlo/reco_tree.root");
-  recoCohJPsiTree = (TTree*) recoCohJPsiFile->Get("DF_2336518085565631/dimu"); 
-  
-  genCohJPsiFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarlo/gen_tree.root");
-  genCohJPsiTree = (TTree*) genCohJPsiFile->Get("DF_2336518085565631/dimu"); 
-
-  recoMumuMidFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/reco_tree.root");
-  recoMumuMidTree = (TTree*) recoMumuMidFile->Get("DF_2336518081075359/dimu");
-
-  genMumuMidFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/gen_tree.root");
-  genMumuMidTree = (TTree*) genMumuMidFile->Get("DF_2336518081075359/dimu");
-
-  if(!isMC){
-    dataFile = new TFile("../data/train-447456/merged-trees.root");
-    dataTree = (TTree*) dataFile->Get("DF_2423890592971072/dimu");
-  }
-  else if(isMC){
-    dataTree = recoCohJPsiTree;
-    gNeutronClass = "noSelection";
-  }
+  // number of bins, and of fits done (for the pages of the PDF)
+  gBins = nBins;
+  nCalls = 0;
 
   // check if the data are there
   if(dataTree==NULL || recoCohJPsiTree==NULL || genCohJPsiTree==NULL || 
@@ -549,7 +508,7 @@ void fitJPsi(const char *config = "jPsi", string nClass = "noSelection", int nBi
   // save the results in a tree
   string fileName = to_string(nBins) + "phi_1pt";
   gSaveFileName = "massFitRes_" + fileName + ".root";
-  gSystem->mkdir(gIdentifier.c_str());
+  gSystem->mkdir(gIdentifier.c_str(), kTRUE);
   gSystem->mkdir(Form("%s/%s",gIdentifier.c_str(),gNeutronClass.c_str()));
   TFile *saveFile = new TFile(Form("%s/%s/%s",gIdentifier.c_str(),gNeutronClass.c_str(),gSaveFileName.c_str()),"recreate");
 	saveFile->Close();
@@ -568,4 +527,61 @@ void fitJPsi(const char *config = "jPsi", string nClass = "noSelection", int nBi
 
 	} // end of the loop on the bins
 
+} // end of fitJPsiTrees
+
+
+// -----------------------------------------------------------------
+// entry point: set up and call fitting function
+// fitJPsiInPhiBins(string nClass = "noSelection", int nPhiBins = 12, const char *config = "jPsi", bool isMC = false, bool notShow = true)
+void fitJPsi(const char *config = "jPsi", string nClass = "noSelection", int nBins = 1, bool isMC = false, bool notShow = false)
+{
+  // choose to show or not the canvas and info from RooFit
+  if(notShow){
+    gROOT->SetBatch(kTRUE);
+    RooMsgService::instance().setGlobalKillBelow(RooFit::WARNING);
+  }
+
+  // get the tree with the data
+  TFile *dataFile = NULL;
+  TTree *dataTree = NULL;
+
+  // get the trees with the reco MC of coh j/psi
+  TFile *recoCohJPsiFile = NULL;
+  TTree *recoCohJPsiTree = NULL;
+
+  // get the trees with the reco MC of coh j/psi
+  TFile *genCohJPsiFile = NULL;
+  TTree *genCohJPsiTree = NULL;
+
+  // get the trees with the reco MC of yy to mumu in the j/psi mass region
+  TFile *recoMumuMidFile = NULL;
+  TTree *recoMumuMidTree = NULL;
+
+  // get the trees with the reco MC of yy to mumu in the j/psi mass region
+  TFile *genMumuMidFile = NULL;
+  TTree *genMumuMidTree = NULL;
+
+  recoCohJPsiFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarlo/reco_tree.root");
+  recoCohJPsiTree = (TTree*) recoCohJPsiFile->Get("DF_2336518085565631/dimu"); 
+  
+  genCohJPsiFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarlo/gen_tree.root");
+  genCohJPsiTree = (TTree*) genCohJPsiFile->Get("DF_2336518085565631/dimu"); 
+
+  recoMumuMidFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/reco_tree.root");
+  recoMumuMidTree = (TTree*) recoMumuMidFile->Get("DF_2336518081075359/dimu");
+
+  genMumuMidFile = new TFile("~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/gen_tree.root");
+  genMumuMidTree = (TTree*) genMumuMidFile->Get("DF_2336518081075359/dimu");
+
+  if(!isMC){
+    dataFile = new TFile("../data/train-447456/merged-trees.root");
+    dataTree = (TTree*) dataFile->Get("DF_2423890592971072/dimu");
+  }
+  else if(isMC){
+    dataTree = recoCohJPsiTree;
+  }
+
+  // do the fits
+  fitJPsiTrees(config, nClass, nBins, isMC, dataTree, recoCohJPsiTree, genCohJPsiTree, recoMumuMidTree, genMumuMidTree);
+
 } // end of the main
\ No newline at end of file
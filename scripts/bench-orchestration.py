@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import argparse
+import subprocess
+
+# stand-in O2 executables and measurement of the commands
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from benchStubs import STUB_ENV, write_stubs
+from jobStats import run_measured
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, os.pardir))
+RESULTS = 'bench-results.jsonl'
+
+# command-line option of each stub setting
+STUB_OPTIONS = {
+  'task_seconds': 'BENCH_TASK_SECONDS',
+  'task_seconds_per_file': 'BENCH_TASK_SECONDS_PER_FILE',
+  'task_mem_mb': 'BENCH_TASK_MEM_MB',
+  'task_read': 'BENCH_TASK_READ',
+  'task_out_kb': 'BENCH_TASK_OUT_KB',
+  'merge_seconds': 'BENCH_MERGE_SECONDS',
+  'merge_mem_mb': 'BENCH_MERGE_MEM_MB',
+}
+
+
+def make_inputs(input_dir, n_files, size_mb, spread, files_per_job=100, seed=1):
+  """
+  Write n_files fake AO2D files in the layout of a HY train (hy_N/AOD/NNN/AO2D.root) as sparse files
+  of size_mb MB +- spread (fraction), and their list. The files that already have the right size are kept.
+  Returns the path of the list.
+  """
+  rng = random.Random(seed)
+  lines = []
+  for i in range(n_files):
+    path = os.path.join(input_dir, f'hy_{1000000 + i // files_per_job}', 'AOD', f'{i % files_per_job + 1:03d}', 'AO2D.root')
+    size = int(size_mb * 1024**2 * (1 + spread * (2 * rng.random() - 1)))
+    if not os.path.isfile(path) or os.path.getsize(path) != size:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'wb') as f:
+        f.truncate(size)
+    lines.append(path)
+  list_path = os.path.join(input_dir, 'file_list.txt')
+  with open(list_path, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+  return list_path
+
+
+def write_config(path, list_path):
+  """Minimal config of the task: the input list and the kinematic cuts scanned by the scan flow."""
+  config = {
+    'internal-dpl-aod-reader': {'aod-file-private': '@' + list_path},
+    'fwd-muons-u-p-c': {'lowPt': '0', 'highPt': '2.', 'lowMass': '0', 'highMass': '6'},
+  }
+  with open(path, 'w') as f:
+    json.dump(config, f, indent=2)
+
+
+def clean_dir(path):
+  shutil.rmtree(path, ignore_errors=True)
+  os.makedirs(path)
+
+
+def measure(name, cmd, cwd, log):
+  """Run one flow with jobStats.run_measured and return its stats (exits if it fails)."""
+  print(f'\n{name}: {cmd}')
+  stats = run_measured(cmd, cwd=cwd, log=log)
+  if stats['ret'] != 0:
+    print(f"Error: {name} failed with exit code {stats['ret']}, see {log}")
+    sys.exit(1)
+  print(f"  {stats['wall']:.2f} s wall, {stats['cpu']:.2f} s CPU, peak RSS {stats['peak_rss']/1024**2:.0f} MB")
+  return stats
+
+
+def flow_result(stats, report_path, units):
+  """Result of a flow: its stats, and from the report of the script the time of the units of work and of the merges."""
+  result = {k: stats[k] for k in ('wall', 'cpu', 'peak_rss', 'read', 'write')}
+  result['units'] = units
+  result['wall_per_unit'] = stats['wall'] / units if units else None
+  if os.path.isfile(report_path):
+    with open(report_path, 'r') as f:
+      summary = json.load(f)['summary']
+    result.update(units_wall=summary['chunks_wall'], merge_wall=summary['merge_wall'])
+  return result
+
+
+def bench_sub_jobs(args, work_dir, config_path):
+  """run-task.py --use-sub-jobs on the fake inputs, then again with all the chunks already done (resume)."""
+  run_dir = os.path.join(work_dir, 'sub-jobs')
+  clean_dir(run_dir)
+  shutil.copy(config_path, os.path.join(run_dir, 'bench.json'))
+  cmd = f"{sys.executable} {os.path.join(SCRIPT_DIR, 'run-task.py')} -j bench.json -t data -u --jobs-dir jobs --max-parallel {args.max_parallel}"
+  if args.chunk_count:
+    cmd += f' --chunk-count {args.chunk_count}'
+    n_chunks = args.chunk_count
+  else:
+    cmd += f' --chunk-num {args.chunk_num}'
+    n_chunks = -(-args.files // args.chunk_num)
+  if args.merge_fan_in:
+    cmd += f' --merge-fan-in {args.merge_fan_in}'
+  report = os.path.join(run_dir, 'jobs', 'run-report.json')
+  results = {'sub-jobs': flow_result(measure('sub-jobs', cmd, run_dir, os.path.join(work_dir, 'sub-jobs.log')), report, n_chunks)}
+  os.remove(report)
+  results['sub-jobs-resume'] = flow_result(measure('sub-jobs-resume', cmd, run_dir, os.path.join(work_dir, 'sub-jobs-resume.log')), report, 0)
+  return results
+
+
+def bench_scan(args, work_dir, config_path):
+  """run-parameter-scan.py with args.points points (values of lowPt), args.scan_parallel at the same time."""
+  run_dir = os.path.join(work_dir, 'scan')
+  clean_dir(run_dir)
+  shutil.copy(config_path, os.path.join(run_dir, 'bench.json'))
+  scan = {
+    'base_config': 'bench.json',
+    'output_base': 'bench-scan',
+    'output_dir': 'scan-results',
+    'scan_params': {'lowPt': [round(0.001 * i, 3) for i in range(args.points)]},
+  }
+  with open(os.path.join(run_dir, 'scan.json'), 'w') as f:
+    json.dump(scan, f, indent=2)
+  cmd = (f"echo | {sys.executable} {os.path.join(SCRIPT_DIR, 'run-parameter-scan.py')} "
+         f"--param-json scan.json --data-type data --parallel {args.scan_parallel}")
+  if args.scan_cache:
+    cmd += f" --cache-dir {os.path.join(work_dir, 'result-cache')}"
+  if args.scan_sub_jobs:
+    cmd += f' -u --chunk-num {args.chunk_num} --cores {args.scan_parallel * args.max_parallel}'
+  report = os.path.join(run_dir, 'scan-results', 'bench-scan-report.json')
+  return {'scan': flow_result(measure('scan', cmd, run_dir, os.path.join(work_dir, 'scan.log')), report, args.points)}
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+  except OSError:
+    return None
+
+
+def compare(record, results_path, tolerance):
+  """Print the ratio of the wall times to the last record with the same setup, and flag the ones over tolerance."""
+  previous = None
+  if os.path.isfile(results_path):
+    with open(results_path, 'r') as f:
+      for line in f:
+        rec = json.loads(line)
+        if rec['setup'] == record['setup'] and rec['host'] == record['host']:
+          previous = rec
+  print('\nResults:')
+  regressions = []
+  for flow, res in record['flows'].items():
+    line = f"  {flow:16s} {res['wall']:8.2f} s"
+    if res['wall_per_unit'] is not None:
+      line += f" ({1000*res['wall_per_unit']:.1f} ms per unit)"
+    old = previous['flows'].get(flow) if previous else None
+    if old and old['wall'] > 0:
+      ratio = res['wall'] / old['wall']
+      line += f"  x{ratio:.2f} w.r.t. {previous['commit']}"
+      if ratio > tolerance:
+        line += '  <- slower'
+        regressions.append(flow)
+    print(line)
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Time the orchestration of run-task.py (sub-jobs, resume, merges) and run-parameter-scan.py on fake inputs, "
+                "with stand-in O2 executables of tunable runtime and memory. The results are appended to a JSON-lines file "
+                "and compared with the last run of the same setup."
+  )
+  parser.add_argument('-w', '--work-dir', default='bench', help='Directory for the fake inputs and the runs (default: bench)')
+  parser.add_argument('-o', '--results', default=None, help=f'JSON-lines file where the results are appended (default: <work-dir>/{RESULTS})')
+  parser.add_argument('--flows', nargs='+', choices=['sub-jobs', 'scan'], default=['sub-jobs', 'scan'], help='Flows to time (default: both)')
+  parser.add_argument('--files', type=int, default=10000, help='Number of fake AO2D files (default: 10000)')
+  parser.add_argument('--file-size', type=float, default=1., help='Size of the fake files in MB, written as sparse files (default: 1)')
+  parser.add_argument('--size-spread', type=float, default=0.5, help='Spread of the file sizes, as a fraction of --file-size (default: 0.5)')
+  parser.add_argument('--chunk-num', type=int, default=100, help='Files per chunk of the sub-jobs (default: 100)')
+  parser.add_argument('--chunk-count', type=int, default=None, help='Use --chunk-count with this number of chunks instead of --chunk-num')
+  parser.add_argument('--max-parallel', type=int, default=4, help='Sub-jobs at the same time (default: 4)')
+  parser.add_argument('--merge-fan-in', type=int, default=None, help='Pass --merge-fan-in to run-task.py')
+  parser.add_argument('--points', type=int, default=200, help='Number of scan points (default: 200)')
+  parser.add_argument('--scan-parallel', type=int, default=4, help='Scan points at the same time (default: 4)')
+  parser.add_argument('--scan-sub-jobs', action='store_true', help='Run the scan points with sub-jobs')
+  parser.add_argument('--scan-cache', action='store_true', help='Run the scan with a result cache in <work-dir>/result-cache: the points found in it are not run')
+  parser.add_argument('--tolerance', type=float, default=1.2, help='Ratio of the wall times to the last run of the same setup over which a flow is reported as slower (default: 1.2)')
+  parser.add_argument('--task-seconds', type=float, default=0., help='Runtime of the analysis stub for each run (default: 0)')
+  parser.add_argument('--task-seconds-per-file', type=float, default=0., help='Runtime of the analysis stub for each input file (default: 0)')
+  parser.add_argument('--task-mem-mb', type=float, default=0., help='Memory allocated by the analysis stub (default: 0)')
+  parser.add_argument('--task-read', type=int, choices=[0, 1], default=0, help='1: the analysis stub reads its inputs, 0: it only stats them (default: 0)')
+  parser.add_argument('--task-out-kb', type=float, default=4., help='Size of the outputs of the analysis stub (default: 4)')
+  parser.add_argument('--merge-seconds', type=float, default=0., help='Runtime of the hadd and o2-aod-merger stubs (default: 0)')
+  parser.add_argument('--merge-mem-mb', type=float, default=0., help='Memory allocated by the hadd and o2-aod-merger stubs (default: 0)')
+  args = parser.parse_args()
+  if min(args.files, args.chunk_num, args.max_parallel, args.points, args.scan_parallel) < 1:
+    print('Error: --files, --chunk-num, --max-parallel, --points and --scan-parallel must be at least 1.')
+    sys.exit(1)
+
+  work_dir = os.path.abspath(args.work_dir)
+  results_path = args.results or os.path.join(work_dir, RESULTS)
+  os.makedirs(work_dir, exist_ok=True)
+
+  # the stubs come first in the PATH, and take their settings from the environment
+  write_stubs(os.path.join(work_dir, 'bin'))
+  os.environ['PATH'] = os.path.join(work_dir, 'bin') + os.pathsep + os.environ.get('PATH', '')
+  stub_env = {STUB_OPTIONS[k]: getattr(args, k) for k in STUB_OPTIONS}
+  os.environ.update({name: str(value) for name, value in stub_env.items()})
+
+  start = time.monotonic()
+  list_path = make_inputs(os.path.join(work_dir, 'inputs'), args.files, args.file_size, args.size_spread)
+  config_path = os.path.join(work_dir, 'bench.json')
+  write_config(config_path, list_path)
+  print(f'{args.files} fake input files in {os.path.dirname(list_path)} ({time.monotonic() - start:.1f} s)')
+
+  flows = {}
+  if 'sub-jobs' in args.flows:
+    flows.update(bench_sub_jobs(args, work_dir, config_path))
+  if 'scan' in args.flows:
+    flows.update(bench_scan(args, work_dir, config_path))
+
+  setup = {k: getattr(args, k) for k in ('files', 'file_size', 'size_spread', 'chunk_num', 'chunk_count', 'max_parallel',
+                                         'merge_fan_in', 'points', 'scan_parallel', 'scan_sub_jobs', 'scan_cache')}
+  setup['stubs'] = {name: stub_env.get(name, default) for name, default in STUB_ENV.items()}
+  record = {
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'commit': git_commit(),
+    'host': socket.gethostname(),
+    'cpus': os.cpu_count(),
+    'setup': setup,
+    'flows': flows,
+  }
+  regressions = compare(record, results_path, args.tolerance)
+  with open(results_path, 'a') as f:
+    f.write(json.dumps(record) + '\n')
+  print(f'Results appended to {results_path}')
+  if regressions:
+    print(f"Warning: {', '.join(regressions)} slower than the last run of the same setup by more than x{args.tolerance}.")
+    sys.exit(2)
+
+if __name__ == '__main__':
+  main()
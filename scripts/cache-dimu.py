@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+# python readers of the trees
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from dimuVars import LAYOUTS, cache_path, is_cache_valid, build_cache
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Convert the dimu trees of ROOT files into a columnar cache (one .npy file per branch) that can be opened memory-mapped with dimuVars.open_cache"
+  )
+  parser.add_argument('files', nargs='+', help='ROOT files with the dimu trees (e.g. data-OO-full-pt-tree.root)')
+  parser.add_argument('--cache-dir', default=None, help='Directory for the caches (default: next to each file, as <file>.npcache)')
+  parser.add_argument('--tree-name', default='dimu', help='Name of the trees to convert (default: dimu)')
+  parser.add_argument('-t', '--data-type', choices=sorted(LAYOUTS), default=None, help='Check that the trees contain the branches of this type of data')
+  parser.add_argument('-f', '--force', action='store_true', help='Rebuild the caches even if they are up to date')
+  args = parser.parse_args()
+
+  if args.cache_dir:
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+  for file_path in args.files:
+    if not os.path.isfile(file_path):
+      print(f"Error: file '{file_path}' not found.")
+      sys.exit(1)
+    path = cache_path(file_path, args.cache_dir, args.tree_name)
+    if not args.force and is_cache_valid(file_path, path, args.tree_name):
+      print(f'{file_path}: cache up to date in {path}')
+      continue
+    meta = build_cache(file_path, path, args.tree_name)
+    if not meta['trees']:
+      print(f"Warning: no '{args.tree_name}' tree found in {file_path}.")
+    print(f"{file_path}: {meta['entries']} entries from {len(meta['trees'])} tree(s), {len(meta['branches'])} branches cached in {path}")
+    if args.data_type:
+      missing = [b for b in LAYOUTS[args.data_type] if b not in meta['branches']]
+      if missing:
+        print(f"Warning: branches of the {args.data_type} trees missing in {file_path}: {', '.join(missing)}")
+
+if __name__ == '__main__':
+  main()
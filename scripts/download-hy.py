@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+# downloader of the HY outputs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from hyDownload import TRANSFERS, parse_jobs, command_copy, download, write_file_list
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Download the output files of the jobs of a HY train, several at a time, and write the list of the downloaded files"
+  )
+  parser.add_argument('input', help='File with the hy jobs, one per line: job paths or the alien_cp lines of a download-*.sh script')
+  parser.add_argument('-o', '--output-dir', default=None, help='Directory where the hy_*/NNN/ directories are written (default: the directory of the input)')
+  parser.add_argument('-n', '--file-name', default='AO2D.root', help='File to download from each output directory (default: AO2D.root)')
+  parser.add_argument('-j', '--parallel', type=int, default=4, help='Maximum number of transfers at the same time (default: 4)')
+  parser.add_argument('--retries', type=int, default=3, help='Attempts after the first one for each transfer (default: 3)')
+  parser.add_argument('--backoff', type=float, default=5., help='Seconds before the first retry, doubled at each retry (default: 5)')
+  parser.add_argument('--transfer', choices=sorted(TRANSFERS), default='alien', help='How the files are listed and copied: alien (alien_ls/alien_cp) or local (the job paths are local directories) (default: alien)')
+  parser.add_argument('--copy-cmd', default=None, help="Command used to copy a file instead of the default one, with {src} and {dst} (e.g. 'xrdcp -f {src} {dst}')")
+  parser.add_argument('-l', '--file-list', default='file_list.txt', help='List of the downloaded files, relative to the output directory (default: file_list.txt)')
+  parser.add_argument('--list-prefix', default=None, help='Write the paths of the list with this prefix instead of the output directory (e.g. ~/Desktop/run3-OO-jpsi/data/train-455531)')
+  args = parser.parse_args()
+
+  try:
+    with open(args.input, 'r') as f:
+      jobs = parse_jobs(f)
+  except FileNotFoundError:
+    print(f"Error: File '{args.input}' not found.")
+    sys.exit(1)
+  if not jobs:
+    print(f'Error: no hy job found in {args.input}.')
+    sys.exit(1)
+  if args.parallel < 1 or args.retries < 0:
+    print('Error: --parallel must be at least 1 and --retries cannot be negative.')
+    sys.exit(1)
+
+  out_dir = args.output_dir or os.path.dirname(os.path.abspath(args.input))
+  copy = command_copy(args.copy_cmd) if args.copy_cmd else None
+  print(f'Downloading {args.file_name} of {len(jobs)} hy job(s) in {out_dir}')
+  files, failed = download(jobs, out_dir, args.file_name, args.transfer, copy, args.parallel, args.retries, args.backoff)
+
+  if failed:
+    print(f"{len(failed)} download(s) failed: {', '.join(failed)}. Run again to resume, the list is written only when all the files are downloaded.")
+    sys.exit(1)
+
+  list_path = os.path.join(out_dir, args.file_list)
+  write_file_list(list_path, files, out_dir, args.list_prefix)
+  print(f'{len(files)} file(s) downloaded, list written in {list_path}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# reader of the trees of the fit results (needs uproot); ROOT is imported only by the workers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from savedVarInMassFits import SAVED_BRANCHES, result_file_name, read_fit_results
+from massFit import NEUTRON_CLASSES, FIT_VARIANTS, read_config_sections
+
+MASS_FITS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'mass-fits'))
+
+# trees used by fitJPsiTrees, in the order of its arguments, with the defaults of fitJPsi
+TREE_FILES = {
+  'data': '../data/train-447456/merged-trees.root',
+  'reco-coh': '~/Desktop/run3-jpsi-analysis/MonteCarlo/reco_tree.root',
+  'gen-coh': '~/Desktop/run3-jpsi-analysis/MonteCarlo/gen_tree.root',
+  'reco-mumu': '~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/reco_tree.root',
+  'gen-mumu': '~/Desktop/run3-jpsi-analysis/MonteCarloMumuMid/gen_tree.root',
+}
+
+
+def macro_switches(macro_path):
+  """Global bool and double variables of the macro with their default: name -> value."""
+  switches = {}
+  with open(macro_path, 'r') as f:
+    for line in f:
+      match = re.match(r'(bool|double)\s+(\w+)\s*=\s*([^;]+);', line)
+      if match:
+        kind, name, value = match.groups()
+        switches[name] = value.strip() == 'true' if kind == 'bool' else float(value)
+  return switches
+
+
+def parse_variant(spec, switches):
+  """Variant from 'name:switch=value,switch=value' (values true/false or numbers), checked against the switches of the macro."""
+  name, _, settings = spec.partition(':')
+  values = {}
+  for item in filter(None, settings.split(',')):
+    key, _, value = item.partition('=')
+    if key not in switches:
+      raise ValueError(f"'{key}' is not a switch of the macro ({', '.join(switches)})")
+    values[key] = value.lower() == 'true' if isinstance(switches[key], bool) else float(value)
+  return name, values
+
+
+def cpp_literal(value):
+  return ('true' if value else 'false') if isinstance(value, bool) else repr(float(value))
+
+
+# WORKERS ----------------------------------------------------------
+# each worker loads the macro and copies the trees in memory once, then runs many fits on them
+
+_worker = {}
+
+
+def memory_tree(ROOT, path):
+  """Chain of all the DF_*/dimu trees of a file (or the tree path:DF_N/dimu), copied in memory."""
+  file_path, _, tree_path = path.partition(':')
+  chain = ROOT.TChain('dimu')
+  if tree_path:
+    chain.Add(f'{file_path}/{tree_path}')
+  else:
+    f = ROOT.TFile.Open(file_path)
+    if not f or f.IsZombie():
+      raise OSError(f'cannot open {file_path}')
+    for key in f.GetListOfKeys():
+      if key.GetClassName() == 'TDirectoryFile' and f.Get(f'{key.GetName()}/dimu'):
+        chain.Add(f'{file_path}/{key.GetName()}/dimu')
+    f.Close()
+  ROOT.gROOT.cd()
+  tree = chain.CopyTree('')
+  return chain, tree
+
+
+def init_worker(macro, config_dir, tree_files, switches):
+  import ROOT
+  ROOT.gROOT.SetBatch(True)
+  ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+  ROOT.gROOT.LoadMacro(macro)
+  # the macro reads config.cfg from the working directory
+  os.chdir(config_dir)
+  _worker['ROOT'] = ROOT
+  _worker['switches'] = switches
+  _worker['trees'] = [memory_tree(ROOT, tree_files[name]) for name in TREE_FILES]
+
+
+def run_fit(task):
+  """Run fitJPsiTrees for one task, with the switches of its variant; its output goes to a log in the task directory."""
+  ROOT = _worker['ROOT']
+  for name, value in {**_worker['switches'], **task['settings']}.items():
+    ROOT.gROOT.ProcessLine(f'{name} = {cpp_literal(value)};')
+  os.makedirs(task['dir'], exist_ok=True)
+  start = time.monotonic()
+  ROOT.gSystem.RedirectOutput(task['log'], 'w')
+  try:
+    ROOT.fitJPsiTrees(task['section'], task['class'], task['bins'], task['mc'],
+                      *[tree for _, tree in _worker['trees']], task['dir'])
+  finally:
+    ROOT.gROOT.ProcessLine('gSystem->RedirectOutput(0);')
+  return task['id'], time.monotonic() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Run fitJPsi.cpp for every combination of config.cfg sections, neutron classes, numbers of bins and fit variants, "
+                "in a pool of processes that read the trees once, and collect the results of all the fits in one table"
+  )
+  parser.add_argument('-s', '--sections', nargs='+', default=None, help='Sections of the config to fit (default: all)')
+  parser.add_argument('-c', '--classes', nargs='+', choices=list(NEUTRON_CLASSES), default=['noSelection'], help='Neutron classes (default: noSelection)')
+  parser.add_argument('-b', '--bins', nargs='+', type=int, default=[1], help='Numbers of bins (default: 1)')
+  parser.add_argument('-v', '--variants', nargs='+', default=['default'],
+                      help=f"Fit variants: {', '.join(FIT_VARIANTS)}, or name:switch=value,... with switches of the macro (e.g. free-tails:isAlphaFixed=false,alphaL=1.0) (default: default)")
+  parser.add_argument('--mc', action='store_true', help='Fit the reconstructed MC instead of the data (only the noSelection class)')
+  parser.add_argument('--config', default=os.path.join(MASS_FITS_DIR, 'config.cfg'), help='Config with the kinematic sections (default: ../mass-fits/config.cfg)')
+  parser.add_argument('--macro', default=os.path.join(MASS_FITS_DIR, 'fitJPsi.cpp'), help='Fit macro (default: ../mass-fits/fitJPsi.cpp)')
+  for name, default in TREE_FILES.items():
+    parser.add_argument(f'--{name}', default=default, help=f'File of the {name} tree, all its DF_*/dimu trees (or file:DF_N/dimu for one of them) (default: {default}, relative to the macro)')
+  parser.add_argument('-o', '--output-dir', default='fit-batch', help='Directory of the results: <section>/<variant>/ for each task, and fit-results.csv/.json (default: fit-batch)')
+  parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='Number of processes (default: number of CPUs)')
+  args = parser.parse_args()
+
+  for path in (args.config, args.macro):
+    if not os.path.isfile(path):
+      print(f"Error: '{path}' not found.")
+      sys.exit(1)
+  if args.workers < 1:
+    print('Error: --workers must be at least 1.')
+    sys.exit(1)
+  sections = read_config_sections(args.config)
+  names = args.sections or list(sections)
+  unknown = [s for s in names if s not in sections]
+  if unknown:
+    print(f"Error: section(s) {', '.join(unknown)} not in {args.config} ({', '.join(sections)}).")
+    sys.exit(1)
+  switches = macro_switches(args.macro)
+  variants = {}
+  for spec in args.variants:
+    if spec in FIT_VARIANTS:
+      variants[spec] = FIT_VARIANTS[spec]
+      continue
+    try:
+      name, values = parse_variant(spec, switches)
+    except ValueError as e:
+      print(f'Error: variant {spec}: {e}')
+      sys.exit(1)
+    variants[name] = values
+  # relative paths of the trees as in fitJPsi, w.r.t. the directory of the macro
+  macro_dir = os.path.dirname(os.path.abspath(args.macro))
+  tree_files = {}
+  for name in TREE_FILES:
+    path = os.path.expanduser(getattr(args, name.replace('-', '_')))
+    tree_files[name] = path if os.path.isabs(path) else os.path.join(macro_dir, path)
+  # with --mc the reconstructed MC is fitted, as in fitJPsi
+  if args.mc:
+    tree_files['data'] = tree_files['reco-coh']
+  for name, path in tree_files.items():
+    if not os.path.isfile(path.split(':')[0]):
+      print(f"Error: {name} tree file '{path}' not found.")
+      sys.exit(1)
+
+  output_dir = os.path.abspath(args.output_dir)
+  os.makedirs(output_dir, exist_ok=True)
+  classes = ['noSelection'] if args.mc else args.classes
+  tasks = []
+  for section, n_class, n_bins, variant in itertools.product(names, classes, args.bins, variants):
+    task_dir = os.path.join(output_dir, section, variant)
+    tasks.append({
+      'id': len(tasks), 'section': section, 'class': n_class, 'bins': n_bins, 'variant': variant, 'mc': args.mc,
+      'settings': variants[variant], 'dir': task_dir,
+      'log': os.path.join(task_dir, f'fit-{n_class}-{n_bins}.log'),
+    })
+  workers = min(args.workers, len(tasks))
+  print(f'{len(tasks)} fit task(s): {len(names)} section(s) x {len(classes)} class(es) x {len(args.bins)} binning(s) x {len(variants)} variant(s), '
+        f'{sum(t["bins"] for t in tasks)} fits in {workers} process(es)')
+
+  start = time.monotonic()
+  seconds = {}
+  errors = {}  # task id -> exception of the tasks that raised (their results, if any, are stale)
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                           initargs=(os.path.abspath(args.macro), os.path.dirname(os.path.abspath(args.config)), tree_files, switches)) as pool:
+    futures = {pool.submit(run_fit, task): task for task in tasks}
+    for future in as_completed(futures):
+      t = futures[future]
+      try:
+        task_id, elapsed = future.result()
+      except Exception as e:
+        # a C++ exception of the macro, a tree that cannot be opened or a crashed worker: the other tasks go on
+        errors[t['id']] = e
+        print(f"  {t['section']} {t['class']} {t['bins']} bin(s) {t['variant']}: failed ({type(e).__name__}: {e})")
+        continue
+      seconds[task_id] = elapsed
+      print(f"  {t['section']} {t['class']} {t['bins']} bin(s) {t['variant']}: {elapsed:.1f} s")
+
+  # one row per fit, with the kinematics of the section and the variables of savedVarInMassFits.h
+  rows, failed = [], []
+  for t in tasks:
+    result_file = os.path.join(t['dir'], t['class'], result_file_name(t['bins']))
+    fits = read_fit_results(result_file) if os.path.isfile(result_file) and t['id'] not in errors else []
+    if len(fits) != t['bins']:
+      failed.append(t)
+    for fit in fits:
+      rows.append({'section': t['section'], 'class': t['class'], 'n_bins': t['bins'], 'variant': t['variant'],
+                   **sections[t['section']], **fit, 'seconds': seconds.get(t['id'], 0) / t['bins']})
+  columns = ['section', 'class', 'n_bins', 'variant', *sorted({k for s in names for k in sections[s]}), 'bin', *SAVED_BRANCHES, 'seconds']
+  with open(os.path.join(output_dir, 'fit-results.json'), 'w') as f:
+    json.dump({'variants': variants, 'rows': rows}, f, indent=2)
+  with open(os.path.join(output_dir, 'fit-results.csv'), 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+  print(f'{len(rows)} fit(s) in {time.monotonic() - start:.1f} s, results in {os.path.join(output_dir, "fit-results.csv")} and .json')
+  if failed:
+    for t in failed:
+      reason = f"{type(errors[t['id']]).__name__}: {errors[t['id']]}" if t['id'] in errors else 'results missing'
+      print(f"Error: {t['section']} {t['class']} {t['bins']} bin(s) {t['variant']}: {reason}, see {t['log']}")
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+# numpy/scipy fit of the mass model of fitJPsi.cpp and readers of the trees
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from massFit import (PARAMS, SWITCHES, parse_switches, NEUTRON_CLASSES, FIT_VARIANTS, MassModel, window_bins, read_config_sections, select_masses, fit_many)
+from dimuVars import read_dimu, open_cache
+
+MASS_FITS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'mass-fits'))
+
+# results written for every fit, as in fit-batch.py (plus the status, the quality of the covariance and, for binned fits, the chi2)
+RESULT_COLUMNS = ['status', 'covQual', 'numJPsi', 'errNumJPsi', 'numBkg', 'errNumBkg', 'entries', 'errEntries', 'nll', 'chi2', 'ndf']
+
+
+def read_hist(spec):
+  """Counts and edges of a TH1 from 'file.root:name'."""
+  import uproot
+  file_path, _, name = spec.rpartition(':')
+  with uproot.open(file_path) as f:
+    hist = f[name]
+    return hist.values().astype(float), hist.axis().edges()
+
+
+def roofit_fit(model, counts, edges):
+  """
+  Same binned fit with RooFit, as doOneDataFit (RooCrystalBall, exp(p1*m + p2*m^2), extended RooAddPdf):
+  yields and parameters to compare with the numpy fit, on the same bins and in the same window (see massFit.window_bins).
+  """
+  import ROOT
+  ROOT.gROOT.SetBatch(True)
+  ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+  counts, edges, model = window_bins(model, counts, edges)
+  hist = ROOT.TH1D('hMassRef', 'hMassRef', len(counts), np.asarray(edges, dtype=float))
+  for i, c in enumerate(counts):
+    hist.SetBinContent(i + 1, c)
+  mass = ROOT.RooRealVar('fM', 'fM', model.low, model.high)
+  data = ROOT.RooDataHist('inData', 'inData', ROOT.RooArgList(mass), hist)
+  limits = model.limits(counts.sum())
+  fixed = model.fixed()
+  v = {}
+  for name in PARAMS:
+    start, low, up = limits[name]
+    v[name] = ROOT.RooRealVar(name, name, fixed.get(name, start), low, up)
+    v[name].setConstant(name in fixed)
+  jpsi = ROOT.RooCrystalBall('jpsi', 'jpsi', mass, v['m0'], v['sigmaL'], v['sigmaR'], v['alphaL'], v['nL'], v['alphaR'], v['nR'])
+  m02 = ROOT.RooFormulaVar('m02', '@0+3.686097-3.096900', ROOT.RooArgList(v['m0']))
+  sL2 = ROOT.RooFormulaVar('sigmaL2', '@0*(1.09)', ROOT.RooArgList(v['sigmaL']))
+  sR2 = ROOT.RooFormulaVar('sigmaR2', '@0*(1.09)', ROOT.RooArgList(v['sigmaR']))
+  psi2s = ROOT.RooCrystalBall('psi2s', 'psi2s', mass, m02, sL2, sR2, v['alphaL'], v['nL'], v['alphaR'], v['nR'])
+  bkg = ROOT.RooGenericPdf('nrBg', 'nrBg', 'exp(@1*@0 + @2*@0*@0)', ROOT.RooArgList(mass, v['p1'], v['p2']))
+  pdfs, yields = [], []
+  for pdf, name in ((jpsi, 'nJpsi'), (psi2s, 'nPsi2s'), (bkg, 'nBg')):
+    if name not in fixed:
+      pdfs.append(pdf)
+      yields.append(v[name])
+  pdf = ROOT.RooAddPdf('fitData', 'fitData', ROOT.RooArgList(*pdfs), ROOT.RooArgList(*yields))
+  result = pdf.fitTo(data, ROOT.RooFit.Save(), ROOT.RooFit.Extended(True), ROOT.RooFit.PrintLevel(-1))
+  return {
+    'status': result.status(),
+    'params': {name: var.getVal() for name, var in v.items()},
+    'errors': {name: var.getError() for name, var in v.items()},
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Fit the mass distribution with the model of fitJPsi.cpp in numpy/scipy (unbinned on the trees, or binned on histograms): "
+                "a fast path for many fits, which can be checked against the same fit done with RooFit"
+  )
+  parser.add_argument('trees', nargs='*', help='ROOT files with the dimu trees to fit (all their DF_*/dimu trees)')
+  parser.add_argument('--hist', nargs='+', default=[], help='Histograms to fit (binned), as file.root:name, in the mass window of the sections')
+  parser.add_argument('-s', '--sections', nargs='+', default=None, help='Sections of the config to fit (default: all)')
+  parser.add_argument('-c', '--classes', nargs='+', choices=list(NEUTRON_CLASSES), default=['noSelection'], help='Neutron classes of the trees (default: noSelection)')
+  parser.add_argument('-v', '--variants', nargs='+', default=['default'], help=f"Fit variants: {', '.join(FIT_VARIANTS)} (default: default)")
+  parser.add_argument('--switch', nargs='+', default=[], help=f"Switches of the model for all the fits, as switch=true/false ({', '.join(SWITCHES)})")
+  parser.add_argument('-b', '--bins', type=int, default=0, help='Fit the trees binned, with this number of bins in the mass window (default: 0, unbinned)')
+  parser.add_argument('--config', default=os.path.join(MASS_FITS_DIR, 'config.cfg'), help='Config with the kinematic sections (default: ../mass-fits/config.cfg)')
+  parser.add_argument('--cache', action='store_true', help='Read the trees through their columnar cache (see cache-dimu.py)')
+  parser.add_argument('--roofit', action='store_true', help='Repeat every binned fit with RooFit (needs PyROOT) and compare the results')
+  parser.add_argument('--tolerance', type=float, default=0.01, help='With --roofit, maximum relative difference of the yields (default: 0.01)')
+  parser.add_argument('-o', '--output', default='fit-mass', help='Prefix of the results, <output>.csv and <output>.json (default: fit-mass)')
+  parser.add_argument('-j', '--workers', type=int, default=1, help='Number of processes for the fits (default: 1)')
+  args = parser.parse_args()
+
+  if not args.trees and not args.hist:
+    print('Error: give the trees or the histograms (--hist) to fit.')
+    sys.exit(1)
+  for path in args.trees + [spec.rpartition(':')[0] for spec in args.hist] + [args.config]:
+    if not os.path.isfile(path):
+      print(f"Error: '{path}' not found.")
+      sys.exit(1)
+  if args.roofit and args.trees and args.bins <= 0:
+    print('Error: --roofit compares binned fits, use --bins with the trees.')
+    sys.exit(1)
+  if args.roofit:
+    try:
+      import ROOT
+    except ImportError:
+      print('Error: --roofit needs PyROOT.')
+      sys.exit(1)
+  sections = read_config_sections(args.config)
+  names = args.sections or list(sections)
+  unknown = [s for s in names if s not in sections]
+  if unknown:
+    print(f"Error: section(s) {', '.join(unknown)} not in {args.config} ({', '.join(sections)}).")
+    sys.exit(1)
+  unknown = [v for v in args.variants if v not in FIT_VARIANTS]
+  if unknown:
+    print(f"Error: variant(s) {', '.join(unknown)} unknown ({', '.join(FIT_VARIANTS)}).")
+    sys.exit(1)
+  try:
+    switches = parse_switches(args.switch)
+  except ValueError as e:
+    print(f'Error: {e}')
+    sys.exit(1)
+
+  # the trees are read once, the histograms too
+  branches = ['fM', 'fPt', 'fRap']
+  arrays = {}
+  for path in args.trees:
+    try:
+      arrays[path] = open_cache(path, branches + ['fNclass']) if args.cache else read_dimu(path, branches + ['fNclass'])
+    except KeyError:
+      # MC trees have no neutron class
+      arrays[path] = open_cache(path, branches) if args.cache else read_dimu(path, branches)
+    if not len(arrays[path]['fM']):
+      print(f'Warning: no dimu entries in {path}.')
+  hists = {spec: read_hist(spec) for spec in args.hist}
+
+  rows = []
+  start = time.monotonic()
+  for section, variant in itertools.product(names, args.variants):
+    kin = sections[section]
+    model = MassModel(kin['minMass'], kin['maxMass'], {**FIT_VARIANTS[variant], **switches})
+    # datasets: (masses, None) for unbinned fits, (counts, edges) for binned ones
+    labels, datasets = [], []
+    for path, n_class in itertools.product(args.trees, args.classes):
+      if n_class != 'noSelection' and 'fNclass' not in arrays[path]:
+        continue
+      masses = select_masses(arrays[path], kin, n_class)
+      labels.append({'input': path, 'class': n_class})
+      if args.bins > 0:
+        counts, edges = np.histogram(masses, bins=args.bins, range=(kin['minMass'], kin['maxMass']))
+        datasets.append((counts.astype(float), edges))
+      else:
+        datasets.append((masses, None))
+    for spec, (counts, edges) in hists.items():
+      labels.append({'input': spec, 'class': ''})
+      datasets.append((counts, edges))
+    # one call of fit_many for each binning (None: unbinned)
+    t0 = time.monotonic()
+    results = [None] * len(datasets)
+    for edges in {None if e is None else tuple(e) for _, e in datasets}:
+      group = [i for i, (_, e) in enumerate(datasets) if (None if e is None else tuple(e)) == edges]
+      fits = fit_many(model, [datasets[i][0] for i in group], None if edges is None else np.array(edges), workers=args.workers)
+      for i, result in zip(group, fits):
+        results[i] = result
+    seconds = (time.monotonic() - t0) / max(len(results), 1)
+    for i, (label, result) in enumerate(zip(labels, results)):
+      row = {'section': section, 'variant': variant, **label, **kin, 'seconds': seconds,
+             **{k: result.get(k) for k in RESULT_COLUMNS}, 'params': result['params'], 'errors': result['errors']}
+      counts, edges = datasets[i]
+      if result['status'] == -1:
+        # too few entries (e.g. an empty class): reported with NaN values
+        rows.append(row)
+        print(f"  {section} {variant} {label['input']} {label['class']}: not fitted, {result['entries']:.0f} entries")
+        continue
+      if args.roofit and edges is not None:
+        reference = roofit_fit(model, counts, edges)
+        row['roofit'] = reference
+        diffs = {name: abs(result['params'][name] - reference['params'][name]) / max(abs(reference['params'][name]), 1e-9)
+                 for name in ('nJpsi', 'nBg') if name not in model.fixed()}
+        row['roofit_max_diff'] = max(diffs.values(), default=0.)
+      rows.append(row)
+      diff = f", RooFit diff {row['roofit_max_diff']:.2%}" if 'roofit_max_diff' in row else ''
+      print(f"  {section} {variant} {label['input']} {label['class']}: N(J/psi) = {result['numJPsi']:.1f} +- {result['errNumJPsi']:.1f}, "
+            f"N(bkg) = {result['numBkg']:.1f} +- {result['errNumBkg']:.1f}, status {result['status']}, covQual {result['covQual']}{diff}")
+
+  not_fitted = sum(r['status'] == -1 for r in rows)
+  print(f"{len(rows)} fit(s) in {time.monotonic() - start:.1f} s{f', {not_fitted} not fitted' if not_fitted else ''}, "
+        f"results in {args.output}.csv and .json")
+  with open(f'{args.output}.json', 'w') as f:
+    json.dump(rows, f, indent=2)
+  columns = ['section', 'variant', 'input', 'class', *sorted({k for s in names for k in sections[s]}), *RESULT_COLUMNS, 'seconds']
+  if args.roofit:
+    columns.append('roofit_max_diff')
+  with open(f'{args.output}.csv', 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+  if args.roofit:
+    worse = [r for r in rows if r.get('roofit_max_diff', 0) > args.tolerance]
+    for r in worse:
+      print(f"Error: {r['section']} {r['variant']} {r['input']}: yields differ from RooFit by {r['roofit_max_diff']:.2%} (> {args.tolerance:.2%})")
+    if worse:
+      sys.exit(2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+# index of the AO2D files
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from aodIndex import INDEX, update_index, parse_runs
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Index the AO2D files of an input list (size, mtime, events and run numbers of each file), and select the files of some runs"
+  )
+  parser.add_argument('file_list', help='Input list of AO2D files (e.g. file_list.txt)')
+  parser.add_argument('-i', '--index', default=None, help=f'Index file (default: {INDEX} in the directory of the list)')
+  parser.add_argument('-j', '--workers', type=int, default=4, help='Number of files read at the same time (default: 4)')
+  parser.add_argument('--runs', default=None, help='Comma separated run numbers, or a file with the run list: print only the files that contain them')
+  parser.add_argument('-o', '--output', default=None, help='With --runs, write the selected files in this list instead of printing them')
+  args = parser.parse_args()
+
+  if not os.path.isfile(args.file_list):
+    print(f"Error: File '{args.file_list}' not found.")
+    sys.exit(1)
+  list_dir = os.path.dirname(os.path.abspath(args.file_list))
+  index_path = args.index or os.path.join(list_dir, INDEX)
+
+  with open(args.file_list, 'r') as f:
+    lines = [line.strip() for line in f if line.strip()]
+  paths = []
+  for line in lines:
+    path = os.path.expanduser(line)
+    paths.append(os.path.abspath(path if os.path.isabs(path) else os.path.join(list_dir, path)))
+  missing = [p for p in paths if not os.path.isfile(p)]
+  for path in missing:
+    print(f'Warning: {path} not found, it is not indexed.')
+  files = update_index([p for p in paths if p not in missing], index_path, args.workers)
+
+  if args.runs:
+    runs = parse_runs(args.runs)
+    selected = [line for line, path in zip(lines, paths) if path in files and runs.intersection(files[path]['runs'])]
+    events = sum(files[p]['events'] for line, p in zip(lines, paths) if line in selected)
+    print(f'{len(selected)} of {len(lines)} files ({events} events) contain at least one of the {len(runs)} runs')
+    if args.output:
+      with open(args.output, 'w') as f:
+        f.write('\n'.join(selected))
+      print(f'Selected files written in {args.output}')
+    else:
+      for line in selected:
+        print(line)
+    return
+
+  # summary per run
+  per_run = {}
+  for entry in files.values():
+    for run in entry['runs']:
+      n_files, size = per_run.get(run, (0, 0))
+      per_run[run] = (n_files + 1, size + entry['size'])
+  total_events = sum(entry['events'] for entry in files.values())
+  print(f'{len(files)} files indexed in {index_path}: {total_events} events, {len(per_run)} runs')
+  print(f"{'run':>8} {'files':>7} {'size (GB)':>10}")
+  for run, (n_files, size) in sorted(per_run.items()):
+    print(f'{run:>8} {n_files:>7} {size/1024**3:>10.3f}')
+
+if __name__ == '__main__':
+  main()
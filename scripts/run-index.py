@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# readers of the trees and of the luminosity
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from lumiSum import LUMI_HISTOS
+from runIndex import open_index, is_source_current, replace_source, lumi_rows, candidate_rows, trigger_rows, run_yields
+
+READERS = {'lumi': lumi_rows, 'candidates': candidate_rows, 'triggers': trigger_rows}
+
+
+def format_value(value):
+  """Text of a value of the yield table: '-' if missing."""
+  if value is None:
+    return '-'
+  return f'{value:.6g}' if isinstance(value, float) else str(value)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Keep a per-run index (SQLite) of luminosity, trigger counts and J/psi candidates, and print the per-run yields"
+  )
+  parser.add_argument('-i', '--index', default='run-index.db', help='SQLite file of the index (default: run-index.db)')
+  parser.add_argument('-t', '--train', default='', help='Train the added files belong to (e.g. 455531)')
+  parser.add_argument('--lumi', nargs='+', default=[], help='AnalysisResults.root files with the hLumi* histograms (bins labelled by run)')
+  parser.add_argument('--trees', nargs='+', default=[], help='ROOT files with the dimu trees')
+  parser.add_argument('--triggers', nargs='+', default=[], help='Trigger count spreadsheets (e.g. ../lumi-hy/trg-count-25ae.cvs)')
+  parser.add_argument('-j', '--workers', type=int, default=1, help='Number of files read at the same time (default: 1)')
+  parser.add_argument('--lumi-histo', choices=LUMI_HISTOS, default='hLumiTCE', help='Luminosity used for the yields (default: hLumiTCE)')
+  parser.add_argument('--trigger', default=None, help='Trigger reported with the yields (default: the first one in the index)')
+  parser.add_argument('--only-train', default=None, help='Report only lumi and candidates of this train')
+  parser.add_argument('--csv', default=None, help='Write the per-run yields in this CSV file instead of printing them')
+  args = parser.parse_args()
+
+  db = open_index(args.index)
+
+  # read only the new or changed files
+  todo = []
+  for kind, files in (('lumi', args.lumi), ('candidates', args.trees), ('triggers', args.triggers)):
+    for file_path in files:
+      if not os.path.isfile(file_path):
+        print(f'The file {file_path} does not exist.')
+        sys.exit(1)
+      if is_source_current(db, file_path):
+        print(f'{file_path}: already in the index')
+        continue
+      todo.append((kind, file_path))
+
+  failed = False
+  with ProcessPoolExecutor(max_workers=args.workers) as pool:
+    futures = [pool.submit(READERS[kind], file_path) for kind, file_path in todo]
+    for (kind, file_path), future in zip(todo, futures):
+      try:
+        rows = future.result()
+      except (OSError, ValueError, KeyError) as e:
+        print(f'Error: cannot read {file_path}: {e}')
+        failed = True
+        continue
+      replace_source(db, file_path, args.train, kind, rows)
+      print(f'{file_path}: {len(rows)} {kind} row(s) indexed')
+
+  # per-run yields
+  header = ['run', 'candidates', 'jpsi-candidates', args.lumi_histo, 'triggers', 'jpsi-per-lumi']
+  rows = run_yields(db, args.lumi_histo, args.trigger, args.only_train)
+  db.close()
+  if failed:
+    print('Some files could not be read: they are not in the index.')
+  if args.csv:
+    with open(args.csv, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(header)
+      writer.writerows(rows)
+    print(f'Per-run yields of {len(rows)} run(s) written in {args.csv}')
+    return
+  print(' '.join(f'{h:>16}' for h in header))
+  for row in rows:
+    print(' '.join(f'{format_value(v):>16}' for v in row))
+
+if __name__ == '__main__':
+  main()
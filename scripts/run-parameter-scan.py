@@ -1,11 +1,19 @@
 import json
-import subprocess
+import shlex
 import os
 import argparse
 import itertools
 import shutil
 import csv
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# python readers of the trees (needed only by the offline scan, that requires numpy and uproot)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from jobStats import kill_groups, report_row, write_report, print_summary
+from runTask import TaskRun, RunTaskError
+from resultCache import config_digest, inputs_digest
 
 # Recursively search for a key in a nested dictionary
 # Used for sanity check to ensure scan parameters exist in base config
@@ -30,6 +38,228 @@ def set_key_recursive(d, key, value):
         return True   # propagate success up the call stack
   return False        # key not found in this branch
 
+# Return the value of a key in a nested dictionary (the first match, as set_key_recursive)
+def get_key_recursive(d, key):
+  """Return the value of key anywhere in nested dict d, None if it is missing."""
+  if isinstance(d, dict):
+    if key in d:
+      return d[key]
+    for v in d.values():
+      found = get_key_recursive(v, key)
+      if found is not None:
+        return found
+  return None
+
+# Make the input of the config absolute, so the analysis can run from any directory
+def make_input_absolute(config):
+  """Rewrite 'aod-file-private' (with or without the leading '@') as an absolute path."""
+  reader = config.get('internal-dpl-aod-reader', {})
+  aod_file = str(reader.get('aod-file-private', '') or '')
+  if aod_file.strip():
+    prefix = '@' if aod_file.startswith('@') else ''
+    reader['aod-file-private'] = prefix + os.path.abspath(os.path.expanduser(aod_file.lstrip('@')))
+
+# Run one scan point in its own working directory
+# Used to run several points at the same time without mixing their outputs
+def run_scan_point(point, output_dir):
+  """
+  Run the task for a scan point in this process (see runTask.py), inside its working directory,
+  then move the ROOT files it produced to output_dir.
+  Returns (run index, exit code, names of the moved files, resources used by the run as in jobStats.run_measured).
+  """
+  os.makedirs(point["workdir"], exist_ok=True)
+  if point["log"]:
+    open(point["log"], "w").close()
+  task = TaskRun(cwd=point["workdir"], log=point["log"], **point["task"])
+  try:
+    task.run()
+  except (RunTaskError, OSError) as e:
+    task.say(f"Error: {e}")
+    task.stats["ret"] = task.stats["ret"] or 1
+  stats = task.stats
+  ret = stats["ret"]
+  if ret != 0:
+    return point["index"], ret, [], stats
+  # the directory belongs to this point only: all the ROOT files in it are its outputs
+  moved = []
+  for fname in sorted(os.listdir(point["workdir"])):
+    if fname.endswith('.root'):
+      shutil.move(os.path.join(point["workdir"], fname), os.path.join(output_dir, fname))
+      moved.append(fname)
+  shutil.rmtree(point["workdir"], ignore_errors=True)
+  return point["index"], 0, moved, stats
+
+# Run the scan points, at most parallel at the same time
+# After a failure no new point is started, the running ones are let finish
+def run_points(points, parallel, output_dir, report=None):
+  """
+  Run the points with run_scan_point. Returns (dict run index -> moved files, list of failed run indices).
+  The resources used by each point are appended to report, if given.
+  """
+  outputs = {}
+  failed = []
+  print(f"\nRunning {len(points)} points, at most {parallel} at the same time")
+  pending = list(points)
+  running = set()
+  with ThreadPoolExecutor(max_workers=parallel) as pool:
+    try:
+      while pending or running:
+        while pending and not failed and len(running) < parallel:
+          point = pending.pop(0)
+          print(f"  Starting run {point['index']}")
+          running.add(pool.submit(run_scan_point, point, output_dir))
+        if not running:
+          break
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          index, ret, moved, stats = future.result()
+          if report is not None:
+            report.append(report_row('point', f"run-{index}", stats))
+          if ret != 0:
+            print(f"Error: run {index} failed with exit code {ret}")
+            failed.append(index)
+          else:
+            print(f"  Run {index} completed")
+            outputs[index] = moved
+    except BaseException:
+      # interrupted (Ctrl-C): the commands of the points are in their own sessions, they would go on running
+      kill_groups()
+      raise
+  return outputs, failed
+
+# Scan parameters of the task that only select the kinematics of the dimuon:
+# they can be applied afterwards on the dimu tree, as (branch, comparison)
+OFFLINE_CUTS = {
+  'lowPt': ('fPt', '>='), 'highPt': ('fPt', '<='),
+  'lowMass': ('fM', '>='), 'highMass': ('fM', '<='),
+  'lowRapidity': ('fRap', '>='), 'highRapidity': ('fRap', '<='),
+  'lowPhi': ('fPhi', '>='), 'highPhi': ('fPhi', '<='),
+}
+
+# Loosest value of an offline cut among the scanned ones
+def loosest_value(param, values):
+  """Smallest value for lower cuts, largest for upper cuts (as given in the scan JSON)."""
+  pick = min if OFFLINE_CUTS[param][1] == '>=' else max
+  return pick(values, key=float)
+
+# Digest of the input files of a config (with 'aod-file-private' absolute), to know if a skim was made from them
+def config_inputs_digest(config):
+  """Digest of the files of the input list (or of the input file) with their size and mtime, see resultCache.inputs_digest."""
+  aod_file = str(config.get('internal-dpl-aod-reader', {}).get('aod-file-private', ''))
+  if not aod_file.startswith('@'):
+    return inputs_digest([aod_file])
+  list_path = aod_file[1:]
+  with open(list_path, "r") as f:
+    paths = [os.path.abspath(os.path.join(os.path.dirname(list_path), os.path.expanduser(line.strip()))) for line in f if line.strip()]
+  return inputs_digest(paths)
+
+# Record of the skim pass, written next to the skimmed tree, so that later scans can reuse it
+def skim_record(config, tree_path):
+  """Config of the skim pass, digest of its inputs and size/mtime of the skimmed tree."""
+  st = os.stat(tree_path)
+  return {"config": config, "inputs": config_inputs_digest(config), "tree": os.path.basename(tree_path),
+          "tree_size": st.st_size, "tree_mtime_ns": st.st_mtime_ns}
+
+# A skim can replace the raw input of a scan if it was made from the same inputs and settings, with looser cuts
+def is_skim_usable(record, config, tree_path):
+  """
+  True if the skimmed tree of record is still there and contains all the candidates that config selects:
+  same input files and same config except the kinematic cuts, each of them at least as loose in the skim.
+  """
+  try:
+    st = os.stat(tree_path)
+  except OSError:
+    return False
+  if (st.st_size, st.st_mtime_ns) != (record["tree_size"], record["tree_mtime_ns"]):
+    return False
+  for key, (_, op) in OFFLINE_CUTS.items():
+    new, old = get_key_recursive(config, key), get_key_recursive(record["config"], key)
+    if new is None or old is None:
+      if new is not old:
+        return False
+    elif (float(new) < float(old)) if op == '>=' else (float(new) > float(old)):
+      return False
+  stripped = []
+  for c in (config, record["config"]):
+    c = json.loads(json.dumps(c))
+    for key in OFFLINE_CUTS:
+      set_key_recursive(c, key, None)
+    stripped.append(config_digest(c))
+  return stripped[0] == stripped[1] and record["inputs"] == config_inputs_digest(config)
+
+# Apply all the offline cut combinations on a dimu tree, reading it only once
+def evaluate_offline_cuts(tree_path, param_names, combinations):
+  """
+  Read the dimu tree in columns and, for each combination of values of param_names (all in OFFLINE_CUTS),
+  select the candidates with vectorized masks. Yields (values, histograms, candidates in the J/psi window).
+  """
+  import numpy as np
+  from dimuVars import read_dimu, first_look_histos, histo_branches, JPSI_WINDOW, FIRST_LOOK_HISTOS
+
+  branches = set(histo_branches(FIRST_LOOK_HISTOS)) | {OFFLINE_CUTS[p][0] for p in param_names}
+  arrays = read_dimu(tree_path, sorted(branches))
+  # one mask per scanned value of each cut, then each combination is the AND of its masks
+  masks = {}
+  for values in combinations:
+    for p, v in zip(param_names, values):
+      if (p, v) not in masks:
+        branch, op = OFFLINE_CUTS[p]
+        masks[(p, v)] = arrays[branch] >= float(v) if op == '>=' else arrays[branch] <= float(v)
+  for values in combinations:
+    mask = np.logical_and.reduce([masks[(p, v)] for p, v in zip(param_names, values)])
+    mass = arrays['fM'][mask]
+    n_jpsi = int(np.count_nonzero((mass >= JPSI_WINDOW[0]) & (mass <= JPSI_WINDOW[1])))
+    yield values, first_look_histos(arrays, mask), n_jpsi, mass
+
+# Objectives of the adaptive scan, computed from the masses of the candidates selected by a point
+# (significance: J/psi window minus the background of the sidebands scaled to its width, over sqrt(window))
+SIDEBANDS = ((2.5, 2.7), (3.4, 3.6))
+OBJECTIVES = ['jpsi_candidates', 'significance', 'fit_yield']
+
+def objective_value(objective, masses, fit_window=None):
+  """Value of the objective (the larger the better) for the masses of a point; fit_yield fits them with massFit in fit_window."""
+  import numpy as np
+  from dimuVars import JPSI_WINDOW
+  masses = np.asarray(masses, dtype=float)
+  n_window = np.count_nonzero((masses >= JPSI_WINDOW[0]) & (masses <= JPSI_WINDOW[1]))
+  if objective == 'jpsi_candidates':
+    return float(n_window)
+  if objective == 'significance':
+    n_side = sum(np.count_nonzero((masses >= lo) & (masses <= up)) for lo, up in SIDEBANDS)
+    bkg = n_side * (JPSI_WINDOW[1] - JPSI_WINDOW[0]) / sum(up - lo for lo, up in SIDEBANDS)
+    return float((n_window - bkg) / np.sqrt(n_window)) if n_window else 0.
+  from massFit import MassModel, fit
+  inside = masses[(masses >= fit_window[0]) & (masses <= fit_window[1])]
+  if len(inside) < 10:
+    return 0.
+  result = fit(MassModel(*fit_window), masses=inside)
+  return result['numJPsi'] if result['status'] == 0 else 0.
+
+# Values of a scan range: n points from lo to hi, integers if both ends are integers
+def range_values(lo, hi, n):
+  """n equally spaced values in [lo, hi] (without repetitions for integer ranges)."""
+  values = [lo + (hi - lo) * i / max(n - 1, 1) for i in range(n)]
+  if isinstance(lo, int) and isinstance(hi, int):
+    return sorted(set(int(round(v)) for v in values))
+  return [round(v, 10) for v in values]
+
+# Next points of the adaptive scan: a grid of 3 values per parameter (best - step, best, best + step) around the best points
+def refine_points(best, steps, ranges, evaluated):
+  """Points around each of best that are within the ranges and not in evaluated, best first."""
+  points = []
+  for center in best:
+    axes = []
+    for value, step, (lo, hi) in zip(center, steps, ranges):
+      integer = isinstance(lo, int) and isinstance(hi, int)
+      if integer:
+        step = max(int(round(step)), 1)
+      axis = [value - step, value, value + step]
+      axes.append(sorted(set(v if integer else round(v, 10) for v in axis if lo <= v <= hi)))
+    for values in itertools.product(*axes):
+      if values not in evaluated and values not in points:
+        points.append(values)
+  return points
+
 # Entry point for parameter scan automation
 def main():
   parser = argparse.ArgumentParser(
@@ -55,10 +285,32 @@ def main():
   parser.add_argument('-u', '--use-sub-jobs', action='store_true', help='Enable processing in sub-jobs via run-task subjob support')
   parser.add_argument('--chunk-num', type=int, default=None, help='Number of items per chunk when using sub-jobs')
   parser.add_argument('--chunk-max-size', type=float, default=None, help='Maximum data size (GB) per chunk when using sub-jobs')
+  parser.add_argument('--parallel', type=int, default=1, help='Number of scan points running at the same time, each one in its own directory (default: 1)')
+  parser.add_argument('--cores', type=int, default=None, help='Cores shared by all the running points: with sub-jobs each point runs cores/parallel chunks at the same time (default: one chunk at a time, or the number of CPUs with --mem-budget)')
+  parser.add_argument('--mem-budget', type=float, default=None, help='Memory (GB) shared by all the running points: each point gets mem-budget/parallel for its sub-jobs (requires --use-sub-jobs)')
+  parser.add_argument('--offline', action='store_true', help=f"Apply the kinematic parameters ({', '.join(OFFLINE_CUTS)}) on the dimu tree instead of rerunning the task for each of their values: the task runs once per combination of the other parameters (requires numpy and uproot)")
+  parser.add_argument('--skim', action='store_true', help="Run the task once with the loosest value of every scanned parameter (all of them kinematic) and apply the cuts of all the points on this skim, as --offline. The skim is kept in <output_dir>/<output_base>-skim-tree.root and reused, without reading the raw input, by later scans of the same inputs and config whose cuts are all within it")
+  parser.add_argument('--offline-tree', default=None, help='With --offline, merged dimu tree to use instead of running the task (only if all the scanned parameters are kinematic)')
+  parser.add_argument('--cache-dir', default=None, help='Result cache passed to run-task.py: a point with the same config, inputs and executables as an earlier run or scan point links its outputs from the cache instead of running')
+  parser.add_argument('--cache-max-size', type=float, default=None, help='Maximum size (GB) of the result cache, passed to run-task.py')
+  parser.add_argument('--budget', type=int, default=None, help='Adaptive scan (scan_ranges in the JSON): maximum number of points to run, overrides "budget" of the JSON (default: 30)')
   args = parser.parse_args()        # parse and validate input flags
-
-  # Path to the analysis script invoked for each parameter set
-  run_task_script = os.path.expanduser("~/Desktop/run3-OO-jpsi/scripts/run-task.py")
+  if args.skim and args.offline_tree:
+    print("Error: --skim and --offline-tree cannot be used together.")
+    sys.exit(1)
+  args.offline = args.offline or args.skim
+  if args.parallel < 1:
+    print("Error: --parallel must be at least 1.")
+    sys.exit(1)
+  if args.mem_budget is not None and not args.use_sub_jobs:
+    print("Error: --mem-budget can only be used with --use-sub-jobs.")
+    sys.exit(1)
+  if args.offline_tree and not args.offline:
+    print("Error: --offline-tree can only be used with --offline.")
+    sys.exit(1)
+  if args.offline_tree and not os.path.isfile(args.offline_tree):
+    print(f"Error: dimu tree '{args.offline_tree}' not found.")
+    sys.exit(1)
 
   # Verify CLI JSON file exists
   if not os.path.isfile(args.param_json):
@@ -73,19 +325,55 @@ def main():
     print(f"Error: failed to parse JSON '{args.param_json}': {e}")
     sys.exit(1)
 
-  # Check required keys
-  for key in ("base_config", "scan_params"):
-    if key not in param_dict:
-      print(f"Error: '{key}' missing in parameter JSON.")
-      sys.exit(1)
-
-  # scan_params must be a non-empty dict of lists
-  sp = param_dict["scan_params"]
-  if (not isinstance(sp, dict) or not sp or
-    any(not isinstance(v, list) or not v for v in sp.values())):
-    print("Error: 'scan_params' must be a non-empty dict of non-empty lists.")
+  # Check required keys: the values to scan are lists (scan_params) or, for the adaptive scan, ranges (scan_ranges)
+  if "base_config" not in param_dict:
+    print("Error: 'base_config' missing in parameter JSON.")
+    sys.exit(1)
+  adaptive = "scan_ranges" in param_dict
+  if adaptive == ("scan_params" in param_dict):
+    print("Error: the parameter JSON needs either 'scan_params' (lists of values) or 'scan_ranges' (adaptive scan).")
     sys.exit(1)
 
+  if adaptive:
+    # scan_ranges must be a non-empty dict of [min, max]
+    sr = param_dict["scan_ranges"]
+    if (not isinstance(sr, dict) or not sr or
+      any(not isinstance(v, list) or len(v) != 2 or not all(isinstance(x, (int, float)) for x in v) or v[0] >= v[1] for v in sr.values())):
+      print("Error: 'scan_ranges' must be a non-empty dict of [min, max] with min < max.")
+      sys.exit(1)
+    objective = param_dict.get("objective", "jpsi_candidates")
+    if objective not in OBJECTIVES:
+      print(f"Error: objective '{objective}' unknown ({', '.join(OBJECTIVES)}).")
+      sys.exit(1)
+    budget = args.budget if args.budget is not None else param_dict.get("budget", 30)
+    coarse_points = param_dict.get("coarse_points", 3)
+    refine_top = param_dict.get("refine_top", 1)
+    if budget < 1 or coarse_points < 2 or refine_top < 1:
+      print("Error: the budget and refine_top must be at least 1, coarse_points at least 2.")
+      sys.exit(1)
+    # the whole coarse grid must fit in the budget: a part of it would leave most of the ranges unexplored
+    if coarse_points ** len(sr) > budget:
+      print(f"Error: the coarse grid has {coarse_points}^{len(sr)} = {coarse_points ** len(sr)} points, more than the budget of {budget} runs: "
+            f"reduce coarse_points or increase the budget.")
+      sys.exit(1)
+    # window of the fit of the fit_yield objective, from a section of the config of the mass fits
+    fit_window = None
+    if objective == "fit_yield":
+      from massFit import read_config_sections
+      section = param_dict.get("fit_section", "jPsi")
+      fit_sections = read_config_sections(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'mass-fits', 'config.cfg'))
+      if section not in fit_sections:
+        print(f"Error: fit_section '{section}' not in mass-fits/config.cfg ({', '.join(fit_sections)}).")
+        sys.exit(1)
+      fit_window = (fit_sections[section]['minMass'], fit_sections[section]['maxMass'])
+  else:
+    # scan_params must be a non-empty dict of lists
+    sp = param_dict["scan_params"]
+    if (not isinstance(sp, dict) or not sp or
+      any(not isinstance(v, list) or not v for v in sp.values())):
+      print("Error: 'scan_params' must be a non-empty dict of non-empty lists.")
+      sys.exit(1)
+
   # Verify base_config file exists
   base_cfg = param_dict["base_config"]
   if not os.path.isfile(base_cfg):
@@ -93,6 +381,10 @@ def main():
     sys.exit(1)
 
   scan_params = param_dict.get("scan_params", {})   # mapping param_name -> [values]
+  scan_ranges = param_dict.get("scan_ranges", {})   # mapping param_name -> [min, max] (adaptive scan)
+  if adaptive:
+    # the ends of the ranges are the loosest values, e.g. for the tree of an offline scan
+    scan_params = {k: list(v) for k, v in scan_ranges.items()}
   base_config_file = param_dict.get("base_config")  # template JSON config
   base_output_name = param_dict.get(
     "output_base", os.path.splitext(os.path.basename(args.param_json))[0])
@@ -127,9 +419,16 @@ def main():
   param_names = list(scan_params.keys())
   param_values = [scan_params[k] for k in param_names]
 
-  # Compute every combination of parameters to test
-  all_combinations = list(itertools.product(*param_values))
+  # Compute every combination of parameters to test (for the adaptive scan, the coarse grid run first)
+  if adaptive:
+    ranges = [scan_ranges[k] for k in param_names]
+    all_combinations = list(itertools.product(*[range_values(lo, hi, coarse_points) for lo, hi in ranges]))
+  else:
+    all_combinations = list(itertools.product(*param_values))
   print(f"\nScan summary:")
+  if adaptive:
+    print(f"  Adaptive scan: maximize {objective} over {', '.join(f'{k} in [{lo}, {hi}]' for k, (lo, hi) in zip(param_names, ranges))}")
+    print(f"  Budget: {budget} runs, coarse grid of {len(all_combinations)} runs, then refined around the best {refine_top} point(s)")
   print(f"  Number of runs: {len(all_combinations)}")
   print(f"  Parameter combinations:")
   for i, values in enumerate(all_combinations, 1):
@@ -146,64 +445,240 @@ def main():
     print(f"Error: The following scanned parameters are missing in base config: {', '.join(missing_params)}")
     exit(1)
 
-  file_map = {}     # will hold mapping of runs to outputs
-  file_counter = 1  # incremental run index
-
-  # Loop through each parameter combination, run analysis, and collect outputs
-  for values in all_combinations:
-    config = json.loads(json.dumps(base_config))  # deep copy to isolate runs
-    for k, v in zip(param_names, values):
-      set_key_recursive(config, k, v)  # apply new values
+  # Split the cores and the memory among the points running at the same time: without --cores (and without a memory
+  # budget, that bounds them) the chunks of a point run one at a time, as by default in run-task.py
+  sub_jobs_per_point = None
+  if args.cores is not None or args.mem_budget is not None:
+    sub_jobs_per_point = max(1, (args.cores or os.cpu_count() or 1) // args.parallel)
+  mem_per_point = args.mem_budget / args.parallel if args.mem_budget is not None else None
 
-    config_name = f"{base_output_name}-{file_counter}.json"
-    config_path = os.path.join(output_dir, config_name)
+  # Prepare the config and the options of a run of the task
+  def prepare_point(index, name, config, params):
+    make_input_absolute(config)  # each point runs in its own directory
+    config_name = f"{name}.json"
+    config_path = os.path.abspath(os.path.join(output_dir, config_name))
     with open(config_path, "w") as f:
       json.dump(config, f, indent=2)  # save per-run config
 
-    # Record existing ROOT files to detect new ones
-    before_files = set(f for f in os.listdir('.') if f.endswith('.root'))
-
-    # Construct and optionally execute the analysis command
-    cmd = [
-      "python3", run_task_script,
-      "-j", config_path
-    ]
+    # Options of the run (named as the options of run-task.py), and the equivalent command for the record
+    task = {"json_file": config_path}
+    cmd = ["run-task.py", "-j", config_path]
     if args.task_name:
+      task["script"] = args.task_name
       cmd += ["-s", args.task_name]
     if args.data_type:
+      task["data_type"] = args.data_type
       cmd += ["-t", args.data_type]
+    if args.cache_dir:
+      task["cache_dir"] = os.path.abspath(args.cache_dir)
+      cmd += ["--cache-dir", task["cache_dir"]]
+      if args.cache_max_size is not None:
+        task["cache_max_size"] = args.cache_max_size
+        cmd += ["--cache-max-size", str(args.cache_max_size)]
     if args.use_sub_jobs:
-      cmd += ["-u"]
-      jobs_dest = os.path.join(output_dir, f"jobs-{file_counter}")
+      jobs_dest = os.path.abspath(os.path.join(output_dir, f"jobs-{name[len(base_output_name)+1:]}"))
       print("jobs_dest", jobs_dest)
-      cmd += ["--jobs-dir", jobs_dest]
+      task.update(use_sub_jobs=True, jobs_dir=jobs_dest)
+      cmd += ["-u", "--jobs-dir", jobs_dest]
       if args.chunk_num is not None:
+        task["chunk_num"] = args.chunk_num
         cmd += ["--chunk-num", str(args.chunk_num)]
       if args.chunk_max_size is not None:
+        task["chunk_max_size"] = args.chunk_max_size
         cmd += ["--chunk-max-size", str(args.chunk_max_size)]
-  
-    print(f"\nRun {file_counter}:")
-    print(f"  Parameters: {dict(zip(param_names, values))}")
-    print(f"  Command: {' '.join(cmd)}")
+      if sub_jobs_per_point is not None:
+        task["max_parallel"] = sub_jobs_per_point
+        cmd += ["--max-parallel", str(sub_jobs_per_point)]
+      if mem_per_point is not None:
+        task["mem_budget"] = mem_per_point
+        cmd += ["--mem-budget", str(mem_per_point)]
+
+    print(f"\nRun {index}:")
+    print(f"  Parameters: {params}")
+    print(f"  Command: {shlex.join(cmd)}")
     if args.dry_run:
       print("  [Dry-run] Command not executed.")
-    else:
-      subprocess.run(cmd, check=True)  # halt on failure
-
-    # Move any newly generated ROOT files into the output directory
-    after_files = set(f for f in os.listdir('.') if f.endswith('.root'))
-    new_files = after_files - before_files
-    run_file_names = []
-    for fname in new_files:
-      dest = os.path.join(output_dir, fname)
-      shutil.move(fname, dest)
-      run_file_names.append(fname)
-    run_file_names.append(config_name)  # include the config file in record
-    file_map[f"run-{file_counter}"] = {
-      "params": dict(zip(param_names, values)),
-      "files": run_file_names
+    return {
+      "index": index,
+      "name": name,
+      "config": config,
+      "params": params,
+      "config_name": config_name,
+      "task": task,
+      "workdir": os.path.join(output_dir, f"run-{name[len(base_output_name)+1:]}"),
+      # with several points at the same time the terminal output would be mixed: one log per point
+      "log": os.path.join(output_dir, f"{name}.log") if args.parallel > 1 else None,
     }
-    file_counter += 1
+
+  file_map = {}     # will hold mapping of runs to outputs
+  failed = []
+  # resources used by the points, written next to the file map
+  report = []
+  scan_start = time.monotonic()
+  def save_report():
+    if report:
+      report_base = os.path.join(output_dir, f"{base_output_name}-report")
+      print_summary(write_report(report_base, report, time.monotonic() - scan_start, unit='point'), report)
+      print(f"  Report written in {report_base}.json and {report_base}.csv")
+  if args.offline:
+    # Kinematic parameters are applied on the tree, the others need the task
+    offline_names = [p for p in param_names if p in OFFLINE_CUTS]
+    task_names = [p for p in param_names if p not in OFFLINE_CUTS]
+    if not offline_names:
+      print(f"Error: none of the scanned parameters can be applied offline ({', '.join(OFFLINE_CUTS)}).")
+      sys.exit(1)
+    if args.offline_tree and task_names:
+      print(f"Error: --offline-tree cannot be used, the parameters {', '.join(task_names)} need to run the task.")
+      sys.exit(1)
+    if adaptive and task_names:
+      print(f"Error: the adaptive scan cannot be done offline, the parameters {', '.join(task_names)} need to run the task.")
+      sys.exit(1)
+    if args.skim and task_names:
+      print(f"Error: --skim cannot be used, the parameters {', '.join(task_names)} need the raw input for each of their values (use --offline).")
+      sys.exit(1)
+    print(f"\n{'Skim' if args.skim else 'Offline'} scan: {', '.join(offline_names)} applied on the dimu tree"
+          + (f", task run for each value of {', '.join(task_names)}" if task_names else ""))
+
+    # One run of the task for each combination of the task parameters, with the loosest kinematic cuts
+    task_combinations = list(itertools.product(*[scan_params[p] for p in task_names]))
+    trees = {}
+    full_points = []
+    skim_path = os.path.join(output_dir, f"{base_output_name}-skim-record.json")
+    for group, task_values in enumerate(task_combinations, 1):
+      if args.offline_tree:
+        trees[task_values] = args.offline_tree
+        continue
+      config = json.loads(json.dumps(base_config))
+      params = dict(zip(task_names, task_values))
+      params.update({p: loosest_value(p, scan_params[p]) for p in offline_names})
+      for k, v in params.items():
+        set_key_recursive(config, k, v)
+      name = f"{base_output_name}-skim" if args.skim else f"{base_output_name}-full-{group}"
+      tree = os.path.join(output_dir, f"{name}-tree.root")
+      trees[task_values] = tree
+      if args.skim and os.path.isfile(skim_path):
+        # a skim of an earlier scan with looser cuts makes the pass on the raw input unnecessary
+        make_input_absolute(config)
+        with open(skim_path, "r") as f:
+          record = json.load(f)
+        if is_skim_usable(record, config, tree):
+          print(f"\nSkim {tree} contains all the points (cuts {dict((k, get_key_recursive(record['config'], k)) for k in offline_names)}): the raw input is not read.")
+          continue
+        print(f"\nSkim {tree} cannot be used (different inputs or config, or tighter cuts): it is made again.")
+      full_points.append(prepare_point(group, name, config, params))
+    if full_points and not args.dry_run:
+      outputs, failed = run_points(full_points, args.parallel, output_dir, report)
+      if failed:
+        print(f"Error: full run(s) {', '.join(map(str, sorted(failed)))} failed, no offline selection done.")
+        save_report()
+        sys.exit(1)
+      if args.skim:
+        with open(skim_path, "w") as f:
+          json.dump(skim_record(full_points[0]["config"], trees[()]), f, indent=2)
+
+    # Apply the kinematic cuts of the points (index, values) on the tree of their task parameters
+    offline_idx = [param_names.index(p) for p in offline_names]
+    task_idx = [param_names.index(p) for p in task_names]
+    def evaluate_points(runs):
+      """Fill the file map for the points; returns run index -> masses of the selected candidates."""
+      masses = {}
+      for task_values, tree in trees.items():
+        tree_runs = [(i, values) for i, values in runs if tuple(values[j] for j in task_idx) == task_values]
+        print(f"\nApplying {len(tree_runs)} cut combination(s) on {tree}")
+        if args.dry_run:
+          print("  [Dry-run] Selection not done.")
+          continue
+        from dimuVars import write_histos
+        cut_values = [tuple(values[j] for j in offline_idx) for _, values in tree_runs]
+        for (index, values), (_, histos, n_jpsi, mass) in zip(tree_runs, evaluate_offline_cuts(tree, offline_names, cut_values)):
+          config = json.loads(json.dumps(base_config))
+          for k, v in zip(param_names, values):
+            set_key_recursive(config, k, v)
+          config_name = f"{base_output_name}-{index}.json"
+          with open(os.path.join(output_dir, config_name), "w") as f:
+            json.dump(config, f, indent=2)  # config equivalent to the point, for the record
+          histo_name = f"{base_output_name}-{index}-offline.root"
+          write_histos(os.path.join(output_dir, histo_name), histos)
+          print(f"  Run {index}: {dict(zip(param_names, values))} -> {n_jpsi} J/psi candidates")
+          file_map[f"run-{index}"] = {
+            "params": dict(zip(param_names, values)),
+            "files": [histo_name, config_name],
+            "tree": os.path.relpath(tree, output_dir),
+            "jpsi_candidates": n_jpsi
+          }
+          masses[index] = mass
+      return masses
+  else:
+    def evaluate_points(runs):
+      """Run the task for the points (index, values) and fill the file map; returns run index -> masses of the candidates of its trees."""
+      nonlocal failed
+      # Prepare the config and the command of each parameter combination
+      points = []
+      for file_counter, values in runs:
+        config = json.loads(json.dumps(base_config))  # deep copy to isolate runs
+        for k, v in zip(param_names, values):
+          set_key_recursive(config, k, v)  # apply new values
+        points.append(prepare_point(file_counter, f"{base_output_name}-{file_counter}", config, dict(zip(param_names, values))))
+
+      # Run the points, at most args.parallel at the same time; stop starting new ones after a failure
+      outputs = {}   # run index -> ROOT files moved to the output directory
+      if not args.dry_run:
+        outputs, failed_now = run_points(points, args.parallel, output_dir, report)
+        failed += failed_now
+
+      # Assemble the mapping in the order of the runs, whatever the order in which they finished
+      masses = {}
+      for point in points:
+        if point["index"] not in outputs and not args.dry_run:
+          continue
+        run_file_names = outputs.get(point["index"], [])
+        if adaptive and not args.dry_run:
+          from dimuVars import read_dimu
+          import numpy as np
+          # the merged trees of run-task.py end with -tree.root
+          trees = [f for f in run_file_names if f.endswith('-tree.root')]
+          masses[point["index"]] = np.concatenate([read_dimu(os.path.join(output_dir, f), ['fM'])['fM'] for f in trees] + [np.empty(0)])
+        run_file_names.append(point["config_name"])  # include the config file in record
+        file_map[f"run-{point['index']}"] = {
+          "params": point["params"],
+          "files": run_file_names
+        }
+      return masses
+
+  runs = list(enumerate(all_combinations, 1))
+  if not adaptive:
+    evaluate_points(runs)
+  else:
+    # Coarse grid first, then grids of half the step around the best points, until the budget is used
+    # or the step is below 1/1000 of the ranges (or the grid around the best points has been run)
+    steps = [(hi - lo) / (coarse_points - 1) for lo, hi in ranges]
+    evaluated = {}  # values -> objective
+    n_runs = len(runs)
+    round_number = 1
+    while runs:
+      print(f"\nAdaptive scan, round {round_number}: {len(runs)} point(s)")
+      masses = evaluate_points(runs)
+      if args.dry_run:
+        break
+      for index, values in runs:
+        if index in masses:
+          value = objective_value(objective, masses[index], fit_window)
+          evaluated[values] = value
+          file_map[f"run-{index}"]["objective"] = value
+          print(f"  Run {index}: {objective} = {value:.4g}")
+      if failed:
+        break
+      steps = [step / 2 for step in steps]
+      best = sorted(evaluated, key=evaluated.get, reverse=True)[:refine_top]
+      if not best or all(step < (hi - lo) / 1000 for step, (lo, hi) in zip(steps, ranges)):
+        break
+      next_values = refine_points(best, steps, ranges, set(evaluated))[:budget - n_runs]
+      runs = [(n_runs + i, values) for i, values in enumerate(next_values, 1)]
+      n_runs += len(runs)
+      round_number += 1
+    if evaluated:
+      best = max(evaluated, key=evaluated.get)
+      print(f"\nBest point after {len(evaluated)} run(s): {dict(zip(param_names, best))}, {objective} = {evaluated[best]:.4g}")
 
   # Save mapping of all runs to a JSON
   map_path = os.path.join(output_dir, f"{base_output_name}-file-map.json")
@@ -214,7 +689,10 @@ def main():
   csv_path = os.path.join(output_dir, f"{base_output_name}-file-map.csv")
   with open(csv_path, "w", newline='') as csvfile:
     writer = csv.writer(csvfile)
-    writer.writerow(["run", *param_names, "config-json", "root-files"])
+    extra = ["jpsi-candidates"] if args.offline else []
+    if adaptive:
+      extra.append("objective")
+    writer.writerow(["run", *param_names, "config-json", "root-files", *extra])
     for run, info in file_map.items():
       params = [info["params"].get(k, "") for k in param_names]
       config_json = [f for f in info["files"] if f.endswith(".json")]
@@ -223,8 +701,14 @@ def main():
         run.replace("run-", ""),
         *params,
         ";".join(config_json),
-        ";".join(root_files)
+        ";".join(root_files),
+        *[info.get(key.replace("-", "_"), "") for key in extra]
       ])
+  save_report()
+
+  if failed:
+    print(f"Error: run(s) {', '.join(map(str, sorted(failed)))} failed, the file map contains only the completed runs.")
+    sys.exit(1)
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+
+# numpy/scipy mass model and toy engine
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from massFit import SHAPE_PARAMS, PARAMS, SWITCHES, FIT_VARIANTS, MassModel, read_config_sections, parse_switches
+from toyMC import run_toys, summarize, good_fit
+
+MASS_FITS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'mass-fits'))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Generate pseudo-datasets from the mass model of fitJPsi.cpp with given parameters (a fit of fit-mass.py, or the starting values "
+                "of the macro with chosen yields), fit them again in parallel and report bias, pulls and coverage of the yields and shape parameters"
+  )
+  parser.add_argument('--from', dest='from_fit', default=None, help='Results of fit-mass.py (.json): the true parameters are those of a fit (see --row)')
+  parser.add_argument('--row', type=int, default=0, help='Fit of the --from file to use (default: 0, the first one)')
+  parser.add_argument('-s', '--section', default='jPsi', help='Without --from: section of the config with the mass window (default: jPsi)')
+  parser.add_argument('--yields', nargs=3, type=float, metavar=('NJPSI', 'NPSI2S', 'NBG'), default=[2000., 0., 800.],
+                      help='Without --from: true yields of J/psi, psi(2S) and background (default: 2000 0 800)')
+  parser.add_argument('--set', nargs='+', default=[], help='True value of other parameters, as name=value (e.g. sigmaL=0.08)')
+  parser.add_argument('-v', '--variant', default=None, help=f"Fit variant of the model ({', '.join(FIT_VARIANTS)}; default: the one of the --from fit, or default)")
+  parser.add_argument('--switch', nargs='+', default=[], help=f"Switches of the model, as switch=true/false ({', '.join(SWITCHES)})")
+  parser.add_argument('--fit-switch', nargs='+', default=[], help='Switches changed only in the fits of the toys (systematics of the model)')
+  parser.add_argument('-n', '--toys', type=int, default=1000, help='Number of pseudo-datasets (default: 1000)')
+  parser.add_argument('--seed', type=int, default=1234, help='Seed of the random generator (default: 1234)')
+  parser.add_argument('-b', '--bins', type=int, default=0, help='Binned toys with this number of bins in the mass window (default: 0, unbinned)')
+  parser.add_argument('--config', default=os.path.join(MASS_FITS_DIR, 'config.cfg'), help='Config with the kinematic sections (default: ../mass-fits/config.cfg)')
+  parser.add_argument('-o', '--output', default='toy-mc', help='Prefix of the results: <output>.json (summary) and <output>-toys.csv (one row per toy) (default: toy-mc)')
+  parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='Number of processes for the fits (default: number of CPUs)')
+  args = parser.parse_args()
+
+  if args.toys < 1:
+    print('Error: --toys must be at least 1.')
+    sys.exit(1)
+  try:
+    switches = parse_switches(args.switch)
+    fit_switches = parse_switches(args.fit_switch)
+  except ValueError as e:
+    print(f'Error: {e}')
+    sys.exit(1)
+
+  # true parameters: a fit of fit-mass.py, or the starting values of the macro with the given yields
+  if args.from_fit:
+    if not os.path.isfile(args.from_fit):
+      print(f"Error: '{args.from_fit}' not found.")
+      sys.exit(1)
+    with open(args.from_fit, 'r') as f:
+      rows = json.load(f)
+    if not 0 <= args.row < len(rows):
+      print(f'Error: --row {args.row} out of range, {args.from_fit} has {len(rows)} fit(s).')
+      sys.exit(1)
+    row = rows[args.row]
+    low, high = row['minMass'], row['maxMass']
+    variant = args.variant or row['variant']
+    truth = dict(row['params'])
+    print(f"True parameters from {args.from_fit}, fit {args.row}: {row['section']} {row['variant']} {row['input']} {row['class']}")
+  else:
+    sections = read_config_sections(args.config) if os.path.isfile(args.config) else {}
+    if args.section not in sections:
+      print(f"Error: section {args.section} not in {args.config}.")
+      sys.exit(1)
+    low, high = sections[args.section]['minMass'], sections[args.section]['maxMass']
+    variant = args.variant or 'default'
+    truth = {name: spec[0] for name, spec in SHAPE_PARAMS.items()}
+    truth.update(zip(['nJpsi', 'nPsi2s', 'nBg'], args.yields))
+  if variant not in FIT_VARIANTS:
+    print(f"Error: variant {variant} unknown ({', '.join(FIT_VARIANTS)}).")
+    sys.exit(1)
+  for spec in args.set:
+    name, _, value = spec.partition('=')
+    if name not in PARAMS:
+      print(f"Error: '{name}' is not a parameter of the model ({', '.join(PARAMS)}).")
+      sys.exit(1)
+    truth[name] = float(value)
+  model = MassModel(low, high, {**FIT_VARIANTS[variant], **switches})
+  # the parameters fixed by the switches take their fixed value (e.g. p2 = 0 with useExpoBkg)
+  truth.update(model.fixed())
+  fit_model = MassModel(low, high, {**model.switches, **fit_switches}) if fit_switches else None
+  edges = np.linspace(low, high, args.bins + 1) if args.bins > 0 else None
+
+  start = time.monotonic()
+  toys, results = run_toys(model, truth, args.toys, args.seed, edges, args.workers, fit_model)
+  elapsed = time.monotonic() - start
+  summary = summarize(truth, results)
+  failed = sum(r['status'] != 0 for r in results)
+  # the statistics are computed on the same fits: converged and with a positive definite covariance
+  excluded = sum(not good_fit(r) for r in results)
+  print(f"{args.toys} toy(s) in [{low}, {high}] GeV ({'binned, ' + str(args.bins) + ' bins' if edges is not None else 'unbinned'}), "
+        f"seed {args.seed}, fitted in {elapsed:.1f} s with {args.workers} process(es), {failed} failed fit(s)")
+  print(f"  {excluded} fit(s) excluded from the statistics ({failed} not converged, {excluded - failed} with a covariance "
+        f"that is not positive definite): {args.toys - excluded} used")
+  print(f"  {'parameter':<10} {'true':>10} {'mean':>10} {'bias':>10} {'pull mean':>10} {'pull width':>10} {'coverage':>9}")
+  for name, s in summary.items():
+    if s['n_fits'] == 0:
+      continue
+    print(f"  {name:<10} {s['true']:>10.4g} {s['mean']:>10.4g} {s['bias']:>10.3g} {s['pull_mean']:>10.3f} "
+          f"{s['pull_width'] if s['pull_width'] is not None else float('nan'):>10.3f} {s['coverage']:>9.1%}")
+
+  with open(f'{args.output}.json', 'w') as f:
+    json.dump({'setup': {'toys': args.toys, 'seed': args.seed, 'bins': args.bins, 'window': [low, high],
+                         'switches': model.switches, 'fit_switches': (fit_model or model).switches, 'truth': truth},
+               'failed': failed, 'excluded': excluded, 'seconds': elapsed, 'summary': summary}, f, indent=2)
+  names = list(summary)
+  with open(f'{args.output}-toys.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['toy', 'entries', 'status', 'covQual', 'nll', *names, *[f'err_{name}' for name in names]])
+    for i, r in enumerate(results):
+      writer.writerow([i, r['entries'], r['status'], r['covQual'], r['nll'], *[r['params'][n] for n in names], *[r['errors'][n] for n in names]])
+  print(f'Results in {args.output}.json and {args.output}-toys.csv')
+
+if __name__ == '__main__':
+  main()
@@ -2,6 +2,18 @@ import os
 import sys
 import argparse
 
+# metadata of the listed files
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'library'))
+from listMeta import SIDECAR_SUFFIX, load_sidecar, save_sidecar, scan_tree, walk_files
+
+
+def display_path(full_path: str) -> str:
+  """Path written in the list: if it's under your home directory, that part is replaced with '~'."""
+  home = os.path.expanduser('~')
+  if full_path.startswith(home + os.sep):
+    return full_path.replace(home, '~', 1)
+  return full_path
+
 def list_files_recursively(start_path: str, output_file: str, extension: str = None) -> int:
   """
   Walks through the directory tree from start_path, collects each file's full path
@@ -12,7 +24,6 @@ def list_files_recursively(start_path: str, output_file: str, extension: str = N
   """
   script_name = os.path.basename(__file__)
   output_name = os.path.basename(output_file)
-  home = os.path.expanduser('~')
   paths = []
 
   # Normalize extension filter
@@ -29,12 +40,7 @@ def list_files_recursively(start_path: str, output_file: str, extension: str = N
       if ext_filter and not file.endswith(ext_filter):
         continue
       full_path = os.path.abspath(os.path.join(root, file))
-      # if it's under your home directory, replace that part with '~'
-      if full_path.startswith(home + os.sep):
-        display_path = full_path.replace(home, '~', 1)
-      else:
-        display_path = full_path
-      paths.append(display_path)
+      paths.append(display_path(full_path))
 
   # Write results (or leave file empty if no matches)
   with open(output_file, 'w', encoding='utf-8') as out:
@@ -43,6 +49,41 @@ def list_files_recursively(start_path: str, output_file: str, extension: str = N
 
   return len(paths)
 
+def list_files_with_metadata(start_path: str, output_file: str, extension: str = None, workers: int = 8) -> int:
+  """
+  Same list as list_files_recursively, but the directories are scanned in parallel with os.scandir,
+  and size, mtime and inode of the listed files are written in a sidecar file next to the list
+  (output_file + '.meta.json'). Only the directories whose mtime changed since the last run are read again.
+  Returns the count of files written.
+  """
+  script_name = os.path.basename(__file__)
+  output_name = os.path.basename(output_file)
+  sidecar_name = output_name + SIDECAR_SUFFIX
+
+  ext_filter = None
+  if extension:
+    ext_filter = extension if extension.startswith('.') else f".{extension}"
+
+  start = os.path.abspath(start_path)
+  dirs, n_read = scan_tree(start, load_sidecar(output_file)['dirs'], workers)
+  print(f"Directories read: {n_read} of {len(dirs)} (the others did not change)")
+
+  files = {}
+  for full_path, stat in walk_files(dirs, start):
+    name = os.path.basename(full_path)
+    if name in (script_name, output_name, sidecar_name, sidecar_name + '.tmp'):
+      continue
+    if ext_filter and not name.endswith(ext_filter):
+      continue
+    files[display_path(full_path)] = stat
+
+  with open(output_file, 'w', encoding='utf-8') as out:
+    if files:
+      out.write("\n".join(files))
+  save_sidecar(output_file, dirs, files)
+
+  return len(files)
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='List files in a directory tree.')
   parser.add_argument(
@@ -58,6 +99,17 @@ if __name__ == '__main__':
     '--extension', '-e',
     help='Filter to only include files with this extension (e.g. root for .root files)'
   )
+  parser.add_argument(
+    '--metadata', '-m',
+    action='store_true',
+    help='Scan the directories in parallel and write size, mtime and inode of the files in a sidecar (<output-file>.meta.json), used by run-task.py; on the next runs only the changed directories are read'
+  )
+  parser.add_argument(
+    '--workers', '-w',
+    type=int,
+    default=8,
+    help='Directories scanned at the same time with --metadata (default: 8)'
+  )
   args = parser.parse_args()
 
   # Determine the folder to operate in
@@ -67,7 +119,10 @@ if __name__ == '__main__':
 
   print(f"Scanning files under: {start}")
   try:
-    total = list_files_recursively(start, output_path, args.extension)
+    if args.metadata:
+      total = list_files_with_metadata(start, output_path, args.extension, args.workers)
+    else:
+      total = list_files_recursively(start, output_path, args.extension)
     if args.extension and total == 0:
       print(f"No {args.extension} files here!")
     else: